@@ -16,13 +16,15 @@ from glu.components.gsearch_component      import GsearchComponent
 from glu.components.combiner_component     import CombinerComponent
 from glu.components.gpswalker_component    import GpsWalkerComponent
 from glu.components.storage_component      import StorageComponent
+from glu.components.counter_component      import CounterComponent
 #from glu.components.salesforce_component   import SalesforceComponent
 #from glu.components.marakana_component     import MarakanaComponent
 
 #
 # The known components
 #
-_KNOWN_COMPONENTS = [ TwitterComponent, GsearchComponent, CombinerComponent, GpsWalkerComponent, StorageComponent ]
+_KNOWN_COMPONENTS = [ TwitterComponent, GsearchComponent, CombinerComponent, GpsWalkerComponent, StorageComponent,
+                      CounterComponent ]
 # SalesforceComponent, MarakanaComponent ]
 
 # -------------------------------------------------------------------------------------
@@ -4,14 +4,34 @@ Defines a base class for all components.
 """
 # Python imports
 import urllib, urllib2
+import threading
 from copy import deepcopy
 
 #Glu imports
 import glu.settings as settings
 
 from glu.core.util                       import Url 
+from glu.exceptions                      import GluBadRequest
 from glu.core.parameter                  import *
-from glu.storageabstraction.file_storage import FileStorage
+from glu.platform_specifics              import STORAGE_CLASS, DATA_STORAGE_LOCATION, PLATFORM, PLATFORM_GAE
+
+from glu.storageabstraction.dedup_storage        import DedupStorage, BLOB_NAMESPACE
+from glu.storageabstraction.caching_storage      import CachingStorage
+from glu.storageabstraction.write_behind_storage import WriteBehindStorage
+from glu.storageabstraction.expiring_storage     import ExpiringStorage
+from glu.storageabstraction.change_feed_storage  import ChangeFeedStorage
+
+#
+# Entries of a service definition that tell the framework how to call the
+# service (see glu.resources.service_cache and glu.resources.single_flight).
+# They are not part of the published service information.
+#
+_SERVICE_CALL_OPTIONS = [ "cache", "coalesce" ]
+
+#
+# Limits the requests that wait for changes, since each of them holds a server thread.
+#
+_change_waiters = threading.Semaphore(settings.STORAGE_CHANGES_MAX_WAITERS)
 
 #
 # Utility method.
@@ -82,21 +102,54 @@ class BaseComponent(object):
     def getMyResourceUri(self):
         return "%s/%s" % (settings.PREFIX_RESOURCE, self.getMyResourceName())
 
-    def getFileStorage(self, namespace=""):
+    def getFileStorage(self, namespace="", write_behind=False, sync=False, cache=False, expiry=False, ttl=None, changes=False):
         """
-        Return a FileStorage object, which can be used to store data.
+        Return a storage object, which can be used to store data.
+
+        The class of the storage object is selected in platform_specifics.
+        If settings.STORAGE_DEDUP is set, identical contents are stored only
+        once, across all resources.
 
         Storage spaces for each resource are separated by resource name,
         this means that two resources cannot share their stored objects,
         even if they are of the same type.
 
-        @param namespace:   A namespace that is used by this resource.
-                            Per invocation a resource may chose to create
-                            yet another resource namespace under (or within)
-                            its inherent namespace.
-        @type namespace:    string
+        @param namespace:     A namespace that is used by this resource.
+                              Per invocation a resource may chose to create
+                              yet another resource namespace under (or within)
+                              its inherent namespace.
+        @type namespace:      string
+
+        @param write_behind:  If set, writes are queued and written in the
+                              background (see glu.storageabstraction.write_behind_storage).
+                              Ignored on Google App Engine, which does not allow
+                              background threads.
+        @type write_behind:   boolean
+
+        @param sync:          If set together with write_behind, each batch of
+                              writes is synced to disk.
+        @type sync:           boolean
+
+        @param cache:         If set, files read from this namespace are kept in
+                              the in-memory storage cache (see
+                              glu.storageabstraction.caching_storage).
+        @type cache:          boolean
 
-        @return:            FileStorage object.
+        @param expiry:        If set, files in this namespace can expire (see
+                              glu.storageabstraction.expiring_storage). Expired
+                              files are hidden and deleted in the background.
+        @type expiry:         boolean
+
+        @param ttl:           Number of seconds after which files stored through
+                              the returned object expire. Implies 'expiry'.
+        @type ttl:            number
+
+        @param changes:       If set, the changes to this namespace are recorded
+                              in a change feed (see getChangeListing() and
+                              glu.storageabstraction.change_feed_storage).
+        @type changes:        boolean
+
+        @return:              Storage object (derived from BaseStorage).
 
         """
         my_resource_name = self.getMyResourceName()
@@ -105,12 +158,143 @@ class BaseComponent(object):
                 unique_namespace = "%s__%s" % (self.getMyResourceName(), namespace)
             else:
                 unique_namespace = self.getMyResourceName()
-            storage = FileStorage(storage_location="storageDB", unique_prefix=unique_namespace)
+            storage = STORAGE_CLASS(storage_location=DATA_STORAGE_LOCATION, unique_prefix=unique_namespace)
+            if settings.STORAGE_DEDUP:
+                # The blobs of all resources are kept in one reserved namespace
+                storage = DedupStorage(storage, STORAGE_CLASS(storage_location=DATA_STORAGE_LOCATION,
+                                                              unique_prefix=BLOB_NAMESPACE))
+            unique_name = "%s/%s" % (DATA_STORAGE_LOCATION, unique_namespace)
+            if cache:
+                storage = CachingStorage(storage, unique_name)
+            if write_behind  and  PLATFORM != PLATFORM_GAE:
+                storage = WriteBehindStorage(storage, unique_name, sync)
+            if changes:
+                # Below the expiry, so that the deletion of expired files is recorded
+                storage = ChangeFeedStorage(storage, unique_name)
+            if expiry  or  ttl is not None:
+                storage = ExpiringStorage(storage, unique_name, ttl)
             return storage
         else:
             # Cannot get storage object when I am not running as a resource
             return None
-    
+
+    def getFileListing(self, storage, service_name, params):
+        """
+        Return the URIs of the files in a storage object.
+
+        The optional 'prefix', 'limit' and 'cursor' parameters are taken from
+        the runtime parameters of the service. If a limit or cursor was given
+        then the result is a page of URIs and - if there are more files - the
+        URI of the next page. Otherwise, the plain list of all URIs is returned.
+
+        @param storage:       The storage object.
+        @type storage:        BaseStorage
+
+        @param service_name:  Name of the service, under which the files are exposed.
+        @type service_name:   string
+
+        @param params:        Dictionary of parameter values.
+        @type params:         dict
+
+        @return:              List of URIs or dictionary with 'files' and 'next'.
+        @rtype:               list or dict
+
+        """
+        prefix = params.get('prefix') or None
+        limit  = params.get('limit')
+        cursor = params.get('cursor') or None
+        if limit is not None:
+            if limit != int(limit)  or  limit < 1:
+                raise GluBadRequest("Parameter 'limit' must be a positive integer")
+            limit = int(limit)
+        # Query string parameters arrive without URL decoding
+        if prefix:
+            prefix = urllib.unquote(prefix)
+        if cursor:
+            cursor = urllib.unquote(cursor)
+
+        names = storage.listFiles(prefix=prefix, limit=limit, cursor=cursor)
+
+        # We want to prepend the resource name and service name, so that the user
+        # gets complete URIs for each file
+        service_uri = "%s/%s" % (self.getMyResourceUri(), service_name)
+        uris        = [ "%s/%s" % (service_uri, urllib.quote(name)) for name in names ]
+        if limit is None  and  cursor is None:
+            return uris
+
+        next_uri = None
+        if names.next_cursor is not None:
+            query = [ "cursor=%s" % urllib.quote(names.next_cursor, safe="") ]
+            if limit is not None:
+                query.insert(0, "limit=%d" % limit)
+            if prefix:
+                query.insert(0, "prefix=%s" % urllib.quote(prefix, safe=""))
+            next_uri = Url("%s?%s" % (service_uri, "&".join(query)))
+        return dict(files=uris, next=next_uri)
+
+    def getChangeListing(self, storage, service_name, params):
+        """
+        Return the changes to the files in a storage object since a cursor.
+
+        The optional 'since', 'limit' and 'wait' parameters are taken from the
+        runtime parameters of the service. Without 'since', no changes are
+        returned, only the cursor to start from. With 'wait', the request is
+        held for up to that many seconds (at most settings.STORAGE_CHANGES_MAX_WAIT),
+        until there is a change. The request is answered right away if too many
+        requests are waiting already (settings.STORAGE_CHANGES_MAX_WAITERS) or
+        on GAE, where the write it waits for could not be served meanwhile.
+
+        If 'reset' is set in the result, the changes since the cursor are not
+        known anymore. The client has to list the files again and continue with
+        the returned cursor.
+
+        @param storage:       The storage object, which needs to have been
+                              created with a change feed.
+        @type storage:        ChangeFeedStorage
+
+        @param service_name:  Name of the service, under which the files are exposed.
+        @type service_name:   string
+
+        @param params:        Dictionary of parameter values.
+        @type params:         dict
+
+        @return:              Dictionary with 'changes', 'cursor', 'next' and 'reset'.
+        @rtype:               dict
+
+        """
+        since = params.get('since') or None
+        limit = params.get('limit')
+        wait  = params.get('wait') or 0
+        if limit is not None:
+            if limit != int(limit)  or  limit < 1:
+                raise GluBadRequest("Parameter 'limit' must be a positive integer")
+            limit = int(limit)
+        if wait < 0:
+            raise GluBadRequest("Parameter 'wait' must not be negative")
+        # Query string parameters arrive without URL decoding
+        if since:
+            since = urllib.unquote(since)
+
+        wait = min(wait, settings.STORAGE_CHANGES_MAX_WAIT)
+        if PLATFORM == PLATFORM_GAE:
+            wait = 0
+        if wait  and  _change_waiters.acquire(False):
+            try:
+                changes, cursor, reset = storage.getChanges(since, limit, wait)
+            finally:
+                _change_waiters.release()
+        else:
+            changes, cursor, reset = storage.getChanges(since, limit, 0)
+
+        service_uri = "%s/%s" % (self.getMyResourceUri(), service_name)
+        changes     = [ dict(seq=seq, change=change, uri=Url("%s/%s" % (service_uri, urllib.quote(name))))
+                        for seq, change, name in changes ]
+        query       = "since=%s" % urllib.quote(cursor, safe="")
+        if limit is not None:
+            query = "limit=%d&%s" % (limit, query)
+        next_uri    = Url("%s/changes?%s" % (self.getMyResourceUri(), query))
+        return dict(changes=changes, cursor=cursor, next=next_uri, reset=reset)
+
     def __get_http_opener(self, url):
         """
         Return an HTTP handler class, with credentials enabled if specified.
@@ -323,6 +507,8 @@ class BaseComponent(object):
             ret = dict()
             for name in self.SERVICES.keys():
                 ret[name]  = deepcopy(self.SERVICES[name])  # That's a dictionary with params definitions and descs
+                for option in _SERVICE_CALL_OPTIONS:
+                    ret[name].pop(option, None)
                 # Create proper dict representations of each parameter definition
                 if 'params' in ret[name]:
                     for pname in ret[name]['params'].keys():
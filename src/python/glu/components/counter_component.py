@@ -0,0 +1,76 @@
+"""
+A test component.
+
+"""
+# Python imports
+import threading
+
+# Glu imports
+from glu.components.api import *
+
+class CounterComponent(BaseComponent):
+    NAME             = "CounterComponent"
+    PARAM_DEFINITION = {
+                       }
+
+    DESCRIPTION      = "Counts how often its services are called."
+    DOCUMENTATION    =  """
+                        Counts how often its services are called.
+
+                        The exposed 'count' service returns the number of times it
+                        was called for the given name. Its results are cached: For
+                        the same name, GET requests get the same count for a second,
+                        and an outdated count is returned for up to a minute while
+                        it is refreshed. Any other request method removes the cached
+                        counts. Identical GET requests that arrive at the same time
+                        share one call.
+
+                        """
+    SERVICES         = {
+                           "count" :   {
+                               "desc"     : "Provide a 'name' to GET the number of calls for that name.",
+                               "params"   : {
+                                    "name"       : ParameterDef(PARAM_STRING, "Name of the counter", required=True),
+                               },
+                               "cache"    : { "ttl" : 1, "stale" : 60 },
+                               "coalesce" : True
+                           }
+                       }
+
+    # The counters are kept by the class, since a new instance
+    # of the component is created for every request.
+    __counters = dict()
+    __lock     = threading.Lock()
+
+    def count(self, request, input, params, method):
+        """
+        Count a call for the given name.
+
+        @param request:    Information about the HTTP request.
+        @type request:     BaseHttpRequest
+
+        @param input:      Any data that came in the body of the request.
+        @type input:       string
+
+        @param params:     Dictionary of parameter values.
+        @type params:      dict
+
+        @param method:     The HTTP request method.
+        @type method:      string
+
+        @return:           Return dictionary with 'name' and 'count' keys.
+        @rtype:            dict
+
+        """
+        name = params['name']
+        CounterComponent.__lock.acquire()
+        try:
+            count = CounterComponent.__counters.get(name, 0) + 1
+            CounterComponent.__counters[name] = count
+        finally:
+            CounterComponent.__lock.release()
+        data = {
+                    "name"  : name,
+                    "count" : count,
+               }
+        return 200, data
@@ -31,7 +31,10 @@ class GsearchComponent(BaseComponent):
                                     "num"   : ParameterDef(PARAM_NUMBER, "The number of results you would like to have returned",
                                                            required=False,
                                                            default=10)
-                               }
+                               },
+                               # Search results don't change from one minute to the next
+                               "cache"    : { "ttl" : 300, "stale" : 60 },
+                               "coalesce" : True
                            }
                        }
     
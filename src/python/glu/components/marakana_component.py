@@ -25,17 +25,31 @@ class MarakanaComponent(BaseComponent):
 
                         A brief sanity check is performed.
 
+                        To find new orders without listing all orders again, follow the 'changes'
+                        sub-resource (see BaseComponent.getChangeListing()).
+
                         """
     SERVICES         = {
                            "orders" :   {
                                "desc"   : "Accepts POSTed new orders and allows the browsing and retrieval of existing orders.",
                                "params" : {
-                                    "id" : ParameterDef(PARAM_STRING, "Order id", required=False, default=""),
+                                    "id"     : ParameterDef(PARAM_STRING, "Order id", required=False, default=""),
+                                    "prefix" : ParameterDef(PARAM_STRING, "Only list order ids starting with this prefix", required=False),
+                                    "limit"  : ParameterDef(PARAM_NUMBER, "Maximum number of orders in a listing", required=False),
+                                    "cursor" : ParameterDef(PARAM_STRING, "Continuation cursor for the next page of a listing", required=False),
                                },
                                "positional_params" : [ "id" ]
                            },
                            "matches" :   {
                                "desc"   : "Calculates the matches between order data and salesforce data.",
+                           },
+                           "changes" :   {
+                               "desc"   : "Returns the orders that were stored or deleted since a cursor.",
+                               "params" : {
+                                    "since"  : ParameterDef(PARAM_STRING, "Cursor returned with the previous changes", required=False),
+                                    "limit"  : ParameterDef(PARAM_NUMBER, "Maximum number of changes to return", required=False),
+                                    "wait"   : ParameterDef(PARAM_NUMBER, "Seconds to wait for a change, if there is none yet", required=False),
+                               }
                            }
                         }
 
@@ -104,20 +118,16 @@ class MarakanaComponent(BaseComponent):
         }
     }
     
-    def __get_order_list(self, storage):
+    def __get_order_list(self, storage, params):
         """
         Helper function that returns a list of URIs for stored orders.
 
+        The list may be filtered by prefix and paged (see BaseComponent.getFileListing()).
+
         """
         # User didn't specify a specific order (and also doesn't POST a new order object),
         # which means we should generate a list of all the orders we have stored.
-        data = storage.listFiles()
-
-        # We want to prepend the resource name and service name, so that the user
-        # gets complete URIs for each file
-        my_resource_uri = self.getMyResourceUri()
-        new_data = [ "%s/%s/%s" % (my_resource_uri, "orders", name) for name in data ]
-        return new_data
+        return self.getFileListing(storage, "orders", params)
 
     def __xml_to_dict_process(self, el):
         """
@@ -221,8 +231,9 @@ class MarakanaComponent(BaseComponent):
         @rtype:            string
         
         """
-        # Access to our storage bucket
-        storage   = self.getFileStorage()
+        # Access to our storage bucket. Cached like in matches(), so that
+        # new orders are removed from the cache right away.
+        storage   = self.getFileStorage(cache=True, changes=True)
 
         # Get my parameters
         param_order_id = params.get('id')
@@ -230,7 +241,7 @@ class MarakanaComponent(BaseComponent):
         if not param_order_id  and  not input:
             # User didn't specify a specific order (and also doesn't POST a new order object),
             # which means we should generate a list of all the orders we have stored.
-            data = self.__get_order_list(storage)
+            data = self.__get_order_list(storage, params)
         else:
             if method == "DELETE":
                 if param_order_id:
@@ -287,7 +298,8 @@ class MarakanaComponent(BaseComponent):
 
 
     def matches(self, request, input, params, method):
-        storage    = self.getFileStorage()
+        # All orders are read on every call, so keep them in memory
+        storage    = self.getFileStorage(cache=True, changes=True)
         order_list = storage.listFiles()
 
         salesforce_resource_uri = params['salesforce_resource']
@@ -343,3 +355,27 @@ class MarakanaComponent(BaseComponent):
         return 200, out
 
 
+
+    def changes(self, request, input, params, method):
+        """
+        Return the orders that were stored or deleted since a cursor.
+
+        @param request:    Information about the HTTP request.
+        @type request:     BaseHttpRequest
+
+        @param input:      Any data that came in the body of the request.
+        @type input:       string
+
+        @param params:     Dictionary of parameter values.
+        @type params:      dict
+
+        @param method:     The HTTP request method.
+        @type method:      string
+
+        @return:           The changes, the cursor to continue with and the
+                           URI of the next changes (see BaseComponent.getChangeListing()).
+        @rtype:            dict
+
+        """
+        storage = self.getFileStorage(cache=True, changes=True)
+        return 200, self.getChangeListing(storage, "orders", params)
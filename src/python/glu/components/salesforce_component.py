@@ -75,7 +75,9 @@ class SalesforceComponent(BaseComponent):
                             "contact" : {
                                 "desc"              : "Return or update information about contacts",
                                 "params"            : _all_tables_params,
-                                "positional_params" : _all_positional_params
+                                "positional_params" : _all_positional_params,
+                                "cache"             : { "ttl" : 300, "stale" : 60 },
+                                "coalesce"          : True
                             },
                             "lead" : {
                                 "desc"              : "Return or update information about leads",
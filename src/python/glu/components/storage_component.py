@@ -3,15 +3,33 @@ A storage component.
 
 """
 # Python imports
+import time
+import uuid
 import urllib
+import hashlib
+import tarfile
 import glujson as json
 
+from email.utils import formatdate, parsedate_tz, mktime_tz
+
 # Glu imports
-from glu.components.api import *
+from glu.components.api     import *
+from glu.core.util          import Url, StreamedBody, selectRange
+from glu.exceptions         import *
+from glu.platform_specifics import PLATFORM, PLATFORM_GAE
 
 class StorageComponent(BaseComponent):
     NAME             = "StorageComponent"
     
+    PARAM_DEFINITION = {
+                           "write_behind" : ParameterDef(PARAM_BOOL, "Acknowledge writes once they are queued, and write them in the background (ignored on Google App Engine)",
+                                                         required=False, default=False),
+                           "sync"         : ParameterDef(PARAM_BOOL, "Sync written data to disk (with write_behind: once per batch of writes)",
+                                                         required=False, default=False),
+                           "default_ttl"  : ParameterDef(PARAM_NUMBER, "Seconds after which stored items expire, unless a 'ttl' is given when storing",
+                                                         required=False),
+                       }
+
     DESCRIPTION      = "Allows the storage of arbitrary data in independent name spaces / buckets"
     DOCUMENTATION    =  """
                         This component is used to store information in arbitrary name spaces (or buckets).
@@ -22,20 +40,161 @@ class StorageComponent(BaseComponent):
                         Subsequently, the .../resourcename/files?name=<name> sub-resource is used to PUT or GET data
                         into the storage bucket.
 
+                        Without a name, the list of stored files is returned. Use the 'prefix' parameter to
+                        only list names starting with that prefix. If 'limit' is specified, the list is returned
+                        page by page. Each page contains the URI of the next page.
+
                         'name' is also allowed as a positional parameter. This means you can access the same
                         file like this: .../resourcename/files/<name>
 
+                        Names are URL-decoded, and those starting with '.' are reserved.
+
+                        Note that names given with the 'name' query parameter used to be taken as they were
+                        sent, without URL-decoding them. An item stored like that, with an escape sequence
+                        in its name (such as 'a%20b'), can now only be reached by escaping its name once more
+                        ('a%2520b').
+
+                        An item is returned as a string and rendered like the results of other
+                        services (as JSON or HTML). Send an 'Accept: application/octet-stream' header
+                        to receive the raw content instead, which is sent straight from storage.
+
+                        Items are returned with an 'ETag' and (where the storage records it) a 'Last-Modified'
+                        header. Send those back as 'If-None-Match' or 'If-Modified-Since' to receive a
+                        '304 Not Modified' without the content, if the item was not changed in the meantime.
+
+                        A part of the raw content of an item can be requested with a 'Range' header (a single
+                        byte range, for example 'bytes=1000-' or 'bytes=-500'), which is answered with
+                        '206 Partial Content'. Combine it with 'If-Range' to resume a download only if the
+                        item is unchanged.
+
+                        To add data to the end of a stored item, rather than replacing it, POST or PUT
+                        with the 'append' parameter: .../resourcename/files/<name>?append=true
+
+                        Large items can be uploaded in parts, through the .../resourcename/uploads
+                        sub-resource:
+
+                            POST   .../uploads?name=<name>          Start an upload. Returns the URI of
+                                                                    the new upload.
+                            PUT    .../uploads/<id>/<part>          Upload part number <part> (starting
+                                                                    at 1). Parts may be uploaded in any
+                                                                    order, in parallel and more than once.
+                            GET    .../uploads/<id>                 List the parts received so far.
+                            POST   .../uploads/<id>?commit=true     Store the parts, in order, as <name>.
+                            DELETE .../uploads/<id>                 Abandon the upload.
+
+                        All items of the bucket (or those starting with a prefix) can be downloaded
+                        in a single request as a tar archive: .../resourcename/archive?prefix=<prefix>
+
+                        Durability is chosen per resource, when it is created:
+
+                            write_behind=false, sync=false  A write is done when the data was handed
+                                                            to the operating system (default).
+                            write_behind=false, sync=true   A write is done when the data is on disk.
+                            write_behind=true,  sync=false  A write is done when it was queued in memory.
+                                                            Queued writes are lost if the server dies.
+                            write_behind=true,  sync=true   As above, but each batch of queued writes
+                                                            is synced to disk.
+
+                        With write_behind, reads see queued writes right away. POST to
+                        .../resourcename/flush to wait until all writes so far have been written.
+                        A queued write that fails stays queued and is tried again. On Google App
+                        Engine, write_behind is ignored, since background threads are not allowed.
+
+                        Items can expire: Store them with a 'ttl' (in seconds), or create the resource
+                        with a 'default_ttl' for all items stored without one. Storing an item starts its
+                        time to live anew, while appending keeps it (unless a 'ttl' is given). Expired items
+                        are gone from reads and listings right away and are deleted in the background.
+
+                        Instead of listing the items over and over, clients can follow the changes to the
+                        bucket: .../resourcename/changes returns the current cursor. Pass it back as 'since'
+                        to get the changes after it, with a new cursor. With 'wait', the request waits up to
+                        that many seconds for the next change (long-polling). It may return without changes
+                        earlier, if the server cannot let more requests wait. If the result has 'reset' set,
+                        the changes since the cursor are not known anymore (for example after a restart of
+                        the server), and the client needs to list the items again.
+
                         """
     SERVICES         = {
                            "files" :   {
                                "desc"   : "Provide the name of the storaged item as parameter and use 'PUT' or 'GET'.",
                                "params" : {
-                                    "name" : ParameterDef(PARAM_STRING, "Name of the stored data item", required=False),
+                                    "name"   : ParameterDef(PARAM_STRING, "Name of the stored data item", required=False),
+                                    "prefix" : ParameterDef(PARAM_STRING, "Only list names starting with this prefix", required=False),
+                                    "limit"  : ParameterDef(PARAM_NUMBER, "Maximum number of names in a listing", required=False),
+                                    "cursor" : ParameterDef(PARAM_STRING, "Continuation cursor for the next page of a listing", required=False),
+                                    "append" : ParameterDef(PARAM_BOOL, "Append the request body to the stored data item", required=False, default=False),
+                                    "ttl"    : ParameterDef(PARAM_NUMBER, "Seconds after which the stored data item expires", required=False),
+                               },
+                               "positional_params" : [ "name" ],
+                               "stream_input"      : True,
+                               # Answers depend on the request headers (ETags, ranges)
+                               "coalesce"          : False
+                           },
+                           "uploads" : {
+                               "desc"   : "Upload large items in parts. POST with a name to start an upload.",
+                               "params" : {
+                                    "id"     : ParameterDef(PARAM_STRING, "Id of the upload", required=False),
+                                    "part"   : ParameterDef(PARAM_NUMBER, "Number of the uploaded part, starting at 1", required=False),
+                                    "name"   : ParameterDef(PARAM_STRING, "Name under which the item is stored", required=False),
+                                    "commit" : ParameterDef(PARAM_BOOL, "Store the uploaded parts as the item", required=False, default=False),
+                               },
+                               "positional_params" : [ "id", "part" ],
+                               "stream_input"      : True
+                           },
+                           "archive" : {
+                               "desc"   : "Download the stored items as a tar archive.",
+                               "params" : {
+                                    "prefix" : ParameterDef(PARAM_STRING, "Only include names starting with this prefix", required=False),
                                },
-                               "positional_params" : [ "name" ]
+                               # The archive is streamed, so it cannot be shared
+                               "coalesce" : False
+                           },
+                           "flush" : {
+                               "desc"   : "POST to wait until all queued writes have been written (with write_behind).",
+                           },
+                           "changes" : {
+                               "desc"   : "Returns the items that were stored, appended to or deleted since a cursor.",
+                               "params" : {
+                                    "since"  : ParameterDef(PARAM_STRING, "Cursor returned with the previous changes", required=False),
+                                    "limit"  : ParameterDef(PARAM_NUMBER, "Maximum number of changes to return", required=False),
+                                    "wait"   : ParameterDef(PARAM_NUMBER, "Seconds to wait for a change, if there is none yet", required=False),
+                               },
+                               # The changes may be stored while a request waits for them
+                               "coalesce" : False
                            }
                        }
-    
+
+    #
+    # The parts of an upload are staged in the namespace of the bucket under
+    # reserved names (starting with '.'), which are never listed. The manifest
+    # of an upload holds the name of the item on its first line, followed by
+    # the number of each part as it is received.
+    #
+    __UPLOAD_MANIFEST = ".upload.%s"
+    __UPLOAD_PART     = ".upload.%s.%06d"
+
+    def __get_storage(self, params):
+        """
+        Return the storage of the bucket, set up for the durability of this resource.
+
+        """
+        ttl = params.get('ttl')
+        if ttl is None:
+            ttl = params.get('default_ttl')
+        if ttl is not None  and  ttl <= 0:
+            raise GluBadRequest("The time to live must be a positive number of seconds")
+        return self.getFileStorage(write_behind=_writeBehind(params), sync=params.get('sync'),
+                                   expiry=True, ttl=ttl, changes=True)
+
+    def __sync(self, storage, params, name):
+        """
+        Sync a written item, if that was requested without write-behind.
+
+        With write-behind, the batches are synced by the queue.
+
+        """
+        if params.get('sync')  and  not _writeBehind(params):
+            storage.syncFiles([ name ])
             
     def files(self, request, input, params, method):
         """
@@ -44,8 +203,9 @@ class StorageComponent(BaseComponent):
         @param request:    Information about the HTTP request.
         @type request:     BaseHttpRequest
         
-        @param input:      Any data that came in the body of the request.
-        @type input:       string
+        @param input:      Any data that came in the body of the request. When
+                           called via HTTP, this is a stream of the body.
+        @type input:       string or file-like object
         
         @param params:     Dictionary of parameter values.
         @type params:      dict
@@ -53,35 +213,473 @@ class StorageComponent(BaseComponent):
         @param method:     The HTTP request method.
         @type method:      string
         
-        @return:           The output data of this service.
-        @rtype:            string
+        @return:           The output data of this service. The contents
+                           of a file are returned as a StreamedBody, if
+                           the client asked for the raw content.
+        @rtype:            string, list or StreamedBody
         
         """
         # Access to our storage bucket
-        storage   = self.getFileStorage()
+        storage   = self.__get_storage(params)
 
         # Get my parameters
-        data_name = params.get('name')
+        data_name = _itemName(request, params)
         if not data_name:
             # User didn't specify a specific file, which means we should generate
             # a list of all the files in that namespace.
-            data = storage.listFiles()
-
-            # We want to prepend the resource name and service name, so that the user
-            # gets complete URIs for each file
-            my_resource_uri = self.getMyResourceUri()
-            new_data = [ "%s/%s/%s" % (my_resource_uri, "files", name) for name in data ]
-            data = new_data
+            data = self.getFileListing(storage, "files", params)
         else:
             if method == "DELETE":
                 storage.deleteFile(data_name)
                 data = "File deleted"
             else:
-                if input:
-                    storage.storeFile(data_name, input)
+                if input  and  params.get('append'):
+                    if type(input) not in [ str, unicode ]:
+                        # Appended records are small, no need to stream them
+                        input = input.read()
+                    storage.appendFile(data_name, input)
+                    self.__sync(storage, params, data_name)
+                    data = "Successfully appended"
+                elif input:
+                    if type(input) in [ str, unicode ]:
+                        storage.storeFile(data_name, input)
+                    else:
+                        # Request body stream: Copied into storage piece by piece
+                        storage.storeStream(data_name, input)
+                    self.__sync(storage, params, data_name)
                     data = "Successfully stored"
                 else:
+                    if request:
+                        etag, mtime = self.__set_validators(request, storage, data_name)
+                        if etag  and  _isNotModified(request, etag, mtime):
+                            return 304, ""
+                        if _wantsRawContent(request):
+                            # Send the file in chunks, straight from storage.
+                            data = storage.openFile(data_name)
+                            validators = [ etag ]
+                            if mtime is not None:
+                                validators.append(formatdate(mtime, usegmt=True))
+                            return selectRange(request, data, validators)
                     data = storage.loadFile(data_name)
 
         return 200, data
 
+
+    def __set_validators(self, request, storage, name):
+        """
+        Set the validator headers of an item.
+
+        Only the version of the item is looked up, the item itself is not read.
+
+        @return:    Tuple of the entity tag and the modification time, either
+                    of which may be None if not known.
+        @rtype:     tuple
+
+        """
+        version = storage.getFileVersion(name)
+        if version is None:
+            # Does not exist: Reading it will fail properly
+            return None, None
+        etag  = _makeETag(version)
+        mtime = storage.getFileModificationTime(name)
+        request.setResponseHeader("ETag", etag)
+        # The item is rendered or sent as it is, depending on the client
+        request.setResponseHeader("Vary", "Accept")
+        if mtime is not None:
+            request.setResponseHeader("Last-Modified", formatdate(mtime, usegmt=True))
+        return etag, mtime
+
+    def __read_manifest(self, storage, upload_id):
+        """
+        Return the item name and the sorted part numbers of an upload.
+
+        """
+        lines = storage.loadFile(self.__UPLOAD_MANIFEST % upload_id).split("\n")
+        parts = list(set([ int(line) for line in lines[1:] if line ]))
+        parts.sort()
+        return lines[0], parts
+
+    def __remove_upload(self, storage, upload_id, parts):
+        """
+        Delete the staged parts and the manifest of an upload.
+
+        """
+        for part in parts:
+            try:
+                storage.deleteFile(self.__UPLOAD_PART % (upload_id, part))
+            except GluFileNotFound:
+                pass
+        storage.deleteFile(self.__UPLOAD_MANIFEST % upload_id)
+
+    def uploads(self, request, input, params, method):
+        """
+        Upload a large item in parts.
+
+        @param request:    Information about the HTTP request.
+        @type request:     BaseHttpRequest
+        
+        @param input:      Any data that came in the body of the request. When
+                           called via HTTP, this is a stream of the body.
+        @type input:       string or file-like object
+        
+        @param params:     Dictionary of parameter values.
+        @type params:      dict
+        
+        @param method:     The HTTP request method.
+        @type method:      string
+        
+        @return:           The output data of this service.
+        @rtype:            string or dict
+        
+        """
+        storage     = self.__get_storage(params)
+        uploads_uri = "%s/%s" % (self.getMyResourceUri(), "uploads")
+
+        upload_id = params.get('id')
+        part      = params.get('part')
+        if not upload_id:
+            # Start a new upload
+            if method != "POST":
+                return 405, "Use POST with a 'name' parameter to start an upload"
+            name = _itemName(request, params)
+            if not name:
+                return 400, "Missing 'name' parameter"
+            upload_id = uuid.uuid4().hex
+            storage.storeFile(self.__UPLOAD_MANIFEST % upload_id, name + "\n")
+            location_str = "%s/%s" % (uploads_uri, upload_id)
+            if request:
+                request.setResponseHeader("Location", location_str)
+            return 201, { "upload" : Url(location_str) }
+
+        if not upload_id.isalnum():
+            return 404, "Unknown upload"
+        try:
+            name, parts = self.__read_manifest(storage, upload_id)
+        except GluFileNotFound:
+            return 404, "Unknown upload"
+
+        if part is not None:
+            # Store one part
+            if method not in [ "PUT", "POST" ]:
+                return 405, "Parts can only be uploaded"
+            if part != int(part)  or  part < 1:
+                return 400, "Part numbers are integers, starting at 1"
+            part      = int(part)
+            part_name = self.__UPLOAD_PART % (upload_id, part)
+            if input is None:
+                # Direct call without data: An empty part
+                input = ""
+            if type(input) in [ str, unicode ]:
+                storage.storeFile(part_name, input)
+            else:
+                storage.storeStream(part_name, input)
+            storage.appendFile(self.__UPLOAD_MANIFEST % upload_id, "%d\n" % part)
+            return 200, "Part %d stored" % part
+
+        if method == "DELETE":
+            self.__remove_upload(storage, upload_id, parts)
+            return 200, "Upload deleted"
+
+        if method == "POST"  and  params.get('commit'):
+            if parts != range(1, len(parts) + 1):
+                return 400, "Cannot commit, parts are missing. Received: %s" % parts
+            storage.storeStream(name, _PartsReader(storage, [ self.__UPLOAD_PART % (upload_id, p) for p in parts ]))
+            self.__sync(storage, params, name)
+            self.__remove_upload(storage, upload_id, parts)
+            return 200, { "stored" : Url("%s/%s/%s" % (self.getMyResourceUri(), "files", name)), "parts" : len(parts) }
+
+        # Report the state of the upload, so that a client can resume it
+        return 200, { "name" : name, "parts" : parts }
+
+    def archive(self, request, input, params, method):
+        """
+        Return the stored items as a tar archive.
+
+        The archive is produced while it is sent: Names are listed page by
+        page and the items are read one after the other. Neither the list
+        of names nor the archive is ever held in memory completely.
+
+        @param request:    Information about the HTTP request.
+        @type request:     BaseHttpRequest
+        
+        @param input:      Any data that came in the body of the request.
+        @type input:       string
+        
+        @param params:     Dictionary of parameter values.
+        @type params:      dict
+        
+        @param method:     The HTTP request method.
+        @type method:      string
+        
+        @return:           The archive.
+        @rtype:            StreamedBody or string
+        
+        """
+        if method != "GET":
+            return 405, "Only GET is supported"
+        prefix = params.get('prefix')
+        if prefix:
+            prefix = urllib.unquote(prefix)
+        body = StreamedBody(_tar_chunks(self.__get_storage(params), prefix), None, content_type="application/x-tar")
+        if request:
+            return 200, body
+        else:
+            return 200, body.read()
+
+    def changes(self, request, input, params, method):
+        """
+        Return the changes to the items of the bucket since a cursor.
+
+        @param request:    Information about the HTTP request.
+        @type request:     BaseHttpRequest
+
+        @param input:      Any data that came in the body of the request.
+        @type input:       string
+
+        @param params:     Dictionary of parameter values.
+        @type params:      dict
+
+        @param method:     The HTTP request method.
+        @type method:      string
+
+        @return:           The changes, the cursor to continue with and the
+                           URI of the next changes (see BaseComponent.getChangeListing()).
+        @rtype:            dict
+
+        """
+        if method != "GET":
+            return 405, "Only GET is supported"
+        # The feed itself, without the layers on top of it
+        storage = self.getFileStorage(write_behind=_writeBehind(params), changes=True)
+        return 200, self.getChangeListing(storage, "files", params)
+
+    def flush(self, request, input, params, method):
+        """
+        Wait until all queued writes of the bucket have been written.
+
+        @param request:    Information about the HTTP request.
+        @type request:     BaseHttpRequest
+        
+        @param input:      Any data that came in the body of the request.
+        @type input:       string
+        
+        @param params:     Dictionary of parameter values.
+        @type params:      dict
+        
+        @param method:     The HTTP request method.
+        @type method:      string
+        
+        @return:           The state of the write queue after the flush.
+        @rtype:            dict
+        
+        """
+        if method != "POST":
+            return 405, "Use POST to flush the queued writes"
+        if not _writeBehind(params):
+            # Nothing is ever queued
+            return 200, { "pending" : 0 }
+        # The queue itself, without the layers on top of it
+        storage = self.getFileStorage(write_behind=True, sync=params.get('sync'))
+        errors  = storage.flush()
+        stats   = storage.getStats()
+        if errors:
+            return 500, "%d queued writes could not be written, see the server log" % errors
+        return 200, stats
+
+
+def _writeBehind(params):
+    """
+    Return True if the writes to the bucket are queued.
+
+    The 'write_behind' parameter is ignored on Google App Engine, which
+    does not allow background threads.
+
+    @param params:     Dictionary of parameter values.
+    @type params:      dict
+
+    @return:           Flag indicating whether writes are queued.
+    @rtype:            boolean
+
+    """
+    return bool(params.get('write_behind'))  and  PLATFORM != PLATFORM_GAE
+
+def _itemName(request, params):
+    """
+    Return the name of the item that a request of the 'files' or 'uploads' service is for.
+
+    Names given as query parameter arrive without URL decoding, while names
+    in the path (positional parameters) are decoded already. Both services
+    take the name from here, so that an item has the same name, whichever
+    of them stored it.
+
+    This changed the names used by the files service for the query
+    parameter, which used to be taken without decoding. Items stored that
+    way with '%' in their name need to be requested with it escaped.
+
+    @param request:    Information about the HTTP request, None for direct calls.
+    @type request:     BaseHttpRequest
+
+    @param params:     Dictionary of parameter values.
+    @type params:      dict
+
+    @return:           The name of the item or None if no name was given.
+    @rtype:            string
+
+    @raise GluBadRequest: If the name is reserved (starts with '.', like the
+                          staged parts of uploads and the expiry journal).
+
+    """
+    name = params.get('name')
+    if not name:
+        return None
+    if request  and  request.getRequestQueryDict().get('name') == name:
+        name = urllib.unquote(name)
+    if name.startswith("."):
+        raise GluBadRequest("Names starting with '.' are reserved")
+    return name
+
+def _makeETag(version):
+    """
+    Return the entity tag for a version of a stored item.
+
+    Versions are whatever getFileVersion() of the storage returns. Their
+    representation is hashed, so that storage details are not exposed.
+
+    """
+    return '"%s"' % hashlib.sha1(repr(version)).hexdigest()[:20]
+
+
+def _wantsRawContent(request):
+    """
+    Return True if the client asked for the raw content of an item.
+
+    Otherwise, the content is rendered like any other result of a service.
+
+    @param request:    The request.
+    @type request:     BaseHttpRequest
+
+    @return:           Flag indicating whether the raw content should be sent.
+    @rtype:            boolean
+
+    """
+    accept_header = request.getRequestHeader("Accept")
+    return accept_header is not None  and  "application/octet-stream" in accept_header
+
+
+def _isNotModified(request, etag, mtime):
+    """
+    Evaluate the If-None-Match and If-Modified-Since headers of a request.
+
+    If-Modified-Since is ignored if If-None-Match was sent.
+
+    @param request:    The request.
+    @type request:     BaseHttpRequest
+
+    @param etag:       Entity tag of the current version.
+    @type etag:        string
+
+    @param mtime:      Modification time of the current version, or None if not known.
+    @type mtime:       float
+
+    @return:           True if the client has the current version.
+    @rtype:            boolean
+
+    """
+    if_none_match = request.getRequestHeader("If-None-Match")
+    if if_none_match:
+        for tag in if_none_match.split(","):
+            tag = tag.strip()
+            if tag.startswith("W/"):
+                # Weak comparison is fine for GET
+                tag = tag[2:]
+            if tag == "*"  or  tag == etag:
+                return True
+        return False
+    if_modified_since = request.getRequestHeader("If-Modified-Since")
+    if if_modified_since  and  mtime is not None:
+        parsed = parsedate_tz(if_modified_since)
+        if parsed:
+            # HTTP dates have a resolution of one second
+            return int(mtime) <= mktime_tz(parsed)
+    return False
+
+
+# Number of names that are listed at a time while producing an archive
+_ARCHIVE_PAGE_SIZE = 1000
+
+def _tar_chunks(storage, prefix):
+    """
+    Generator that returns a tar archive of the items in a storage, chunk by chunk.
+
+    Items that disappear while the archive is produced are skipped.
+
+    """
+    now    = time.time()
+    cursor = None
+    while True:
+        names = storage.listFiles(prefix=prefix, limit=_ARCHIVE_PAGE_SIZE, cursor=cursor)
+        for name in names:
+            try:
+                body = storage.openFile(name)
+            except GluFileNotFound:
+                continue
+            if type(name) is unicode:
+                name = name.encode("utf-8")
+            info       = tarfile.TarInfo(name)
+            info.size  = len(body)
+            info.mtime = now
+            yield info.tobuf()
+            sent = 0
+            for chunk in body:
+                if sent + len(chunk) > info.size:
+                    # The item grew while we were reading: Send no more than announced
+                    chunk = chunk[:info.size - sent]
+                sent += len(chunk)
+                yield chunk
+                if sent == info.size:
+                    body.close()
+                    break
+            # Pad to the announced size (in case the item shrank while we were reading),
+            # and then to the end of the tar block.
+            yield tarfile.NUL * (info.size - sent + (tarfile.BLOCKSIZE - info.size % tarfile.BLOCKSIZE) % tarfile.BLOCKSIZE)
+        cursor = names.next_cursor
+        if cursor is None:
+            break
+    # End of archive marker
+    yield tarfile.NUL * (2 * tarfile.BLOCKSIZE)
+
+
+class _PartsReader(object):
+    """
+    File-like object, which reads the staged parts of an upload one after the other.
+
+    Only one part is open at any time.
+
+    """
+    def __init__(self, storage, part_names):
+        self.storage    = storage
+        self.part_names = part_names
+        self.current    = None
+        self.buffer     = ""
+
+    def __next_chunk(self):
+        while True:
+            if self.current is None:
+                if not self.part_names:
+                    return ""
+                self.current = iter(self.storage.openFile(self.part_names.pop(0)))
+            try:
+                return self.current.next()
+            except StopIteration:
+                self.current = None
+
+    def read(self, size=-1):
+        while size < 0  or  len(self.buffer) < size:
+            chunk = self.__next_chunk()
+            if not chunk:
+                break
+            self.buffer += chunk
+        if size < 0:
+            size = len(self.buffer)
+        data, self.buffer = self.buffer[:size], self.buffer[size:]
+        return data
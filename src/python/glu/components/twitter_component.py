@@ -23,7 +23,9 @@ class TwitterComponent(BaseComponent):
                         """
     SERVICES         = {
                          "status" :   { "desc" : "You can GET the status or POST a new status to it." },
-                         "timeline" : { "desc" : "You can GET the timeline of the user." },
+                         "timeline" : { "desc"     : "You can GET the timeline of the user.",
+                                        "cache"    : { "ttl" : 60, "stale" : 60 },
+                                        "coalesce" : True },
                        }
     
 
@@ -5,8 +5,9 @@ Base class for all content browser classes.
 # Glu imports
 import glu.settings as settings
 
-from glu.render import HtmlRenderer
-from glu.render import JsonRenderer
+from glu.render    import HtmlRenderer
+from glu.render    import JsonRenderer
+from glu.core.util import StreamedBody
 
 class BaseBrowser(object):
     """
@@ -78,13 +79,16 @@ class BaseBrowser(object):
                       and lists. The output is rendered in JSON, HTML, etc.
                       based on details we have gleaned from the request. For
                       example, there is a human_client flag, which if set indicates
-                      that the output should be in HTML.
+                      that the output should be in HTML. A StreamedBody is
+                      raw content, which is passed through without rendering.
         @type data:   object
         
         @return:      Tuple with content type and Endered data, ready to be sent to the client.
         @rtype:       tuple of (string, string)
 
         """
+        if isinstance(data, StreamedBody):
+            return data.content_type, data
         if self.human_client:
             renderer     = HtmlRenderer(self.renderer_args, self.breadcrums)
         else:
@@ -6,6 +6,12 @@ import glu.settings as settings
 
 from glu.core.basebrowser import BaseBrowser
 from glu.core.util        import Url
+from glu.resources        import RESOURCE_CACHE, PLAN_CACHE
+
+from glu.resources.service_cache            import getServiceCacheStats
+from glu.resources.single_flight            import getSingleFlightStats
+from glu.storageabstraction.file_storage    import getCompressionStats
+from glu.storageabstraction.caching_storage import getCacheStats
 
         
 class MetaBrowser(BaseBrowser):
@@ -66,6 +72,17 @@ This is the documentation for the server.
 Click around and have fun.
 """
             code = 200
+        elif path == settings.PREFIX_META + "/stats":
+            self.breadcrums.append(("Stats", settings.PREFIX_META + "/stats"))
+            data = {
+                    "resource_cache"   : RESOURCE_CACHE.getStats(),
+                    "resource_plans"   : PLAN_CACHE.getStats(),
+                    "service_results"  : getServiceCacheStats(),
+                    "service_calls"    : getSingleFlightStats(),
+                    "file_compression" : getCompressionStats(),
+                    "storage_cache"    : getCacheStats()
+            }
+            code = 200
         else:
             data = "Don't know this meta page"
             code = 404
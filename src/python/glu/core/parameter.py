@@ -2,9 +2,13 @@
 The parameter class.
 
 """
+# Python imports
 from datetime import date
 from datetime import time as time_class
 
+# Glu imports
+from glu.exceptions import *
+
 #
 # Types for resource parameters
 #
@@ -48,10 +52,10 @@ def __numstr_to_num(x):
     if type(x) in [ int, float ]:
         return x
     elif type(x) in [ str, unicode ]:
-        try:
+        # Checked first, so that floats are not parsed via an exception
+        if x.strip().lstrip("+-").isdigit():
             return int(x)
-        except:
-            return float(x)
+        return float(x)
     # Can't convert anything else
     return None
 
@@ -133,3 +137,196 @@ class ParameterDef(object):
                     default          = self.default)
 
 
+
+
+class LayeredParams(object):
+    """
+    A read-only view of several parameter dictionaries, stacked on top of each other.
+
+    Services receive their parameters like this: The runtime parameters
+    of the request on top of the parameters given when the resource was
+    created. A name is looked up in each layer in turn, so that values in
+    upper layers hide those of the same name in lower layers.
+
+    The layers are not copied. Lower layers (such as the parameters of a
+    resource definition) may therefore be shared between requests, which
+    is why the view cannot be changed. Call copy() to get a dictionary
+    that can be modified.
+
+    """
+    def __init__(self, *layers):
+        """
+        Create the view.
+
+        @param layers:  The parameter dictionaries, top layer first.
+                        Layers that are None are skipped.
+        @type layers:   dict
+
+        """
+        self.__layers = [ layer for layer in layers if layer is not None ]
+
+    def __getitem__(self, name):
+        for layer in self.__layers:
+            if name in layer:
+                return layer[name]
+        raise KeyError(name)
+
+    def __contains__(self, name):
+        for layer in self.__layers:
+            if name in layer:
+                return True
+        return False
+
+    has_key = __contains__
+
+    def get(self, name, default=None):
+        for layer in self.__layers:
+            if name in layer:
+                return layer[name]
+        return default
+
+    def keys(self):
+        names = list()
+        seen  = set()
+        for layer in self.__layers:
+            for name in layer:
+                if name not in seen:
+                    seen.add(name)
+                    names.append(name)
+        return names
+
+    def __iter__(self):
+        return iter(self.keys())
+
+    def __len__(self):
+        return len(self.keys())
+
+    def values(self):
+        return [ self[name] for name in self.keys() ]
+
+    def items(self):
+        return [ (name, self[name]) for name in self.keys() ]
+
+    def copy(self):
+        """
+        Return the parameters as a plain dictionary, which may be modified.
+
+        @return:    The values of all layers.
+        @rtype:     dict
+
+        """
+        return dict(self.items())
+
+    def __eq__(self, other):
+        if isinstance(other, LayeredParams):
+            other = other.copy()
+        return self.copy() == other
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __repr__(self):
+        return repr(self.copy())
+
+    def __readOnly(self, *args, **kwargs):
+        raise TypeError("Service parameters are read-only, use copy() to get a modifiable dictionary")
+
+    __setitem__ = __delitem__ = update = pop = popitem = setdefault = clear = __readOnly
+
+
+
+class ParamValidator(object):
+    """
+    Checks, completes and converts parameter dictionaries against one definition.
+
+    The definition is examined once, when the validator is created. The
+    names of the required parameters, the defaults of the optional ones
+    and the type information of each parameter are kept ready, so that
+    validating a parameter dictionary takes a single pass over it and
+    raises no exceptions internally, unless something is wrong.
+
+    """
+    def __init__(self, param_def_dict, name_for_errors):
+        """
+        Compile the validator for a parameter definition.
+
+        @param param_def_dict:  The parameter definition as provided by the component (the code).
+                                Parameters may be given as ParameterDef objects or as their
+                                plain dictionary representation.
+        @type param_def_dict:   dict
+
+        @param name_for_errors: A section name, which helps to provide meaningful error messages.
+        @type name_for_errors:  string
+
+        """
+        self.name_for_errors = name_for_errors
+        self.types           = dict()    # Name -> (accepted types, runtime types, conversion function)
+        self.required        = list()    # Names of the required parameters
+        self.defaults        = list()    # (name, default) of the optional parameters with default
+        for pname, pdef in (param_def_dict or {}).items():
+            if isinstance(pdef, ParameterDef):
+                pdef = pdef.as_dict()
+            storage_types, runtime_types, conversion_func = TYPE_COMPATIBILITY[pdef['type']]
+            self.types[pname] = (frozenset(runtime_types + storage_types), runtime_types, conversion_func)
+            if pdef['required']:
+                self.required.append(pname)
+            elif pdef['default'] is not None:
+                self.defaults.append((pname, pdef['default']))
+
+    def validate(self, param_dict):
+        """
+        Check a provided parameter dictionary and bring it into the form the code needs.
+
+        The following checks are performed:
+
+         * Are there any keys in the params that are not in the definition?
+         * Are the types compatible?
+         * Are all required parameters present?
+
+        Values that are not of an acceptable type (for example numbers that
+        were passed on the URL command line as strings) are converted.
+        Optional parameters that were not provided get their default value.
+        Both is done in place.
+
+        @param param_dict:      The parameter dictionary provided (for example by the client).
+        @type param_dict:       dict
+
+        @return:                The checked parameter dictionary. If None was
+                                provided, this is a new dictionary.
+        @rtype:                 dict
+
+        @raise GluException:    If the check fails.
+
+        """
+        if param_dict is None:
+            param_dict = dict()
+        elif type(param_dict) is not dict:
+            if param_dict:
+                raise GluException("The '%s' section has to be a dictionary" % self.name_for_errors)
+            param_dict = dict()
+        # Without a definition, the provided parameters are not checked.
+        types = self.types
+        if types:
+            for pname, param_value in param_dict.items():
+                ptypes = types.get(pname)
+                if ptypes is None:
+                    raise GluException("Unknown parameter in '%s' section: %s" % (self.name_for_errors, pname))
+                accepted_types, runtime_types, conversion_func = ptypes
+                if type(param_value) not in accepted_types:
+                    try:
+                        if conversion_func:
+                            param_dict[pname] = conversion_func(param_value)
+                        else:
+                            raise Exception("Cannot convert provided parameter type (%s) to necessary type(s) '%s'" % \
+                                            (type(param_value), runtime_types))
+                    except Exception, e:
+                        raise GluException("Incompatible type for parameter '%s' in section '%s': %s" % \
+                                           (pname, self.name_for_errors, str(e)))
+        for pname in self.required:
+            if pname not in param_dict:
+                raise GluMandatoryParameterMissing("Missing mandatory parameter '%s' in section '%s'" % \
+                                                   (pname, self.name_for_errors))
+        for pname, default in self.defaults:
+            if pname not in param_dict:
+                param_dict[pname] = default
+        return param_dict
@@ -67,6 +67,8 @@ class RequestDispatcher(object):
             (code, data) = e.code, e.msg
         except GluMandatoryParameterMissing, e:
             (code, data) = e.code, e.msg
+        except GluLengthRequired, e:
+            (code, data) = e.code, e.msg
         except GluFileNotFound, e:
             (code, data) = e.code, e.msg
         except GluException, e:
@@ -4,6 +4,7 @@ Allows users and clients to browse the defined resources.
 """
 # Python imports
 import os
+import urllib
 import traceback
 
 # Glu imports
@@ -14,7 +15,7 @@ from glu.logger                    import *
 from glu.core.basebrowser          import BaseBrowser
 from glu.core.util                 import Url
 from glu.core.codebrowser          import getComponentInstance
-from glu.resources                 import paramSanityCheck, fillDefaults, makeResource, listResources, \
+from glu.resources                 import makeResource, listResources, \
                                           retrieveResourceFromStorage, getResourceUri, deleteResourceFromStorage
 from glu.resources.resource_runner import _accessComponentService, _getResourceDetails
 
@@ -59,9 +60,27 @@ class ResourceBrowser(BaseBrowser):
             #
             if method == "GET":
                 #
-                # List all the resources
+                # List all the resources. A client may page through a large
+                # list with the 'limit' and 'cursor' arguments.
                 #
-                data = listResources()
+                query  = self.request.getRequestQueryDict()
+                limit  = query.get('limit')
+                cursor = query.get('cursor')
+                if limit is not None:
+                    try:
+                        limit = int(limit)
+                        if limit < 1:
+                            raise ValueError()
+                    except (TypeError, ValueError), e:
+                        raise GluBadRequest("Limit needs to be a positive number")
+                if cursor:
+                    cursor = urllib.unquote(cursor)
+                data, next_cursor = listResources(limit, cursor)
+                if limit is not None  or  cursor:
+                    data = dict(resources=data)
+                    if next_cursor:
+                        data['next'] = Url("%s?limit=%d&cursor=%s" % (settings.PREFIX_RESOURCE, limit,
+                                                                      urllib.quote(next_cursor, safe="")))
             else:
                 raise GluMethodNotAllowed()
             
@@ -112,11 +131,17 @@ class ResourceBrowser(BaseBrowser):
 
                 service_name      = path_elems[1]
                 positional_params = path_elems[2:]
-                input             = self.request.getRequestBody()
+                if services.get(service_name, {}).get('stream_input'):
+                    # The service reads the request body itself, piece by piece
+                    input = self.request.getRequestBodyStream()
+                else:
+                    input = self.request.getRequestBody()
                 try:
                     code, data = _accessComponentService(component, services, complete_resource_def,
                                                          resource_name, service_name, positional_params,
-                                                         runtime_param_dict, input, self.request, self.request.getRequestMethod())
+                                                         runtime_param_dict, input, self.request, self.request.getRequestMethod(),
+                                                         validators=rinfo['validators'],
+                                                         positional_param_defs=rinfo['positional_params'])
                 except GluException, e:
                     code = e.code
                     data = e.msg
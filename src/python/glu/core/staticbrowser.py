@@ -2,9 +2,13 @@
 Serves static files.
 
 """
+import os
+import mimetypes
+
 import glu.settings as settings
 
 from glu.core.basebrowser import BaseBrowser
+from glu.core.util        import StreamedBody, selectRange
 
         
 class StaticBrowser(BaseBrowser):
@@ -37,6 +41,9 @@ class StaticBrowser(BaseBrowser):
         Produce the data that needs to be displayed for any request
         handled by this browser. Currently, there is only one request
         handled by the meta browser.
+
+        The file is streamed, and only the part selected by a 'Range'
+        header of the request is read.
         
         @return:  Http return code and data as a tuple.
         @rtype:   tuple
@@ -50,10 +57,14 @@ class StaticBrowser(BaseBrowser):
             path = path[:-1]
             
         try:
-            f = open(settings.STATIC_LOCATION + path, "r")
-            data = f.read()
-            f.close()
-            return 200, data
+            f = open(settings.STATIC_LOCATION + path, "rb")
         except Exception, e:
             return 404, "Not found"
+        try:
+            size = os.fstat(f.fileno()).st_size
+        except:
+            f.close()
+            raise
+        content_type = mimetypes.guess_type(path)[0] or "application/octet-stream"
+        return selectRange(self.request, StreamedBody(f, size, content_type=content_type))
             
@@ -2,6 +2,8 @@
 Utility definitions, methods and classes.
 
 """
+# Python imports
+import threading
 
 class Url(object):
     """
@@ -85,3 +87,411 @@ def bool_view(flag):
     """
     return "yes" if flag else "no"
 
+
+class StreamedBody(object):
+    """
+    A response body, which is sent to the client in chunks.
+
+    Services may return this instead of a Python object, if the data
+    is raw content (for example a stored file) that should not be rendered.
+    The HTTP layer reads the source chunk by chunk and writes each chunk
+    straight to the client, so that the complete body never needs to be
+    held in memory.
+
+    The source can be anything with a read(size) method: an open file,
+    an mmap or a StringIO. It can also be an iterator (for example a
+    generator), which returns the chunks of the body.
+
+    """
+    CHUNK_SIZE = 64 * 1024
+
+    def __init__(self, source, length, content_type="application/octet-stream", on_close=None):
+        """
+        Initialize the streamed body.
+
+        @param source:        Object from which the data is read.
+        @type source:         file-like object or iterator
+
+        @param length:        Total number of bytes that will be read from the
+                              source, or None if that is not known in advance.
+                              In that case, the source is read until it is
+                              exhausted.
+        @type length:         int
+
+        @param content_type:  Content type of the data.
+        @type content_type:   string
+
+        @param on_close:      Optional function, which is called after the
+                              source was closed. Used to release any
+                              additional resources (such as the file
+                              underlying an mmap).
+        @type on_close:       callable
+
+        """
+        self.source       = source
+        self.length       = length
+        self.content_type = content_type
+        self.on_close     = on_close
+
+    def __len__(self):
+        return self.length or 0
+
+    def __iter__(self):
+        """
+        Return the data in chunks of at most CHUNK_SIZE bytes.
+
+        Chunks from an iterator source are returned as they are.
+        The source is closed once all data has been read.
+
+        """
+        try:
+            if not hasattr(self.source, "read"):
+                for chunk in self.source:
+                    yield chunk
+                return
+            remaining = self.length
+            while remaining is None  or  remaining > 0:
+                if remaining is None:
+                    chunk = self.source.read(self.CHUNK_SIZE)
+                else:
+                    chunk = self.source.read(min(self.CHUNK_SIZE, remaining))
+                    remaining -= len(chunk)
+                if not chunk:
+                    break
+                yield chunk
+        finally:
+            self.close()
+
+    def restrict(self, start, length):
+        """
+        Restrict the body to a part of the data.
+
+        Sources that can seek are positioned at the start of the part,
+        so that the data before it is never read. From other sources,
+        the data before the part is read and dropped.
+
+        @param start:    Offset of the part, relative to the current start of the body.
+        @type start:     int
+
+        @param length:   Number of bytes in the part.
+        @type length:    int
+
+        """
+        if hasattr(self.source, "seek")  and  hasattr(self.source, "tell"):
+            self.source.seek(self.source.tell() + start)
+        elif hasattr(self.source, "read"):
+            while start > 0:
+                chunk = self.source.read(min(self.CHUNK_SIZE, start))
+                if not chunk:
+                    break
+                start -= len(chunk)
+        else:
+            self.source = _sliceChunks(self.source, start, length)
+        self.length = length
+
+    def read(self):
+        """
+        Return the complete data as a single string.
+
+        Only use this for small bodies, since it defeats the purpose.
+
+        @return:    The data.
+        @rtype:     string
+
+        """
+        return "".join(self)
+
+    def close(self):
+        """
+        Close the source and release any resources held for it.
+
+        Can safely be called multiple times.
+
+        """
+        if self.source is not None:
+            try:
+                if hasattr(self.source, "close"):
+                    self.source.close()
+            finally:
+                self.source = None
+                if self.on_close:
+                    self.on_close()
+                    self.on_close = None
+
+
+def _sliceChunks(chunks, start, length):
+    """
+    Return the part of the data of a chunk iterator that starts at the given offset.
+
+    """
+    for chunk in chunks:
+        if start >= len(chunk):
+            start -= len(chunk)
+            continue
+        chunk  = chunk[start:start+length]
+        start  = 0
+        length -= len(chunk)
+        yield chunk
+        if length <= 0:
+            break
+
+
+def selectRange(request, body, validators=None):
+    """
+    Serve only a part of a streamed body, if the client asked for it.
+
+    Evaluates the 'Range' header of the request. A single byte range is
+    supported. If several ranges are requested, or the header cannot be
+    parsed, the complete body is sent, as HTTP allows. An 'If-Range'
+    header is honoured if the validators of the body are given.
+
+    The 'Accept-Ranges' and 'Content-Range' headers are set on the request.
+
+    @param request:     The client's HTTP request.
+    @type request:      BaseHttpRequest
+
+    @param body:        The complete body.
+    @type body:         StreamedBody
+
+    @param validators:  The current ETag and Last-Modified values of the
+                        body. If the client sends an 'If-Range' header
+                        that matches none of them, the complete body is sent.
+    @type validators:   list
+
+    @return:            Tuple of code and body: 200 with the complete body,
+                        206 with the selected part or 416 with a message.
+    @rtype:             tuple
+
+    """
+    length = body.length
+    if length is None:
+        # Cannot select a part of something with an unknown size
+        return 200, body
+    request.setResponseHeader("Accept-Ranges", "bytes")
+    value = request.getRequestHeader("Range")
+    if not value:
+        return 200, body
+    if_range = request.getRequestHeader("If-Range")
+    if if_range  and  if_range not in (validators or []):
+        # Changed since the client got the first part
+        return 200, body
+
+    unit, _, spec = value.partition("=")
+    if unit.strip().lower() != "bytes"  or  "," in spec:
+        return 200, body
+    first, _, last = spec.strip().partition("-")
+    if not (first or last).isdigit()  or  (first and last and not last.isdigit()):
+        return 200, body
+    if first:
+        start = int(first)
+        end   = length - 1
+        if last:
+            end = int(last)
+            if end < start:
+                return 200, body
+    else:
+        # Suffix range: The last so many bytes
+        start = length - min(int(last), length)
+        end   = length - 1
+    if start > end  or  start >= length:
+        body.close()
+        request.setResponseHeader("Content-Range", "bytes */%d" % length)
+        return 416, "Requested range not satisfiable"
+
+    end = min(end, length - 1)
+    body.restrict(start, end - start + 1)
+    request.setResponseHeader("Content-Range", "bytes %d-%d/%d" % (start, end, length))
+    return 206, body
+
+
+class LruCache(object):
+    """
+    A bounded, thread-safe dictionary with least-recently-used eviction.
+
+    Entries are kept in a doubly linked list in order of their last use,
+    so that lookups, insertions and evictions are all O(1). The cache
+    counts hits, misses and evictions, which helps when sizing it.
+
+    Each entry may carry a validator (for example a file's modification
+    time). A lookup that provides a different validator is treated as a
+    miss and the outdated entry is dropped.
+
+    Optionally, the cache can also be limited by the total size of its
+    values. The size of each value is passed to put().
+
+    A generation counter is incremented whenever entries are invalidated.
+    Callers that load a value outside of the cache lock should remember the
+    generation before loading and pass it to put(): If an invalidation
+    happened in the meantime then the (possibly outdated) value is not
+    stored.
+
+    """
+    def __init__(self, max_entries, max_bytes=None):
+        """
+        Initialize an empty cache.
+
+        @param max_entries:  Maximum number of entries that are kept, None for no limit.
+        @type max_entries:   int
+
+        @param max_bytes:    Maximum total size of the values that are kept, None for no limit.
+        @type max_bytes:     int
+
+        """
+        self.max_entries = max_entries
+        self.max_bytes   = max_bytes
+        self.bytes       = 0
+        self.__lock      = threading.Lock()
+        self.__map       = dict()
+        # Sentinel of the circular list. Links are [ prev, next, key, value, validator, size ].
+        self.__root      = [ None, None, None, None, None, 0 ]
+        self.__root[0]   = self.__root
+        self.__root[1]   = self.__root
+        self.generation  = 0
+        self.hits        = 0
+        self.misses      = 0
+        self.evictions   = 0
+
+    def __unlink(self, link):
+        prev_link, next_link = link[0], link[1]
+        prev_link[1] = next_link
+        next_link[0] = prev_link
+
+    def __append(self, link):
+        last = self.__root[0]
+        link[0] = last
+        link[1] = self.__root
+        last[1] = link
+        self.__root[0] = link
+
+    def get(self, key, default=None, validator=None):
+        """
+        Return the cached value for a key and mark it as recently used.
+
+        @param key:        The key of the entry.
+        @type key:         hashable
+
+        @param default:    Returned if the key is not in the cache.
+        @type default:     object
+
+        @param validator:  If specified, the entry is only returned if it was
+                           stored with an equal validator.
+        @type validator:   object
+
+        @return:           The cached value or the default.
+        @rtype:            object
+
+        """
+        self.__lock.acquire()
+        try:
+            link = self.__map.get(key)
+            if link is not None  and  validator is not None  and  link[4] != validator:
+                # Outdated entry, we might as well drop it right away
+                self.__unlink(link)
+                del self.__map[key]
+                self.bytes -= link[5]
+                link = None
+            if link is None:
+                self.misses += 1
+                return default
+            self.__unlink(link)
+            self.__append(link)
+            self.hits += 1
+            return link[3]
+        finally:
+            self.__lock.release()
+
+    def put(self, key, value, validator=None, generation=None, size=0):
+        """
+        Store a value in the cache, evicting the least recently used entry if necessary.
+
+        @param key:         The key of the entry.
+        @type key:          hashable
+
+        @param value:       The value to be cached.
+        @type value:        object
+
+        @param validator:   Optional validator that describes the version of the value.
+        @type validator:    object
+
+        @param generation:  The generation at the time the value was loaded. If
+                            the cache was invalidated since then, the value is
+                            silently discarded.
+        @type generation:   int
+
+        @param size:        Size of the value, counted against max_bytes.
+        @type size:         int
+
+        """
+        self.__lock.acquire()
+        try:
+            if generation is not None  and  generation != self.generation:
+                return
+            if self.max_bytes is not None  and  size > self.max_bytes:
+                # Would push out everything else
+                return
+            link = self.__map.get(key)
+            if link is not None:
+                self.__unlink(link)
+                self.bytes -= link[5]
+                link[3] = value
+                link[4] = validator
+                link[5] = size
+            else:
+                link = [ None, None, key, value, validator, size ]
+                self.__map[key] = link
+            self.bytes += size
+            self.__append(link)
+            while (self.max_entries is not None  and  len(self.__map) > self.max_entries)  or  \
+                  (self.max_bytes is not None  and  self.bytes > self.max_bytes):
+                oldest = self.__root[1]
+                self.__unlink(oldest)
+                del self.__map[oldest[2]]
+                self.bytes -= oldest[5]
+                self.evictions += 1
+        finally:
+            self.__lock.release()
+
+    def invalidate(self, key=None):
+        """
+        Remove an entry from the cache, or clear the cache entirely.
+
+        @param key:   The key of the entry that should be removed. If
+                      not specified, all entries are removed.
+        @type key:    hashable
+
+        """
+        self.__lock.acquire()
+        try:
+            self.generation += 1
+            if key is None:
+                self.__map.clear()
+                self.__root[0] = self.__root
+                self.__root[1] = self.__root
+                self.bytes     = 0
+            else:
+                link = self.__map.pop(key, None)
+                if link is not None:
+                    self.__unlink(link)
+                    self.bytes -= link[5]
+        finally:
+            self.__lock.release()
+
+    def __len__(self):
+        return len(self.__map)
+
+    def getStats(self):
+        """
+        Return the usage counters of this cache.
+
+        @return:  Dictionary with size, hit, miss and eviction counts.
+        @rtype:   dict
+
+        """
+        return dict(entries     = len(self.__map),
+                    max_entries = self.max_entries,
+                    bytes       = self.bytes,
+                    max_bytes   = self.max_bytes,
+                    hits        = self.hits,
+                    misses      = self.misses,
+                    evictions   = self.evictions)
+
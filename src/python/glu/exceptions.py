@@ -29,6 +29,10 @@ class GluMandatoryParameterMissing(GluException):
     code = 400
     msg  = "Mandatory parameter missing"
     
+class GluLengthRequired(GluException):
+    code = 411
+    msg  = "Length required"
+
 class GluPermissionDenied(GluException):
     code = 403
     msg  = "Permission denied"
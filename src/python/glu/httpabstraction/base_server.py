@@ -6,6 +6,59 @@ being spread all over the place. That way, we can always change the
 concrete HttpServer implementation later on.
 
 """
+# Python imports
+import StringIO
+
+
+class BoundedInputStream(object):
+    """
+    File-like object for reading a request body of known length.
+
+    Wraps the input stream of a request, so that no more than the
+    announced number of bytes is ever read from it. The number of
+    bytes that are still to be read is available as len() of the
+    object, so that an empty body evaluates as False.
+
+    """
+    def __init__(self, stream, length):
+        """
+        Initialize the bounded stream.
+
+        @param stream:   The underlying input stream.
+        @type stream:    file-like object
+
+        @param length:   Length of the request body.
+        @type length:    int
+
+        """
+        self.stream    = stream
+        self.remaining = length
+
+    def __len__(self):
+        return self.remaining
+
+    def read(self, size=-1):
+        """
+        Read at most 'size' bytes, or everything that is left.
+
+        @param size:    Maximum number of bytes to read. Read all if negative.
+        @type size:     int
+
+        @return:        The data. An empty string at the end of the body.
+        @rtype:         string
+
+        """
+        if size < 0  or  size > self.remaining:
+            size = self.remaining
+        if size == 0:
+            return ""
+        data = self.stream.read(size)
+        self.remaining -= len(data)
+        if not data:
+            # Client closed the connection before sending everything
+            self.remaining = 0
+        return data
+
 
 class BaseHttpRequest(object):
     """
@@ -38,6 +91,28 @@ class BaseHttpRequest(object):
     def getRequestPath(self): pass
     
     def getRequestHeaders(self): pass
+
+    def getRequestHeader(self, name):
+        """
+        Return the value of a single request header.
+
+        Header names are not case sensitive.
+
+        @param name:  Name of the header.
+        @type name:   string
+
+        @return:      The (first) value of the header or None if the
+                      header was not sent.
+        @rtype:       string
+
+        """
+        name = name.lower()
+        for header_name, values in self.getRequestHeaders().items():
+            if header_name.lower() == name:
+                if len(values):
+                    return values[0]
+                return None
+        return None
     
     def getRequestQuery(self): pass
     
@@ -59,6 +134,20 @@ class BaseHttpRequest(object):
         return runtime_param_dict
     
     def getRequestBody(self): pass
+
+    def getRequestBodyStream(self):
+        """
+        Return the body of the request message as a file-like object.
+
+        This allows large bodies to be processed in pieces. Request classes
+        that can read the body incrementally should override this.
+
+        @return:  The body of the request.
+        @rtype:   BoundedInputStream
+
+        """
+        body = self.getRequestBody() or ""
+        return BoundedInputStream(StringIO.StringIO(body), len(body))
     
     def sendResponseHeaders(self): pass
     
@@ -10,10 +10,10 @@ concrete HttpServer implementation later on.
 # Java imports
 from com.sun.net.httpserver import HttpServer, HttpHandler
 from java.net               import InetSocketAddress
+from java.util.concurrent   import Executors
 from java.lang              import String
-from java.io                import InputStreamReader;
-from java.io                import BufferedReader
 from java.io                import DataOutputStream
+from org.python.core.util   import FileUtil
 
 # Python imports
 import sys
@@ -22,9 +22,10 @@ import traceback
 # Glu imports
 import glu.settings as settings
 
-from glu.logger import *
+from glu.logger    import *
+from glu.core.util import StreamedBody
 
-from glu.httpabstraction.base_server import BaseHttpServer, BaseHttpRequest
+from glu.httpabstraction.base_server import BaseHttpServer, BaseHttpRequest, BoundedInputStream
 
 class JythonJavaHttpRequest(BaseHttpRequest):
     """
@@ -44,7 +45,7 @@ class JythonJavaHttpRequest(BaseHttpRequest):
     __native_req       = None
     __request_uri_str  = None
     __request_headers  = None
-    __response_headers = dict()
+    __request_body     = None
     
     def __init__(self, native_request):
         """
@@ -58,7 +59,8 @@ class JythonJavaHttpRequest(BaseHttpRequest):
         @type native_request:   com.sun.net.httpserver.HttpExchange
         
         """
-        self.__native_req      = native_request
+        self.__native_req       = native_request
+        self.__response_headers = dict()
     
     def setResponseCode(self, code):
         """
@@ -86,7 +88,10 @@ class JythonJavaHttpRequest(BaseHttpRequest):
         @type body:     string
         
         """
-        self.__response_body = String(body)
+        if isinstance(body, StreamedBody):
+            self.__response_body = body
+        else:
+            self.__response_body = String(body)
         
     def setResponseHeader(self, name, value):
         """
@@ -190,23 +195,33 @@ class JythonJavaHttpRequest(BaseHttpRequest):
         """
         Return the body of the request message.
         
-        Note that this is not very suitable for streaming or large message bodies
-        at this point, since the entire message is read into a single string
-        before it is returned to the client.
+        Note that this is not very suitable for streaming or large message bodies,
+        since the entire message is read into a single string before it is returned
+        to the client. Use getRequestBodyStream() for those.
         
         @return:    Body of the request.
         @rtype:     string
         
         """
-        buffered_reader = BufferedReader(InputStreamReader(self.__native_req.getRequestBody()));
-        lines = []
-        while True:
-            line = buffered_reader.readLine()
-            if not line:
-                break
-            lines.append(line)
+        return self.getRequestBodyStream().read()
+
+    def getRequestBodyStream(self):
+        """
+        Return the body of the request message as a file-like object.
+
+        The body is read from the client as the returned object is read.
         
-        return '\n'.join(lines)
+        @return:    Body of the request.
+        @rtype:     BoundedInputStream
+        
+        """
+        if self.__request_body is None:
+            try:
+                length = int(self.__native_req.getRequestHeaders().getFirst("Content-length") or 0)
+            except ValueError:
+                length = 0
+            self.__request_body = BoundedInputStream(FileUtil.wrap(self.__native_req.getRequestBody()), length)
+        return self.__request_body
     
     def sendResponseHeaders(self):
         """
@@ -216,15 +231,32 @@ class JythonJavaHttpRequest(BaseHttpRequest):
         response_headers = self.__native_req.getResponseHeaders()
         for name, value in self.__response_headers.items():
             response_headers[name] = [ value ]
-        self.__native_req.sendResponseHeaders(self.__response_code, self.__response_body.length())
+        if self.__response_code == 304:
+            # A length of -1 indicates that there is no body
+            length = -1
+        elif isinstance(self.__response_body, StreamedBody):
+            # A length of 0 selects chunked transfer encoding
+            length = self.__response_body.length or 0
+        else:
+            length = self.__response_body.length()
+        self.__native_req.sendResponseHeaders(self.__response_code, length)
     
     def sendResponseBody(self):
         """
         Send the previously specified request body.
         
+        A StreamedBody is written chunk by chunk.
+
         """
         os = DataOutputStream(self.__native_req.getResponseBody())
-        os.writeBytes(self.__response_body)
+        if self.__response_code == 304:
+            # Not allowed to have a body
+            pass
+        elif isinstance(self.__response_body, StreamedBody):
+            for chunk in self.__response_body:
+                os.writeBytes(chunk)
+        else:
+            os.writeBytes(self.__response_body)
         os.flush()
         os.close()
         
@@ -341,6 +373,7 @@ class JythonJavaHttpServer(BaseHttpServer):
         self.__native_server = HttpServer.create(InetSocketAddress(port), 5);
         self.__native_server.createContext(settings.DOCUMENT_ROOT,
                                            __HttpHandler(request_handler));
-        self.__native_server.setExecutor(None);
+        # Requests may wait (for example for changes), so they must not hold up the others
+        self.__native_server.setExecutor(Executors.newFixedThreadPool(settings.HTTP_SERVER_THREADS));
         self.__native_server.start();
         log("Listening for HTTP requests on port %d..." % port)
@@ -16,9 +16,11 @@ import traceback
 # Glu imports
 import glu.settings as settings
 
-from glu.logger import *
+from glu.logger     import *
+from glu.core.util  import StreamedBody
+from glu.exceptions import GluLengthRequired
 
-from glu.httpabstraction.base_server import BaseHttpServer, BaseHttpRequest
+from glu.httpabstraction.base_server import BaseHttpServer, BaseHttpRequest, BoundedInputStream
 
 from glu.platform_specifics import *
 if PLATFORM == PLATFORM_PYTHON:
@@ -38,17 +40,18 @@ class PythonHttpRequest(BaseHttpRequest):
     the specific server implementation.
     
     """
-    __response_code    = None
-    __request_headers  = None
-    __response_headers = dict()
+    __response_code       = None
+    __request_headers     = None
+    __request_body_stream = None
     
     def __init__(self, environ, start_response):
         """
         Initialize request wrapper with the native request class.
         
         """
-        self.environ        = environ
-        self.start_response = start_response
+        self.environ            = environ
+        self.start_response     = start_response
+        self.__response_headers = dict()
     
     def setResponseCode(self, code):
         """
@@ -165,6 +168,11 @@ class PythonHttpRequest(BaseHttpRequest):
         """
         if not self.__request_headers:
             self.__request_headers = dict()
+            for key, value in self.environ.items():
+                if key.startswith("HTTP_")  and  key != "HTTP_ACCEPT":
+                    # HTTP_IF_NONE_MATCH -> If-None-Match
+                    name = "-".join([ part.capitalize() for part in key[5:].split("_") ])
+                    self.__request_headers[name] = [ value ]
             if 'HTTP_ACCEPT' in self.environ:
                 self.__request_headers['Accept'] = self.environ['HTTP_ACCEPT'].split(";")
             if 'CONTENT_TYPE' in self.environ:
@@ -186,33 +194,50 @@ class PythonHttpRequest(BaseHttpRequest):
         """
         Return the body of the request message.
         
-        Note that this is not very suitable for streaming or large message bodies
-        at this point, since the entire message is read into a single string
-        before it is returned to the client.
+        Note that this is not very suitable for streaming or large message bodies,
+        since the entire message is read into a single string before it is returned
+        to the client. Use getRequestBodyStream() for those.
         
         @return:    Body of the request.
         @rtype:     string
         
         """
-        #buffered_reader = BufferedReader(InputStreamReader(self.__native_req.getRequestBody()));
-        if self.getRequestMethod() in [ "POST", "PUT" ]:
-            fp = self.environ['wsgi.input']
-            lines = []
-            while True:
-                line = fp.readline()
-                if not line:
-                    break
-                lines.append(line)
-            return '\n'.join(lines)
-        else:
-            return ""
+        return self.getRequestBodyStream().read()
+
+    def getRequestBodyStream(self):
+        """
+        Return the body of the request message as a file-like object.
+
+        The body is read from the client as the returned object is read.
+
+        The server does not decode a chunked transfer encoding, so
+        a body needs to be sent with a Content-Length header.
+        
+        @return:    Body of the request.
+        @rtype:     BoundedInputStream
+        
+        """
+        if self.__request_body_stream is None:
+            transfer_encoding = self.environ.get('HTTP_TRANSFER_ENCODING')
+            if transfer_encoding  and  transfer_encoding.lower() != "identity":
+                raise GluLengthRequired("A request body needs to be sent with a Content-Length")
+            if self.getRequestMethod() in [ "POST", "PUT" ]:
+                try:
+                    length = int(self.environ.get('CONTENT_LENGTH') or 0)
+                except ValueError:
+                    length = 0
+            else:
+                length = 0
+            self.__request_body_stream = BoundedInputStream(self.environ['wsgi.input'], length)
+        return self.__request_body_stream
     
     def sendResponseHeaders(self):
         """
         Send the previously specified response headers and code.
         
         """
-        
+        if isinstance(self.__response_body, StreamedBody)  and  self.__response_body.length is not None:
+            self.__response_headers["Content-Length"] = str(self.__response_body.length)
         self.write_callable = self.start_response('%d %s' % (self.__response_code, httplib.responses[self.__response_code]),
                                                    self.__response_headers.items())
     
@@ -220,7 +245,16 @@ class PythonHttpRequest(BaseHttpRequest):
         """
         Send the previously specified request body.
         
+        A StreamedBody is written chunk by chunk.
+
         """
+        if self.__response_code == 304:
+            # Not allowed to have a body
+            return
+        if isinstance(self.__response_body, StreamedBody):
+            for chunk in self.__response_body:
+                self.write_callable(chunk)
+            return
         if not self.__response_body:
             self.__response_body = ""
         self.write_callable(self.__response_body)
@@ -315,5 +349,6 @@ class PythonHttpServer(BaseHttpServer):
         global request_handler
         request_handler = req_handler
         log("Listening for HTTP requests on port %d..." % port)
-        httpserver.serve(_app_method, host="0.0.0.0", port=port)
+        httpserver.serve(_app_method, host="0.0.0.0", port=port,
+                         use_threadpool=True, threadpool_workers=settings.HTTP_SERVER_THREADS)
 
@@ -13,25 +13,50 @@ PLATFORM_PYTHON = "Python"
 PLATFORM_JYTHON = "Jython"
 PLATFORM_GAE    = "GAE"
 
+#
+# These are the storage types for resource definitions and data when
+# we are not running on GAE. SQLite requires CPython. Log is an
+# append-only storage, suited for a high rate of writes.
+#
+STORAGE_FILE    = "File"
+STORAGE_SQLITE  = "Sqlite"
+STORAGE_LOG     = "Log"
+
 #
 # ------------------------------------------------------------------------------------------
 # !!! EDIT THIS:
 # ------------------------------------------------------------------------------------------
 #
 PLATFORM = PLATFORM_JYTHON
+STORAGE  = STORAGE_FILE
 
 
 
 
 #
-# Export the correct storage object under the generic name 'STORAGE_OBJECT'
+# Export the correct storage object under the generic name 'STORAGE_OBJECT'.
+# Components store their data in storage objects of class 'STORAGE_CLASS',
+# which are created for 'DATA_STORAGE_LOCATION'.
 #
-if PLATFORM == PLATFORM_GAE:
-    from glu.storageabstraction.gae_storage import GaeStorage
-    STORAGE_OBJECT = GaeStorage()
+if PLATFORM != PLATFORM_GAE  and  STORAGE == STORAGE_SQLITE:
+    from glu.storageabstraction.sqlite_storage import SqliteStorage
+    STORAGE_CLASS         = SqliteStorage
+    STORAGE_OBJECT        = SqliteStorage("gluDB.sqlite")
+    DATA_STORAGE_LOCATION = "gluDB.sqlite"
+elif PLATFORM != PLATFORM_GAE  and  STORAGE == STORAGE_LOG:
+    from glu.storageabstraction.log_storage import LogStorage
+    STORAGE_CLASS         = LogStorage
+    STORAGE_OBJECT        = LogStorage("resourceLog")
+    DATA_STORAGE_LOCATION = "storageLog"
 else:
     from glu.storageabstraction.file_storage import FileStorage
-    STORAGE_OBJECT = FileStorage("resourceDB")
+    STORAGE_CLASS         = FileStorage
+    DATA_STORAGE_LOCATION = "storageDB"
+    if PLATFORM == PLATFORM_GAE:
+        from glu.storageabstraction.gae_storage import GaeStorage
+        STORAGE_OBJECT = GaeStorage()
+    else:
+        STORAGE_OBJECT = FileStorage("resourceDB")
 
 
 #
@@ -34,8 +34,25 @@ from glu.platform_specifics import STORAGE_OBJECT
 
 from glu.exceptions       import *
 from glu.logger           import *
-from glu.core.parameter   import TYPE_COMPATIBILITY
-from glu.core.util        import Url
+from glu.core.parameter   import ParamValidator
+from glu.core.util        import Url, LruCache
+
+#
+# Parsed resource definitions, keyed by resource name. Each entry is
+# stored with the storage's version validator for that resource, so
+# that edits made outside of this server are detected. Unknown resources
+# are cached as well (as None), so that repeated requests for them don't
+# hit the storage either.
+#
+RESOURCE_CACHE = LruCache(settings.RESOURCE_CACHE_SIZE)
+
+#
+# Resource plans (see glu.resources.resource_runner), keyed by resource name.
+# A plan is only used while the resource cache returns the same parsed
+# definition it was built from, so that redefining or deleting a resource
+# invalidates its plan as well.
+#
+PLAN_CACHE = LruCache(settings.RESOURCE_CACHE_SIZE)
 
 
 def getResourceUri(resource_name):
@@ -49,6 +66,36 @@ def getResourceUri(resource_name):
     return settings.PREFIX_RESOURCE + "/" + resource_name
 
 
+def _loadResourceDefinition(resource_name):
+    """
+    Return the parsed definition of a resource, using the resource cache.
+
+    Only a cheap version check is performed on the storage if we have
+    the definition cached already. The returned object is shared with
+    the cache and must not be modified.
+
+    @param resource_name: Name of the resource.
+    @type  resource_name: string
+
+    @return:              Dictionary or None if not found.
+    @rtype:               dict
+
+    """
+    version = STORAGE_OBJECT.getResourceVersion(resource_name)
+    entry   = RESOURCE_CACHE.get(resource_name, validator=(version,))
+    if entry is not None:
+        return entry[0]
+    generation = RESOURCE_CACHE.generation
+    if version is None:
+        obj = None
+    else:
+        obj = STORAGE_OBJECT.loadResourceFromStorage(resource_name)
+    # Storing the object in a tuple, so that we can tell a cached
+    # miss (None) apart from an entry that is not in the cache.
+    RESOURCE_CACHE.put(resource_name, (obj,), validator=(version,), generation=generation)
+    return obj
+
+
 def retrieveResourceFromStorage(uri, only_public=False):
     """
     Return the details about a stored resource.
@@ -62,7 +109,9 @@ def retrieveResourceFromStorage(uri, only_public=False):
                         public information about this resource.
     @type only_public:  boolean
     
-    @return:            Dictionary or None if not found.
+    @return:            Dictionary or None if not found. The dictionary
+                        is shared with the resource cache and must not
+                        be modified.
     @rtype:             dict
     
     """
@@ -70,7 +119,7 @@ def retrieveResourceFromStorage(uri, only_public=False):
     resource_name = uri[len(settings.PREFIX_RESOURCE)+1:]
     obj = None
     try:
-        obj = STORAGE_OBJECT.loadResourceFromStorage(resource_name)
+        obj = _loadResourceDefinition(resource_name)
         if not obj:
             raise Exception("Unknown resource: " + resource_name)
         if type(obj) is not dict  or  'public' not in obj:
@@ -101,151 +150,68 @@ def deleteResourceFromStorage(uri):
 
     """
     resource_name = uri[len(settings.PREFIX_RESOURCE)+1:]
-    STORAGE_OBJECT.deleteResourceFromStorage(resource_name)
+    try:
+        STORAGE_OBJECT.deleteResourceFromStorage(resource_name)
+    finally:
+        RESOURCE_CACHE.invalidate(resource_name)
 
-def listResources():
+def listResources(limit=None, cursor=None):
     """
     Return list of all stored resources.
     
     Data is returned as dictionary keyed by resource name.
     For each resource the complete URI, the name and the description
     are returned.
+
+    The information is taken from the storage's index of resource
+    summaries, so that the individual resource definitions don't
+    need to be loaded.
+
+    @param limit:  Maximum number of resources to return.
+    @type  limit:  int
+
+    @param cursor: Continuation cursor returned with the previous page.
+    @type  cursor: string
     
-    @return: Dictionary of available resources.
-    @rtype:  dict
+    @return: Tuple of dictionary of available resources and the cursor
+             for the next page (None if this was the last page).
+    @rtype:  tuple
     
     """
-    dir_list = STORAGE_OBJECT.listResourcesInStorage()
+    summaries, next_cursor = STORAGE_OBJECT.listResourceSummaries(limit, cursor)
     out = {}
-    for resource_name in dir_list:
-        resource_dict = retrieveResourceFromStorage(getResourceUri(resource_name), only_public=True)
-        if resource_dict:
-            out[resource_name] = dict(uri=Url(resource_dict['uri']), desc=resource_dict['desc'])
-        else:
-            out[resource_name] = "Not found"
-    return out
+    for resource_name, summary in summaries:
+        out[resource_name] = dict(uri=Url(summary['uri']), desc=summary['desc'])
+    return out, next_cursor
 
 
-def paramSanityCheck(param_dict, param_def_dict, name_for_errors):
-    """
-    Check whether a provided parameter-dict is compatible
-    with a parameter-definition-dict.
-    
-    The following checks are performed:
-    
-     * Are there any keys in the params that are not in the definition?
-     * Are all required parameters present?
-     * Are the types are compatible?
-    
-    Does not return anything but raises GlueException with
-    meaningful error message in case of problem.
-    
-    The 'name_for_errors' is used in the error message and provides
-    some context to make the error message more useful.
-    
-    @param param_dict:      The parameter dictionary provided (for example by the client).
-    @type  param_dict:      dict
-    
-    @param param_def_dict:  The parameter definition as provided by the component (the code).
-                            The provided parameters are checked against this definition.
-    @type  param_def_dict:  dict
-    
-    @param name_for_errors: A section name, which helps to provide meaningful error messages.
-    @type  name_for_errors: string
-    
-    @raise GluException:    If the sanity check fails.
-    
-    """
-    #
-    # Check whether there are unknown parameters in the 'param' section
-    # and also whether the type is compatible.
-    #
-    if param_dict  and  type(param_dict) is not dict:
-        raise GluException("The '%s' section has to be a dictionary" % name_for_errors)
-    if param_def_dict  and  param_dict:
-        for pname in param_dict:
-            # Any unknown parameters
-            if pname not in param_def_dict:
-                raise GluException("Unknown parameter in '%s' section: %s" % (name_for_errors, pname))
-            # Sanity check the types
-            type_str    = param_def_dict[pname]['type']
-            param_value = param_dict[pname]
-            param_type  = type(param_value)
-            storage_types, runtime_types, conversion_func = TYPE_COMPATIBILITY[type_str]
-            if param_type in runtime_types:
-                pass
-            elif param_type not in storage_types:
-                try:
-                    if conversion_func:
-                        conversion_func(param_value)
-                    else:
-                        raise Exception("Cannot convert provided parameter type (%s) to necessary type(s) '%s'" % \
-                                        (param_type, runtime_types))
-                except Exception, e:
-                    raise GluException("Incompatible type for parameter '%s' in section '%s': %s" % \
-                                       (pname, name_for_errors, str(e)))
-                    
-    #
-    # Check whether all required parameters are present
-    #
-    for pname, pdict in param_def_dict.items():
-        if pdict['required']  and  (not param_dict  or  pname not in param_dict):
-            raise GluMandatoryParameterMissing("Missing mandatory parameter '%s' in section '%s'" % (pname, name_for_errors))
+#
+# Compiled validators for the parameters of resource creation,
+# for each component class.
+#
+_CREATION_VALIDATORS = dict()
 
-def fillDefaults(param_def_dict, param_dict):
-    """
-    Copy defaults values into parameter dictionary if not present.
-    
-    The parameter dictionaries may be defined with defaults.
-    So, if the param_dict does not contain anything for those
-    parameters then we will create them in there with the
-    default value that were specified in the parameter definition.
-    
-    @param param_def_dict:  The parameter definition- including default values -
-                            provided by the component code.
-    @type  param_def_dict:  dict
-    
-    @param param_dict:      The parameter definition provided by the client.
-    @type  param_dict:      dict
-    
+def _getCreationValidators(component_class, component):
     """
-    for pname, pdict in param_def_dict.items():
-        if not pdict['required']  and  pname not in param_dict:
-            if pdict['default'] is not None:
-                param_dict[pname] = pdict['default']
+    Return the validators for the 'params' and 'resource_creation_params' sections.
 
-def convertTypes(param_def_dict, param_dict):
-    """
-    Convert parameters to those types indicated in the parameter definition.
+    @param component_class:    A class (not instance) derived from BaseComponent.
+    @type  component_class:    BaseComponent or derived.
 
-    This is useful when we get parameters, such as the URL command line, where
-    all is passed as string.
+    @param component:          An instance of that class.
+    @type  component:          BaseComponent or derived.
 
-    @param param_def_dict:  The parameter definition- including default values -
-                            provided by the component code.
-    @type  param_def_dict:  dict
-    
-    @param param_dict:      The parameter definition provided by the client.
-    @type  param_dict:      dict
+    @return:                   Tuple of the two validators.
+    @rtype:                    tuple
 
     """
-    for pname in param_dict:
-        type_str   = param_def_dict[pname]['type']
-        param_val  = param_dict[pname]
-        param_type = type(param_val)
-        storage_types, runtime_types, conversion_func = TYPE_COMPATIBILITY[type_str]
-        if param_type in runtime_types:
-            pass
-        elif param_type not in storage_types:
-            try:
-                if conversion_func:
-                    param_dict[pname] = conversion_func(param_val)
-                else:
-                    raise Exception("Cannot convert provided parameter type (%s) to necessary type(s) '%s'" % \
-                                    (param_type, runtime_types))
-            except Exception, e:
-                raise GluException("Incompatible type for parameter '%s': %s" % (pname, str(e)))
-
+    validators = _CREATION_VALIDATORS.get(component_class)
+    if validators is None:
+        component_params_def = component.getMetaData()
+        validators = (ParamValidator(component_params_def['params'], 'params'),
+                      ParamValidator(component_params_def['resource_creation_params'], 'resource_creation_params'))
+        _CREATION_VALIDATORS[component_class] = validators
+    return validators
 
 def makeResource(component_class, params):
     """
@@ -289,9 +255,9 @@ def makeResource(component_class, params):
                           problem with the provided parameters.
 
     """    
-    # We get the meta data (parameter definition) from the component
-    component            = component_class()
-    component_params_def = component.getMetaData()
+    # The parameter definition of the component is compiled into validators once
+    component                            = component_class()
+    params_validator, creation_validator = _getCreationValidators(component_class, component)
 
     #
     # First we check whether there are any unknown parameters specified
@@ -313,22 +279,19 @@ def makeResource(component_class, params):
         # to merge some defaults into it later on.
         provided_params = dict()
         params['params'] = provided_params
-    provided_resource_creation_params = params.get('resource_creation_params')
-    paramSanityCheck(provided_params, component_params_def['params'], 'params')
-    paramSanityCheck(provided_resource_creation_params,
-                     component_params_def['resource_creation_params'],
-                     'resource_creation_params')
+    #
+    # This also converts the values to the types of the definition and
+    # adds the default values of optional parameters that were not supplied.
+    #
+    provided_params                    = params_validator.validate(provided_params)
+    provided_resource_creation_params  = creation_validator.validate(params.get('resource_creation_params'))
+    params['resource_creation_params'] = provided_resource_creation_params
 
     # The parameters passed the sanity checks. We can now create the resource definition.
     suggested_name = provided_resource_creation_params['suggested_name']
     resource_uri   = settings.PREFIX_RESOURCE + "/" + suggested_name
     resource_name  = suggested_name # TODO: Should check if the resource exists already...
     params['code_uri'] = component.getUri()  # Need a reference to the code that this applies to
-    
-    # Some parameters are optional. If they were not supplied,
-    # we need to add their default values.
-    fillDefaults(component_params_def['params'], provided_params)
-    fillDefaults(component_params_def['resource_creation_params'], provided_resource_creation_params)
 
     # Storage for a resource contains a private and public part. The public part is what
     # any user of the resource can see: URI, name and description. In the private part we
@@ -344,7 +307,10 @@ def makeResource(component_class, params):
     }
     
     # Storage to our 'database'.
-    STORAGE_OBJECT.writeResourceToStorage(resource_name, resource_def)
+    try:
+        STORAGE_OBJECT.writeResourceToStorage(resource_name, resource_def)
+    finally:
+        RESOURCE_CACHE.invalidate(resource_name)
 
     # Send a useful message back to the client.
     success_body = {
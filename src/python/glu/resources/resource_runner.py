@@ -5,14 +5,92 @@ import glu.settings as settings
 
 import glu.core.codebrowser  # Wanted to be much more selective here, but a circular
                              # import issue was most easily resolved like this.
-                             # We only need getComponentInstance() from this module.
+                             # We only need getComponentClass() from this module.
 
-from glu.exceptions import *
-from glu.resources  import paramSanityCheck, fillDefaults, convertTypes, \
-                           retrieveResourceFromStorage, getResourceUri
+from glu.exceptions     import *
+from glu.core.parameter import LayeredParams, ParamValidator
+from glu.resources      import getResourceUri, _loadResourceDefinition, PLAN_CACHE
+
+from glu.resources.service_cache import getCachedResult, invalidateCachedResults
+from glu.resources.single_flight import coalesced
+
+
+class _ResourcePlan(object):
+    """
+    Everything needed to call the services of a resource, worked out once.
+
+    Component instances are not shared between requests, since components
+    may keep per-call state (such as HTTP credentials). The plan holds the
+    component class instead, and creating an instance is cheap.
+
+    """
+    def __init__(self, resource_name, definition):
+        """
+        Build the plan for a resource.
+
+        @param resource_name:  Name of the resource.
+        @type resource_name:   string
+
+        @param definition:     The cached definition, from which the plan is built.
+                               None if the resource does not exist.
+        @type definition:      dict
+
+        """
+        if type(definition) is not dict  or  'public' not in definition:
+            raise GluResourceNotFound("Unknown resource")
+        self.definition            = definition
+        self.resource_name         = resource_name
+        self.resource_home_uri     = getResourceUri(resource_name)
+        self.code_uri              = definition['private']['code_uri']
+        self.component_class       = glu.core.codebrowser.getComponentClass(self.code_uri)
+
+        # The exposed sub-services are added to the public information about the
+        # resource. The stored definition is shared, so that is done on a copy.
+        self.services              = self.newComponent()._getServices(resource_base_uri = self.resource_home_uri)
+        self.public_resource_def   = dict(definition['public'], services=self.services)
+        self.complete_resource_def = dict(definition, public=self.public_resource_def)
+
+        # The runtime parameters of each service are checked by a validator,
+        # which is compiled from the parameter definition here. The names of
+        # the positional parameters of each service are looked up here as well.
+        self.validators            = dict()
+        self.positional_params     = dict()
+        for service_name, service_def in self.services.items():
+            if service_def.get('params'):
+                self.validators[service_name] = ParamValidator(service_def['params'], "runtime parameter")
+            if service_def.get('positional_params'):
+                self.positional_params[service_name] = service_def['positional_params']
+
+    def newComponent(self):
+        """
+        Return a new instance of the component of the resource.
+
+        """
+        return self.component_class(self.resource_name)
+
+
+def _getResourcePlan(resource_name):
+    """
+    Return the plan of a resource, from the plan cache if it is still valid.
+
+    @param resource_name:    The name of the resource.
+    @type resource_name:     string
+
+    @return:                 The plan.
+    @rtype:                  _ResourcePlan
+
+    """
+    definition = _loadResourceDefinition(resource_name)
+    plan       = PLAN_CACHE.get(resource_name)
+    if plan is None  or  plan.definition is not definition:
+        generation = PLAN_CACHE.generation
+        plan       = _ResourcePlan(resource_name, definition)
+        PLAN_CACHE.put(resource_name, plan, generation=generation)
+    return plan
 
 def _accessComponentService(component, services, complete_resource_def, resource_name, service_name,
-                            positional_params, runtime_param_dict, input, request="GET", method=None, direct_call=False):
+                            positional_params, runtime_param_dict, input, request="GET", method=None, direct_call=False,
+                            validators=None, positional_param_defs=None):
     """
     Passes control to a service method exposed by a component.
     
@@ -43,8 +121,10 @@ def _accessComponentService(component, services, complete_resource_def, resource
     @param runtime_param_dict:    Dictionary of URL command line arguments.
     @type runtime_param_dict:     dict
     
-    @param input:                 Any potential input (came in the request body)
-    @type input:                  string
+    @param input:                 Any potential input (came in the request body). For
+                                  services with the 'stream_input' flag, this is a file-like
+                                  object when called via HTTP.
+    @type input:                  string or file-like object
 
     @param request:               HTTP request structure.
     @type request:                BaseHttpRequest
@@ -55,6 +135,16 @@ def _accessComponentService(component, services, complete_resource_def, resource
                                   That allows the framework code to react differently to exceptions
                                   in here than direct-call code.
     @type direct_call:            boolean
+
+    @param validators:            Compiled validators for the runtime parameters of the services, as
+                                  kept in the plan of the resource. If not given, the validator of
+                                  the service is compiled from its definition for just this call.
+    @type validators:             dict
+
+    @param positional_param_defs: Names of the positional parameters of the services, as kept in
+                                  the plan of the resource. If not given, they are looked up in the
+                                  resource definition.
+    @type positional_param_defs:  dict
     
     """
     try:
@@ -87,10 +177,13 @@ def _accessComponentService(component, services, complete_resource_def, resource
         # method, which could possibly use a complete 
         #
         if positional_params:
-            try:
-                pos_param_def = complete_resource_def['public']['services'][service_name]['positional_params']
-            except Exception, e:
-                pos_param_def = None
+            if positional_param_defs is not None:
+                pos_param_def = positional_param_defs.get(service_name)
+            else:
+                try:
+                    pos_param_def = complete_resource_def['public']['services'][service_name]['positional_params']
+                except Exception, e:
+                    pos_param_def = None
             if pos_param_def:
                 # Iterating over all the positional parameters that are provided in the URI
                 # There might be some empty ones (when the URL has two // in a row or ends
@@ -131,26 +224,49 @@ def _accessComponentService(component, services, complete_resource_def, resource
                     if name not in runtime_param_dict:
                         runtime_param_dict[name] = value
 
-            paramSanityCheck(runtime_param_dict, runtime_param_def, "runtime parameter")
-            fillDefaults(runtime_param_def, runtime_param_dict)
-            convertTypes(runtime_param_def, runtime_param_dict)
+            validator = (validators or {}).get(service_name)
+            if validator is None:
+                validator = ParamValidator(runtime_param_def, "runtime parameter")
+            runtime_param_dict = validator.validate(runtime_param_dict)
     
         services = complete_resource_def['public']['services']
         if service_name in services  and  hasattr(component, service_name):
             service_method = getattr(component, service_name)
             
-            # Get the parameters from the resource definition time
-            params = complete_resource_def['private']['params']
+            # The runtime parameters are laid over the parameters from the
+            # resource definition time. The definition is shared between
+            # requests, so the service gets a read-only view, not a copy.
+            params = LayeredParams(runtime_param_dict, complete_resource_def['private']['params'])
 
-            if runtime_param_dict:
-                # Merge the runtime parameters with the static parameters
-                # from the resource definition.
-                params.update(runtime_param_dict)
-            
-            code, data = service_method(request = request,
-                                        input   = input,
-                                        params  = params,
-                                        method  = method)
+            def call(request=request):
+                return service_method(request = request,
+                                      input   = input,
+                                      params  = params,
+                                      method  = method)
+
+            # Services may declare that their results can be cached for a while.
+            # That is not published, so it is taken from the component itself.
+            call_options = component.SERVICES.get(service_name, {})
+            cache_def    = call_options.get('cache')
+            if method == "GET"  and  not input:
+                if call_options.get('coalesce'):
+                    # Identical calls that run at the same time share one result,
+                    # if the service declares that its result depends only on them
+                    call = coalesced(call, resource_name, service_name,
+                                     complete_resource_def['private'], runtime_param_dict)
+                if cache_def:
+                    code, data = getCachedResult(cache_def, resource_name, service_name,
+                                                 complete_resource_def['private'], runtime_param_dict, call)
+                else:
+                    code, data = call()
+            elif not cache_def:
+                code, data = call()
+            else:
+                try:
+                    code, data = call()
+                finally:
+                    # Whatever was cached may have been changed by this request
+                    invalidateCachedResults(resource_name, service_name)
         else:
             raise GluException("Service '%s' is not exposed by this resource." % service_name)
     except GluException, e:
@@ -167,7 +283,9 @@ def _getResourceDetails(resource_name):
     """
     Extract and compute a number of importants facts about a resource.
     
-    The information is returned as a dictionary.
+    The information is returned as a dictionary. It is taken from the
+    plan of the resource, so apart from the component instance, it is
+    shared between requests and must not be modified.
     
     @param resource_name:    The name of the resource.
     @type resource_name:     string
@@ -176,24 +294,14 @@ def _getResourceDetails(resource_name):
     @rtype:                  dict
     
     """
-    complete_resource_def  = retrieveResourceFromStorage(getResourceUri(resource_name))
-    if not complete_resource_def:
-        raise GluResourceNotFound("Unknown resource")
-    resource_home_uri      = getResourceUri(resource_name)
-    public_resource_def    = complete_resource_def['public']
-    
-    # Instantiate the component to get the exposed sub-services. Their info
-    # is added to the public information about the resource.
-    code_uri  = complete_resource_def['private']['code_uri']
-    component = glu.core.codebrowser.getComponentInstance(code_uri, resource_name)
-    services  = component._getServices(resource_base_uri = resource_home_uri)
-    public_resource_def['services'] = services
-    
-    return dict(complete_resource_def = complete_resource_def,
-                resource_home_uri     = resource_home_uri,
-                public_resource_def   = public_resource_def,
-                code_uri              = code_uri,
-                component             = component)
+    plan = _getResourcePlan(resource_name)
+    return dict(complete_resource_def = plan.complete_resource_def,
+                resource_home_uri     = plan.resource_home_uri,
+                public_resource_def   = plan.public_resource_def,
+                code_uri              = plan.code_uri,
+                validators            = plan.validators,
+                positional_params     = plan.positional_params,
+                component             = plan.newComponent())
 
      
 def accessResource(resource_uri, input=None, params=None, method="GET"):
@@ -235,7 +343,9 @@ def accessResource(resource_uri, input=None, params=None, method="GET"):
     
     code, data = _accessComponentService(rinfo['component'], rinfo['public_resource_def']['services'],
                                          rinfo['complete_resource_def'], resource_name,
-                                         service_name, positional_params, params, input, None, method, True)
+                                         service_name, positional_params, params, input, None, method, True,
+                                         validators=rinfo['validators'],
+                                         positional_param_defs=rinfo['positional_params'])
     return code, data
  
  
@@ -0,0 +1,264 @@
+"""
+Cached results of services.
+
+A service can declare in its SERVICES entry that its results may be
+cached for a while:
+
+    "search" : {
+        "desc"  : "...",
+        "cache" : { "ttl" : 300, "stale" : 60 }
+    }
+
+Results of successful GET requests are then kept for 'ttl' seconds,
+keyed by resource name, service name and the runtime parameters (after
+defaults were filled in and types were converted). For another 'stale'
+seconds (optional, default 0) the outdated result is still returned,
+while a single background call of the service fetches a new one. On GAE,
+where there are no background threads, the first request that finds the
+outdated result calls the service itself, while the others still get
+the outdated result.
+
+Requests with any other method remove the cached results of the service
+of that resource, since they may have changed the data. Redefining a
+resource has the same effect.
+
+Cached results are shared between requests and must not be modified.
+
+"""
+# Python imports
+import time
+import threading
+import traceback
+
+# Glu imports
+import glu.settings as settings
+
+from glu.logger             import *
+from glu.core.util          import LruCache
+from glu.platform_specifics import PLATFORM, PLATFORM_GAE
+
+#
+# Cached results, keyed by (resource name, service name, version of the
+# service's results, normalized parameters).
+#
+RESULT_CACHE = LruCache(settings.SERVICE_CACHE_SIZE)
+
+#
+# Protects the counters and the refresh flags.
+#
+_lock = threading.Lock()
+
+
+class _CachedResult(object):
+    """
+    The result of one service call, with the times until which it may be used.
+
+    """
+    def __init__(self, definition, code, data, ttl, stale):
+        now              = time.time()
+        self.definition  = definition    # Private part of the resource definition
+        self.code        = code
+        self.data        = data
+        self.fresh_until = now + ttl
+        self.stale_until = self.fresh_until + stale
+        self.refreshing  = False
+
+
+class _ServiceInfo(object):
+    """
+    Counters of the cached results of one service of a resource.
+
+    The version is part of the keys of the cached results. Incrementing
+    it makes all of the service's results unreachable at once, they are
+    then evicted from the cache in time.
+
+    """
+    def __init__(self):
+        self.version          = 0
+        self.hits             = 0
+        self.stale_hits       = 0
+        self.misses           = 0
+        self.refreshes        = 0
+        self.failed_refreshes = 0
+
+    def as_dict(self):
+        requests = self.hits + self.stale_hits + self.misses
+        if requests:
+            hit_ratio = round(float(self.hits + self.stale_hits) / requests, 3)
+        else:
+            hit_ratio = None
+        return dict(hits             = self.hits,
+                    stale_hits       = self.stale_hits,
+                    misses           = self.misses,
+                    refreshes        = self.refreshes,
+                    failed_refreshes = self.failed_refreshes,
+                    hit_ratio        = hit_ratio)
+
+
+#
+# Keyed by (resource name, service name).
+#
+_services = dict()
+
+
+def _getServiceInfo(resource_name, service_name):
+    key = (resource_name, service_name)
+    _lock.acquire()
+    try:
+        info = _services.get(key)
+        if info is None:
+            info = _services[key] = _ServiceInfo()
+        return info
+    finally:
+        _lock.release()
+
+def _normalizeParams(params):
+    """
+    Turn runtime parameters into a hashable value that does not depend on their order.
+
+    """
+    items = list()
+    for name, value in sorted(params.items()):
+        if type(value) in [ list, dict ]:
+            # Parameters taken from a request body may contain those
+            value = repr(value)
+        items.append((name, value))
+    return tuple(items)
+
+def _store(key, cache_def, definition, code, data):
+    # Errors are not cached, and neither are streamed bodies, which can only be read once
+    if code == 200  and  not hasattr(data, "read"):
+        RESULT_CACHE.put(key, _CachedResult(definition, code, data, cache_def['ttl'], cache_def.get('stale', 0)))
+
+def _refresh(key, cache_def, entry, info, call):
+    """
+    Call the service again and replace an outdated result.
+
+    @return:    Http return code and data as a tuple, or None if the call failed.
+    @rtype:     tuple
+
+    """
+    try:
+        code, data = call(None)
+        ok         = code == 200
+    except Exception, e:
+        print traceback.format_exc()
+        ok = False
+    if ok:
+        _store(key, cache_def, entry.definition, code, data)
+    else:
+        log("Refreshing the cached result of service '%s' of resource '%s' failed" % (key[1], key[0]),
+            facility=LOGF_RESOURCES)
+    _lock.acquire()
+    try:
+        if not ok:
+            info.failed_refreshes += 1
+            # The next request for the outdated result tries again
+            entry.refreshing = False
+    finally:
+        _lock.release()
+    if ok:
+        return code, data
+    return None
+
+def getCachedResult(cache_def, resource_name, service_name, definition, params, call):
+    """
+    Return the result of a service call from the cache, if possible.
+
+    @param cache_def:       The 'cache' entry of the service definition.
+    @type cache_def:        dict
+
+    @param resource_name:   Name of the resource.
+    @type resource_name:    string
+
+    @param service_name:    Name of the service.
+    @type service_name:     string
+
+    @param definition:      The private part of the resource definition. Results
+                            that were cached for another definition are not used.
+    @type definition:       dict
+
+    @param params:          The checked runtime parameters of the call.
+    @type params:           dict
+
+    @param call:            Function that calls the service. It receives the
+                            HTTP request as argument, which is None for calls
+                            that refresh an outdated result.
+    @type call:             function
+
+    @return:                Http return code and data as a tuple.
+    @rtype:                 tuple
+
+    """
+    info    = _getServiceInfo(resource_name, service_name)
+    key     = (resource_name, service_name, info.version, _normalizeParams(params))
+    entry   = RESULT_CACHE.get(key)
+    now     = time.time()
+    refresh = False
+    _lock.acquire()
+    try:
+        if entry is not None  and  entry.definition is not definition  and  entry.definition != definition:
+            entry = None
+        if entry is None  or  now >= entry.stale_until:
+            info.misses += 1
+            entry        = None
+        elif now < entry.fresh_until:
+            info.hits += 1
+        else:
+            info.stale_hits += 1
+            if not entry.refreshing:
+                entry.refreshing = refresh = True
+                info.refreshes  += 1
+    finally:
+        _lock.release()
+
+    if entry is None:
+        code, data = call()
+        _store(key, cache_def, definition, code, data)
+        return code, data
+    if refresh:
+        if PLATFORM == PLATFORM_GAE:
+            result = _refresh(key, cache_def, entry, info, call)
+            if result is not None:
+                return result
+        else:
+            thread = threading.Thread(target=_refresh, args=(key, cache_def, entry, info, call))
+            thread.setDaemon(True)
+            thread.start()
+    return entry.code, entry.data
+
+def invalidateCachedResults(resource_name, service_name):
+    """
+    Drop all cached results of a service of a resource.
+
+    @param resource_name:   Name of the resource.
+    @type resource_name:    string
+
+    @param service_name:    Name of the service.
+    @type service_name:     string
+
+    """
+    info = _getServiceInfo(resource_name, service_name)
+    _lock.acquire()
+    try:
+        info.version += 1
+    finally:
+        _lock.release()
+
+def getServiceCacheStats():
+    """
+    Return the usage counters of the service result cache.
+
+    @return:  Dictionary with the counters of the cache itself and,
+              for each cached service of a resource, the counts of
+              hits, stale hits, misses and refreshes and the hit ratio.
+    @rtype:   dict
+
+    """
+    _lock.acquire()
+    try:
+        services = dict([ ("%s/%s" % key, info.as_dict()) for key, info in _services.items() ])
+    finally:
+        _lock.release()
+    return dict(results  = RESULT_CACHE.getStats(),
+                services = services)
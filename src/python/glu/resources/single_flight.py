@@ -0,0 +1,146 @@
+"""
+Coalescing of identical service calls that run at the same time.
+
+Services opt in with "coalesce": True in their SERVICES entry. When a
+GET request for such a service arrives while the same service of the
+same resource is already being called with the same runtime parameters,
+the request does not call the service again. It waits for the running
+call instead and returns its result (or raises its exception). This
+keeps a burst of identical requests from multiplying the load on the
+upstream server that the service talks to. If the running call takes
+longer than settings.SERVICE_COALESCE_MAX_WAIT seconds, the waiting
+requests stop waiting and call the service themselves.
+
+The result of the running call is returned, even if a write to the
+same data finished while the request waited for it. Only services
+whose results depend on nothing but the parameters (not, for example,
+on request headers) and that set no response headers should opt in.
+Streamed results cannot be shared: Requests that waited for a call with
+a streamed result call the service themselves.
+
+"""
+# Python imports
+import threading
+
+# Glu imports
+import glu.settings as settings
+
+from glu.resources.service_cache import _normalizeParams
+
+
+class _Flight(object):
+    """
+    A service call that is running, and the requests waiting for it.
+
+    """
+    def __init__(self):
+        self.done      = threading.Event()
+        self.result    = None
+        self.exception = None
+
+
+#
+# The running calls, keyed by (resource name, service name, identity of
+# the resource definition, normalized parameters).
+#
+_flights     = dict()
+_lock        = threading.Lock()
+_executions  = 0
+_coalesced   = 0
+_timeouts    = 0
+
+
+def _callCoalesced(key, call, args):
+    global _executions, _coalesced, _timeouts
+    _lock.acquire()
+    try:
+        flight = _flights.get(key)
+        leader = flight is None
+        if leader:
+            flight = _flights[key] = _Flight()
+            _executions += 1
+        else:
+            _coalesced += 1
+    finally:
+        _lock.release()
+
+    if not leader:
+        flight.done.wait(settings.SERVICE_COALESCE_MAX_WAIT)
+        if not flight.done.isSet():
+            _lock.acquire()
+            try:
+                _timeouts += 1
+            finally:
+                _lock.release()
+            return call(*args)
+        if flight.exception is not None:
+            raise flight.exception
+        if flight.result is None  or  hasattr(flight.result[1], "read"):
+            return call(*args)
+        return flight.result
+
+    try:
+        try:
+            flight.result = call(*args)
+        except Exception, e:
+            flight.exception = e
+            raise
+    finally:
+        # Later requests start a new call
+        _lock.acquire()
+        try:
+            del _flights[key]
+        finally:
+            _lock.release()
+        flight.done.set()
+    return flight.result
+
+def coalesced(call, resource_name, service_name, definition, params):
+    """
+    Wrap a service call, so that identical calls running at the same time share one result.
+
+    @param call:            Function that calls the service.
+    @type call:             function
+
+    @param resource_name:   Name of the resource.
+    @type resource_name:    string
+
+    @param service_name:    Name of the service.
+    @type service_name:     string
+
+    @param definition:      The private part of the resource definition. Calls only
+                            share results if they are made for the same definition.
+    @type definition:       dict
+
+    @param params:          The checked runtime parameters of the call.
+    @type params:           dict
+
+    @return:                Function with the same arguments and result as 'call'.
+    @rtype:                 function
+
+    """
+    # The definition is in use while the call runs, so its id cannot be reused meanwhile
+    key = (resource_name, service_name, id(definition), _normalizeParams(params))
+    def coalesced_call(*args):
+        return _callCoalesced(key, call, args)
+    return coalesced_call
+
+def getSingleFlightStats():
+    """
+    Return the counters of coalesced service calls.
+
+    @return:  Dictionary with the number of service calls that were made,
+              the number of requests that shared the result of another
+              call, the number of requests that stopped waiting for it
+              and the number of calls running right now.
+    @rtype:   dict
+
+    """
+    _lock.acquire()
+    try:
+        return dict(executions = _executions,
+                    coalesced  = _coalesced,
+                    timeouts   = _timeouts,
+                    in_flight  = len(_flights))
+    finally:
+        _lock.release()
@@ -11,11 +11,100 @@ PREFIX_RESOURCE = "/resource"
 PREFIX_STATIC   = "/static"
 
 LISTEN_PORT     = 8001
+
+# Number of threads with which the Jython and Python servers handle requests
+HTTP_SERVER_THREADS = 20
 #STATIC_LOCATION = "/home/jbrendel/Programming/google_appengine/glu/static_files/"
 STATIC_LOCATION = "static_files/"
 
 NEVER_HUMAN   = False
 
+# Maximum number of parsed resource definitions kept in memory
+RESOURCE_CACHE_SIZE = 10000
+
+# Changes to the resource index are appended to it. A new snapshot of the
+# index is written once there are more change records than resources, but
+# not before there are RESOURCE_INDEX_SLACK of them.
+RESOURCE_INDEX_SLACK = 1000
+
+# Directory layout of FileStorage: "flat" (one directory with all files)
+# or "sharded" (a directory per namespace, with files spread over hash
+# sub-directories). Existing flat files are moved over when switching
+# to "sharded".
+FILE_STORAGE_LAYOUT       = "flat"
+FILE_STORAGE_SHARD_DIGITS = 2
+
+# Files of at least this many bytes are stored zlib-compressed by FileStorage
+# (if that makes them smaller). Set to None to disable compression.
+FILE_STORAGE_COMPRESS_THRESHOLD = None
+
+# If set, the storage of components keeps identical contents only once
+# (see glu.storageabstraction.dedup_storage).
+STORAGE_DEDUP = False
+
+# Segment files of LogStorage are closed and a new one is started once
+# they reach this size. Compaction starts when at least this fraction of
+# the closed segments is taken up by overwritten or deleted data.
+LOG_STORAGE_SEGMENT_SIZE  = 64 * 1024 * 1024
+LOG_STORAGE_COMPACT_RATIO = 0.5
+
+# If set, LogStorage syncs every write to disk before returning
+LOG_STORAGE_FSYNC         = False
+
+# Write-behind mode of the StorageComponent (resource parameter 'write_behind'):
+# Writes are acknowledged once they are queued, and written in batches by a
+# background thread. Writers wait while a bucket has this many writes or bytes
+# queued. Items larger than STORAGE_WRITE_BEHIND_MAX_ITEM bytes are written
+# directly. The background thread waits STORAGE_WRITE_BEHIND_DELAY seconds
+# before writing a batch, so that more writes can join it. Writes that failed
+# stay queued and are tried again after STORAGE_WRITE_BEHIND_RETRY_DELAY seconds.
+STORAGE_WRITE_BEHIND_MAX_PENDING = 1000
+STORAGE_WRITE_BEHIND_MAX_BYTES   = 16 * 1024 * 1024
+STORAGE_WRITE_BEHIND_MAX_ITEM    = 1024 * 1024
+STORAGE_WRITE_BEHIND_DELAY       = 0.01
+STORAGE_WRITE_BEHIND_RETRY_DELAY = 1.0
+
+# In-memory cache for the storage of components that ask for it (see
+# glu.storageabstraction.caching_storage). The total size of the cached
+# files is limited to STORAGE_CACHE_MAX_BYTES, larger files than
+# STORAGE_CACHE_MAX_ITEM are not cached. With STORAGE_CACHE_VALIDATE, the
+# version of a file is checked on every read, which is needed if other
+# processes write to the same storage.
+STORAGE_CACHE_MAX_BYTES = 64 * 1024 * 1024
+STORAGE_CACHE_MAX_ITEM  = 1024 * 1024
+STORAGE_CACHE_VALIDATE  = True
+
+# Expiry of stored items with a time to live (StorageComponent parameters
+# 'default_ttl' and 'ttl'). Expired items are deleted by a background thread,
+# which handles all items that expire within STORAGE_EXPIRY_SWEEP_INTERVAL
+# seconds of each other in one pass. The journal of expiry times of a bucket
+# is rewritten once it holds more than STORAGE_EXPIRY_JOURNAL_SLACK records
+# beyond those needed. On Google App Engine, where there are no background
+# threads, expired items are deleted by the requests that write to or list
+# the bucket, at most STORAGE_EXPIRY_SWEEP_LIMIT of them per request.
+STORAGE_EXPIRY_SWEEP_INTERVAL = 1.0
+STORAGE_EXPIRY_JOURNAL_SLACK  = 1000
+STORAGE_EXPIRY_SWEEP_LIMIT    = 100
+
+# Change feeds of storage namespaces (the 'changes' services): At least the
+# last STORAGE_CHANGES_RETAIN changes of each namespace are kept in memory.
+# Clients can wait for a change for up to STORAGE_CHANGES_MAX_WAIT seconds.
+# A waiting client holds a server thread, so at most STORAGE_CHANGES_MAX_WAITERS
+# clients wait at the same time (well below HTTP_SERVER_THREADS), the others
+# get an answer right away. On GAE, clients never wait.
+STORAGE_CHANGES_RETAIN      = 10000
+STORAGE_CHANGES_MAX_WAIT    = 30
+STORAGE_CHANGES_MAX_WAITERS = 5
+
+# Results of services that declare a 'cache' (see glu.resources.service_cache):
+# Maximum number of results kept in memory.
+SERVICE_CACHE_SIZE = 10000
+
+# Identical calls of services that declare 'coalesce', which run at the same
+# time, share one result (see glu.resources.single_flight). A request waits for the running call for at
+# most SERVICE_COALESCE_MAX_WAIT seconds, then it calls the service itself.
+SERVICE_COALESCE_MAX_WAIT = 30
+
 HTML_HEADER = """
 <html>
     <head>
@@ -2,12 +2,162 @@
 Base class from which all storage abstractions derive.
 
 """
+# Python imports
+import bisect
+import StringIO
+import threading
+import glujson as json
+
+# Glu imports
+import glu.settings as settings
+
+from glu.exceptions import *
+from glu.logger     import *
+
+#
+# Name under which the index of public resource summaries is kept
+# in the resource storage. File names starting with '.' are reserved
+# for internal use and are not returned by listFiles().
+#
+# The index consists of JSON records, one per line: A dictionary of
+# summaries keyed by resource name (a snapshot of the whole index),
+# followed by [ name, summary ] records for each resource that was
+# stored since, with a summary of null for deleted resources. Once
+# there are enough of those, a new snapshot replaces them.
+#
+RESOURCE_INDEX_NAME = ".resource_index"
+
+
+def _pageOfSortedNames(sorted_names, limit=None, cursor=None):
+    """
+    Return one page out of a sorted list of names.
+
+    The cursor is the last name of the previous page. We find the
+    start of the next page with a binary search, so the cost does
+    not depend on how far into the list we are.
+
+    @param sorted_names:  Sorted list of names.
+    @type sorted_names:   list
+
+    @param limit:         Maximum number of names to return. All remaining
+                          names are returned if not specified.
+    @type limit:          int
+
+    @param cursor:        Continuation cursor returned with the previous page.
+    @type cursor:         string
+
+    @return:              Tuple of the list of names and the cursor for the
+                          next page (None if there are no more names).
+    @rtype:               tuple
+
+    """
+    if cursor:
+        start = bisect.bisect_right(sorted_names, cursor)
+    else:
+        start = 0
+    if limit is None:
+        end = len(sorted_names)
+    else:
+        end = start + limit
+    names = sorted_names[start:end]
+    if end < len(sorted_names)  and  names:
+        next_cursor = names[-1]
+    else:
+        next_cursor = None
+    return names, next_cursor
+
+
+class FileList(list):
+    """
+    A page of file names, as returned by listFiles().
+
+    This is a plain list of names with an additional 'next_cursor'
+    attribute. If that is not None then there are more names, which
+    can be retrieved by passing the cursor to the next listFiles() call.
+
+    """
+    def __init__(self, names, next_cursor=None):
+        super(FileList, self).__init__(names)
+        self.next_cursor = next_cursor
+
+
+def _makeFileList(names, prefix=None, limit=None, cursor=None):
+    """
+    Filter, sort and page a list of file names.
+
+    This is used by storage classes, which cannot list their files
+    in order or by prefix natively.
+
+    @param names:         Unsorted list of all file names.
+    @type names:          list
+
+    @param prefix:        Only names starting with this prefix are returned.
+    @type prefix:         string
+
+    @param limit:         Maximum number of names to return.
+    @type limit:          int
+
+    @param cursor:        Continuation cursor returned with the previous page.
+    @type cursor:         string
+
+    @return:              The requested page of names.
+    @rtype:               FileList
+
+    """
+    if prefix:
+        names = [ name for name in names if name.startswith(prefix) ]
+    names.sort()
+    page, next_cursor = _pageOfSortedNames(names, limit, cursor)
+    return FileList(page, next_cursor)
+
 
 class BaseStorage(object):
     """
     Abstract implementation of the base storage methods.
 
+    Concrete storage classes need to provide the file methods. The
+    resource methods, including the index of public resource summaries,
+    are implemented here on top of those, so that all storage classes
+    can use them.
+
     """
+    _append_lock = threading.Lock()
+    _named_locks = dict()
+
+    def _getLock(self, lock_name):
+        """
+        Return a lock for read-modify-write operations that span several files.
+
+        This implementation returns a reentrant lock, which only serializes
+        the threads of this process. Storage objects of the same class, location
+        and namespace get the same lock. Storage classes whose files may be
+        changed by several processes return a lock that works between them.
+
+        @param lock_name:    Name of the lock. Storage objects that share their
+                             files return the same lock for the same name.
+        @type lock_name:     string
+
+        @return:             The lock.
+        @rtype:              object with acquire() and release()
+
+        """
+        key = (self.__class__, getattr(self, "storage_location", None),
+               getattr(self, "unique_prefix", None), lock_name)
+        self._append_lock.acquire()
+        try:
+            lock = self._named_locks.get(key)
+            if lock is None:
+                lock = self._named_locks[key] = threading.RLock()
+            return lock
+        finally:
+            self._append_lock.release()
+
+    def __get_index_lock(self):
+        return self._getLock("index")
+
+    # Serializes changes to the index of resource summaries
+    _index_lock = property(__get_index_lock)
+
     def loadFile(self, file_name):
         """
         Load the specified file from storage.
@@ -21,6 +171,26 @@ class BaseStorage(object):
         """
         pass
 
+    def openFile(self, file_name):
+        """
+        Open the specified file for streaming its contents.
+
+        Storage classes, which can read a file in pieces, should
+        override this. The default implementation loads the whole
+        file into memory.
+
+        @param file_name:    Name of the selected file.
+        @type file_name:     string
+
+        @return              Body from which the file contents can be read.
+        @rtype               StreamedBody
+
+        """
+        # Imported here, since glu.core depends on the storage classes
+        from glu.core.util import StreamedBody
+        buf = self.loadFile(file_name)
+        return StreamedBody(StringIO.StringIO(buf), len(buf))
+
     def storeFile(self, file_name, data):
         """
         Store the specified file in storage.
@@ -34,6 +204,49 @@ class BaseStorage(object):
         """
         pass
 
+    def storeStream(self, file_name, stream):
+        """
+        Store the contents of a file-like object in storage.
+
+        Storage classes, which can write a file in pieces, should
+        override this. The default implementation reads the whole
+        stream into memory and calls storeFile().
+
+        @param file_name:    Name of the file.
+        @type file_name:     string
+
+        @param stream:       Object from which the file contents are read.
+        @type stream:        file-like object
+
+        """
+        self.storeFile(file_name, stream.read())
+
+    def appendFile(self, file_name, data):
+        """
+        Append data to the specified file.
+
+        The file is created if it does not exist yet. Storage classes,
+        which can append without rewriting the file, should override
+        this. The default implementation loads the file and stores it
+        again with the data appended.
+
+        @param file_name:    Name of the file.
+        @type file_name:     string
+
+        @param data:         Buffer containing the data to append.
+        @type data:          string
+
+        """
+        self._append_lock.acquire()
+        try:
+            try:
+                buf = self.loadFile(file_name)
+            except GluFileNotFound:
+                buf = ""
+            self.storeFile(file_name, buf + data)
+        finally:
+            self._append_lock.release()
+
     def deleteFile(self, file_name):
         """
         Delete the specified file from storage.
@@ -44,12 +257,92 @@ class BaseStorage(object):
         """
         pass
 
-    def listFiles(self):
+    def renameFile(self, old_name, new_name):
+        """
+        Give a stored file a new name.
+
+        A file with the new name is replaced. Storage classes, which can
+        rename without copying, should override this. The default
+        implementation copies the file and deletes the original.
+
+        @param old_name:     Current name of the file.
+        @type old_name:      string
+
+        @param new_name:     New name of the file.
+        @type new_name:      string
+
+        """
+        self.storeFile(new_name, self.loadFile(old_name))
+        self.deleteFile(old_name)
+
+    def getFileVersion(self, file_name):
+        """
+        Return a cheap validator for the current version of a file.
+
+        The validator changes whenever the file is rewritten, which allows
+        callers to detect edits without reading the file again.
+
+        @param file_name:    Name of the selected file.
+        @type file_name:     string
+
+        @return              Validator or None if the file does not exist.
+        @rtype               object
+
+        """
+        pass
+
+    def getFileModificationTime(self, file_name):
+        """
+        Return the time at which a file was last written.
+
+        Storage classes, which keep track of this, should override
+        this. The default implementation returns None.
+
+        @param file_name:    Name of the selected file.
+        @type file_name:     string
+
+        @return              Seconds since the epoch or None if not known
+                             (or the file does not exist).
+        @rtype               float
+
         """
-        Return list of all files in the storage.
+        return None
+
+    def listFiles(self, prefix=None, limit=None, cursor=None):
+        """
+        Return list of files in the storage, ordered by name.
+
+        Large listings can be retrieved page by page: Pass the 'next_cursor'
+        of the returned list as the cursor of the next call. The order
+        of the names, and the format of the cursor, is up to the storage
+        class.
+
+        @param prefix:           Only names starting with this prefix are returned.
+        @type prefix:            string
+
+        @param limit:            Maximum number of names to return. All names
+                                 are returned if not specified.
+        @type limit:             int
+
+        @param cursor:           Continuation cursor returned with the previous page.
+        @type cursor:            string
 
         @return:                 List of file names.
-        @rtype:                  list
+        @rtype:                  FileList
+
+        """
+        pass
+
+    def syncFiles(self, file_names):
+        """
+        Make sure that the specified files have been written to disk.
+
+        Storage classes, whose writes may still sit in operating system
+        buffers after returning, should override this. The default
+        implementation does nothing.
+
+        @param file_names:       Names of the files.
+        @type file_names:        list
 
         """
         pass
@@ -61,12 +354,32 @@ class BaseStorage(object):
         @param resource_name:    Name of the selected resource.
         @type resource_name:     string
 
-        @return                  Buffer containing the resource definition
-                                 as a JSON string or None if not found.
-        @rtype                   string
+        @return                  A Python dictionary representation or None
+                                 if not found.
+        @rtype                   dict
 
         """
-        pass
+        try:
+            buf = self.loadFile(resource_name)
+        except GluFileNotFound, e:
+            return None
+        obj = json.loads(buf)
+        return obj
+
+    def getResourceVersion(self, resource_name):
+        """
+        Return a cheap validator for the current version of a resource definition.
+
+        @param resource_name:    Name of the selected resource.
+        @type resource_name:     string
+
+        @return                  Validator, which changes whenever the resource
+                                 is rewritten, or None if the resource does
+                                 not exist.
+        @rtype                   tuple
+
+        """
+        return self.getFileVersion(resource_name)
 
     def deleteResourceFromStorage(self, resource_name):
         """
@@ -76,19 +389,27 @@ class BaseStorage(object):
         @type resource_name:     string
 
         """
-        pass
+        self.deleteFile(resource_name)
+        self._updateResourceIndex(resource_name, None)
 
     def listResourcesInStorage(self):
         """
         Return list of resources which we currently have in storage.
 
+        Consider listResourceSummaries() if you only need the public
+        information about the resources.
+
         @return:                 List of resource names.
         @rtype:                  list
 
         """
-        pass
+        try:
+            dir_list = self.listFiles()
+            return dir_list
+        except Exception, e:
+            raise GluException("Problems getting resource list from storage: " + str(e))
 
-    def writeResourceToStorage(resource_name, resource_def):
+    def writeResourceToStorage(self, resource_name, resource_def):
         """
         Store a resource definition.
         
@@ -98,10 +419,204 @@ class BaseStorage(object):
         @type  resource_name: string
         
         @param resource_def: The dictionary containing the resource definition.
-        @type  resource_def: string
+        @type  resource_def: dict
         
         @raise GluException: If the resource cannot be stored.
             
         """
-        pass
+        try:
+            buf = json.dumps(resource_def, indent=4)
+            self.storeFile(resource_name, buf)
+            self._updateResourceIndex(resource_name, resource_def)
+        except Exception, e:
+            raise GluException("Problems storing new resource: " + str(e))
+
+    def _getResourceIndex(self):
+        """
+        Return the index of public resource summaries.
+
+        The index is kept in memory and is only read again if the stored
+        index was changed by someone else. If the index is missing or
+        corrupt then it is rebuilt from the stored resources.
+
+        @return:                 Tuple of dictionary of summaries, keyed by
+                                 resource name, and a sorted list of the names.
+        @rtype:                  tuple
 
+        """
+        version = self.getFileVersion(RESOURCE_INDEX_NAME)
+        if version is None:
+            return self.rebuildResourceIndex()
+        if version != getattr(self, "_index_version", None):
+            try:
+                summaries, changes = _parseResourceIndex(self.loadFile(RESOURCE_INDEX_NAME))
+            except Exception, e:
+                log("Corrupt resource index, rebuilding it: %s" % str(e), facility=LOGF_RESOURCES)
+                return self.rebuildResourceIndex()
+            names = summaries.keys()
+            names.sort()
+            self._index, self._index_names, self._index_version = summaries, names, version
+            self._index_changes = changes
+        return self._index, self._index_names
+
+    def __storeResourceIndex(self, summaries, names):
+        """
+        Write a snapshot of the index of resource summaries and remember it in memory.
+
+        """
+        self.storeFile(RESOURCE_INDEX_NAME, json.dumps(summaries) + "\n")
+        self._index, self._index_names = summaries, names
+        self._index_changes = 0
+        self._index_version = self.getFileVersion(RESOURCE_INDEX_NAME)
+
+    def rebuildResourceIndex(self):
+        """
+        Rebuild the index of public resource summaries from the stored resources.
+
+        This needs to load every single resource definition. It is done
+        automatically when the index is missing or corrupt.
+
+        @return:                 Tuple of dictionary of summaries, keyed by
+                                 resource name, and a sorted list of the names.
+        @rtype:                  tuple
+
+        """
+        summaries = dict()
+        for resource_name in self.listResourcesInStorage():
+            try:
+                summaries[resource_name] = _makeResourceSummary(self.loadResourceFromStorage(resource_name))
+            except Exception, e:
+                log("Resource '%s' not added to index: %s" % (resource_name, str(e)), facility=LOGF_RESOURCES)
+        names = summaries.keys()
+        names.sort()
+        self._index_lock.acquire()
+        try:
+            self.__storeResourceIndex(summaries, names)
+        finally:
+            self._index_lock.release()
+        return summaries, names
+
+    def _updateResourceIndex(self, resource_name, resource_def):
+        """
+        Add, update or remove a single entry in the index of resource summaries.
+
+        The change is appended to the stored index as a single record. Only
+        when there are more change records than resources (and at least
+        settings.RESOURCE_INDEX_SLACK) is a new snapshot of the index written.
+
+        @param resource_name:    Name of the resource.
+        @type resource_name:     string
+
+        @param resource_def:     The complete resource definition, or None
+                                 if the resource was deleted.
+        @type resource_def:      dict
+
+        """
+        if resource_def is None:
+            summary = None
+        else:
+            summary = _makeResourceSummary(resource_def)
+        self._index_lock.acquire()
+        try:
+            summaries, names = self._getResourceIndex()
+            # Readers use the index without the lock, so it is not changed in
+            # place. They tolerate names without summary, so the new name list
+            # and dictionary don't need to be put in place at the same time.
+            summaries = dict(summaries)
+            if summary is None:
+                if resource_name in summaries:
+                    del summaries[resource_name]
+                    names = [ name for name in names if name != resource_name ]
+            else:
+                if resource_name not in summaries:
+                    names = list(names)
+                    bisect.insort(names, resource_name)
+                summaries[resource_name] = summary
+            self._index, self._index_names = summaries, names
+            if self._index_changes >= max(settings.RESOURCE_INDEX_SLACK, len(summaries)):
+                self.__storeResourceIndex(summaries, names)
+            else:
+                self.appendFile(RESOURCE_INDEX_NAME, json.dumps([ resource_name, summary ]) + "\n")
+                self._index_changes += 1
+                # We hold the index lock, so nobody else can have changed the index meanwhile
+                self._index_version = self.getFileVersion(RESOURCE_INDEX_NAME)
+        finally:
+            self._index_lock.release()
+
+    def listResourceSummaries(self, limit=None, cursor=None):
+        """
+        Return the public summaries of stored resources, ordered by name.
+
+        The summaries are taken from the resource index, so no resource
+        definition has to be loaded.
+
+        @param limit:            Maximum number of summaries to return.
+        @type limit:             int
+
+        @param cursor:           Continuation cursor returned with the previous page.
+        @type cursor:            string
+
+        @return:                 Tuple of a list of (name, summary) tuples and the
+                                 cursor for the next page (None if this was the last page).
+                                 Each summary is a dictionary with 'uri' and 'desc'.
+        @rtype:                  tuple
+
+        """
+        summaries, names = self._getResourceIndex()
+        page, next_cursor = _pageOfSortedNames(names, limit, cursor)
+        out = list()
+        for name in page:
+            summary = summaries.get(name)
+            if summary is not None:
+                out.append((name, summary))
+        return out, next_cursor
+
+
+def _parseResourceIndex(buf):
+    """
+    Read the stored index of resource summaries.
+
+    @param buf:              Contents of the stored index.
+    @type buf:               string
+
+    @return:                 Tuple of dictionary of summaries, keyed by resource
+                             name, and the number of change records since the
+                             last snapshot.
+    @rtype:                  tuple
+
+    @raise Exception:        If the index is malformed.
+
+    """
+    summaries = dict()
+    changes   = 0
+    for line in buf.splitlines():
+        if not line.strip():
+            continue
+        record = json.loads(line)
+        if type(record) is dict:
+            summaries = record
+            changes   = 0
+        elif type(record) is list  and  len(record) == 2:
+            name, summary = record
+            if summary is None:
+                summaries.pop(name, None)
+            else:
+                summaries[name] = summary
+            changes += 1
+        else:
+            raise Exception("Malformed record in index")
+    return summaries, changes
+
+def _makeResourceSummary(resource_def):
+    """
+    Extract the public summary of a resource for the resource index.
+
+    @param resource_def:     The complete resource definition.
+    @type resource_def:      dict
+
+    @return:                 Dictionary with 'uri' and 'desc'.
+    @rtype:                  dict
+
+    """
+    public_def = resource_def['public']
+    return dict(uri=public_def['uri'], desc=public_def['desc'])
@@ -0,0 +1,308 @@
+"""
+Storage abstraction that keeps recently read files in memory.
+
+All caching storage objects of the process share one LRU cache, whose
+total size is limited to settings.STORAGE_CACHE_MAX_BYTES. Files larger
+than settings.STORAGE_CACHE_MAX_ITEM are never cached.
+
+Writes through a caching storage object remove the file from the cache.
+If settings.STORAGE_CACHE_VALIDATE is set, the version of a file is
+checked on every read as well, so that changes made by other processes
+(or through storage objects without caching) are noticed.
+
+"""
+# Python imports
+import StringIO
+import threading
+
+# Glu imports
+import glu.settings as settings
+
+from glu.exceptions                      import *
+from glu.storageabstraction.base_storage import BaseStorage
+
+_cache      = None
+_cache_lock = threading.Lock()
+
+
+def _getCache():
+    """
+    Return the cache shared by all caching storage objects.
+
+    """
+    global _cache
+    _cache_lock.acquire()
+    try:
+        if _cache is None:
+            # Imported here, since glu.core depends on the storage classes
+            from glu.core.util import LruCache
+            _cache = LruCache(None, max_bytes=settings.STORAGE_CACHE_MAX_BYTES)
+        return _cache
+    finally:
+        _cache_lock.release()
+
+
+def getCacheStats():
+    """
+    Return the usage counters of the storage cache.
+
+    @return:  Dictionary with size, hit, miss and eviction counts.
+    @rtype:   dict
+
+    """
+    return _getCache().getStats()
+
+
+class CachingStorage(BaseStorage):
+    """
+    Serves the files of another storage object from memory, if possible.
+
+    """
+    def __init__(self, storage, cache_name):
+        """
+        Initialize the caching storage.
+
+        @param storage:      Storage from which files are read.
+        @type storage:       BaseStorage
+
+        @param cache_name:   Unique name of the namespace, used to tell the
+                             files of different namespaces apart in the cache.
+        @type cache_name:    string
+
+        """
+        self.storage    = storage
+        self.cache_name = cache_name
+        self.cache      = _getCache()
+
+    def __key(self, file_name):
+        return (self.cache_name, file_name)
+
+    def __version(self, file_name):
+        """
+        Return the version of a file, against which cached contents are validated.
+
+        @return:    Tuple of the version (None if not validated) and a flag,
+                    which is set if validation found that the file does not
+                    exist (for example, it was deleted by another process).
+        @rtype:     tuple
+
+        """
+        if settings.STORAGE_CACHE_VALIDATE:
+            version = self.storage.getFileVersion(file_name)
+            if version is None:
+                # Must not be served from the cache
+                self.__invalidate(file_name)
+                return None, True
+            return version, False
+        return None, False
+
+    def __invalidate(self, file_name):
+        self.cache.invalidate(self.__key(file_name))
+
+    def __cached(self, file_name, version):
+        return self.cache.get(self.__key(file_name), validator=version)
+
+    def __put(self, file_name, buf, version, generation):
+        if len(buf) <= settings.STORAGE_CACHE_MAX_ITEM:
+            self.cache.put(self.__key(file_name), buf, validator=version, generation=generation, size=len(buf))
+
+    def loadFile(self, file_name):
+        """
+        Load the specified file from the cache or storage.
+
+        @param file_name:    Name of the selected file.
+        @type file_name:     string
+
+        @return              Buffer containing the file contents.
+        @rtype               string
+
+        """
+        version, missing = self.__version(file_name)
+        if missing:
+            # Raises the proper error, unless the file was stored again meanwhile
+            return self.storage.loadFile(file_name)
+        buf = self.__cached(file_name, version)
+        if buf is None:
+            # Remember the generation first: If the file is written while
+            # we load it, the (then outdated) contents are not cached.
+            generation = self.cache.generation
+            buf        = self.storage.loadFile(file_name)
+            self.__put(file_name, buf, version, generation)
+        return buf
+
+    def openFile(self, file_name):
+        """
+        Open the specified file for streaming its contents.
+
+        Small files are read completely and cached, larger files are
+        streamed from the storage.
+
+        @param file_name:    Name of the selected file.
+        @type file_name:     string
+
+        @return              Body from which the file contents can be read.
+        @rtype               StreamedBody
+
+        """
+        # Imported here, since glu.core depends on the storage classes
+        from glu.core.util import StreamedBody
+        version, missing = self.__version(file_name)
+        if missing:
+            return self.storage.openFile(file_name)
+        buf = self.__cached(file_name, version)
+        if buf is None:
+            generation = self.cache.generation
+            body       = self.storage.openFile(file_name)
+            if body.length is None  or  body.length > settings.STORAGE_CACHE_MAX_ITEM:
+                return body
+            buf = body.read()
+            self.__put(file_name, buf, version, generation)
+        return StreamedBody(StringIO.StringIO(buf), len(buf))
+
+    def storeFile(self, file_name, data):
+        """
+        Store the specified file in storage.
+
+        @param file_name:    Name of the file.
+        @type file_name:     string
+
+        @param data:         Buffer containing the file contents.
+        @type data:          string
+
+        """
+        try:
+            self.storage.storeFile(file_name, data)
+        finally:
+            self.__invalidate(file_name)
+
+    def storeStream(self, file_name, stream):
+        """
+        Store the contents of a file-like object in storage.
+
+        @param file_name:    Name of the file.
+        @type file_name:     string
+
+        @param stream:       Object from which the file contents are read.
+        @type stream:        file-like object
+
+        """
+        try:
+            self.storage.storeStream(file_name, stream)
+        finally:
+            self.__invalidate(file_name)
+
+    def appendFile(self, file_name, data):
+        """
+        Append data to the specified file.
+
+        @param file_name:    Name of the file.
+        @type file_name:     string
+
+        @param data:         Buffer containing the data to append.
+        @type data:          string
+
+        """
+        try:
+            self.storage.appendFile(file_name, data)
+        finally:
+            self.__invalidate(file_name)
+
+    def deleteFile(self, file_name):
+        """
+        Delete the specified file from storage.
+
+        @param file_name:    Name of the selected file.
+        @type file_name:     string
+
+        """
+        try:
+            self.storage.deleteFile(file_name)
+        finally:
+            self.__invalidate(file_name)
+
+    def renameFile(self, old_name, new_name):
+        """
+        Give a stored file a new name.
+
+        @param old_name:     Current name of the file.
+        @type old_name:      string
+
+        @param new_name:     New name of the file.
+        @type new_name:      string
+
+        """
+        try:
+            self.storage.renameFile(old_name, new_name)
+        finally:
+            self.__invalidate(old_name)
+            self.__invalidate(new_name)
+
+    def _getLock(self, lock_name):
+        """
+        Return the lock of the underlying storage for the given name.
+
+        @param lock_name:    Name of the lock.
+        @type lock_name:     string
+
+        @return:             The lock.
+        @rtype:              object with acquire() and release()
+
+        """
+        return self.storage._getLock(lock_name)
+
+    def getFileVersion(self, file_name):
+        """
+        Return a cheap validator for the current version of a file.
+
+        @param file_name:    Name of the selected file.
+        @type file_name:     string
+
+        @return              Validator or None if the file does not exist.
+        @rtype               object
+
+        """
+        return self.storage.getFileVersion(file_name)
+
+    def getFileModificationTime(self, file_name):
+        """
+        Return the time at which a file was last written.
+
+        @param file_name:    Name of the selected file.
+        @type file_name:     string
+
+        @return              Seconds since the epoch or None if not known.
+        @rtype               float
+
+        """
+        return self.storage.getFileModificationTime(file_name)
+
+    def listFiles(self, prefix=None, limit=None, cursor=None):
+        """
+        Return list of files in the storage.
+
+        Listings are not cached.
+
+        @param prefix:           Only names starting with this prefix are returned.
+        @type prefix:            string
+
+        @param limit:            Maximum number of names to return.
+        @type limit:             int
+
+        @param cursor:           Continuation cursor returned with the previous page.
+        @type cursor:            string
+
+        @return:                 List of file names.
+        @rtype:                  FileList
+
+        """
+        return self.storage.listFiles(prefix=prefix, limit=limit, cursor=cursor)
+
+    def syncFiles(self, file_names):
+        """
+        Make sure that the specified files have been written to disk.
+
+        @param file_names:       Names of the files.
+        @type file_names:        list
+
+        """
+        self.storage.syncFiles(file_names)
@@ -0,0 +1,334 @@
+"""
+Storage abstraction that records a feed of the changes to a namespace.
+
+Every store, append, delete and rename gets the next number of a change
+sequence of the namespace. Clients remember the cursor of the last change
+they have seen and ask for the newer changes only, instead of listing all
+files again. They may also wait for the next change (long-polling).
+
+The feed is kept in memory, for the last settings.STORAGE_CHANGES_RETAIN
+changes of each namespace. Each feed has an epoch, which is chosen when
+the namespace is first used by the process. A cursor consists of epoch
+and sequence number. If the epoch of a cursor is not the current one (the
+server was restarted, or the request went to another process) or its
+changes are no longer retained, the client is told to reset: It has to
+list the files again and continue with the returned cursor.
+
+Files with reserved names (starting with '.') are not included.
+
+"""
+# Python imports
+import time
+import uuid
+import threading
+
+# Glu imports
+import glu.settings as settings
+
+from glu.exceptions                      import *
+from glu.storageabstraction.base_storage import BaseStorage
+
+CHANGE_STORE  = "store"
+CHANGE_APPEND = "append"
+CHANGE_DELETE = "delete"
+
+
+class _ChangeFeed(object):
+    """
+    The retained changes of one namespace.
+
+    Sequence numbers have no gaps, so the position of a change in
+    the list follows from its number.
+
+    """
+    def __init__(self):
+        self.epoch   = uuid.uuid4().hex[:8]
+        self.cond    = threading.Condition(threading.Lock())
+        self.entries = list()    # (sequence number, change, file name), oldest first
+        self.seq     = 0         # Sequence number of the latest change
+
+    def add(self, change, file_name):
+        self.cond.acquire()
+        try:
+            self.seq += 1
+            self.entries.append((self.seq, change, file_name))
+            if len(self.entries) > 2 * settings.STORAGE_CHANGES_RETAIN:
+                # Trimmed in bulk, so that adding stays cheap
+                del self.entries[:-settings.STORAGE_CHANGES_RETAIN]
+            self.cond.notifyAll()
+        finally:
+            self.cond.release()
+
+    def get(self, since, limit, wait):
+        """
+        Return the changes after a sequence number.
+
+        @return:    Tuple of the list of changes and the sequence number to
+                    continue with. The list is None if the changes after
+                    'since' are not known.
+        @rtype:     tuple
+
+        """
+        self.cond.acquire()
+        try:
+            if self.entries:
+                oldest = self.entries[0][0] - 1
+            else:
+                oldest = self.seq
+            if since is None  or  since < oldest  or  since > self.seq:
+                return None, self.seq
+            deadline = time.time() + wait
+            while since == self.seq:
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    break
+                self.cond.wait(remaining)
+            if since == self.seq:
+                return [], since
+            # The list may have been trimmed while we waited
+            if since < self.entries[0][0] - 1:
+                return None, self.seq
+            start   = since - self.entries[0][0] + 1
+            changes = self.entries[start:start + (limit or len(self.entries))]
+            if changes:
+                since = changes[-1][0]
+            return changes, since
+        finally:
+            self.cond.release()
+
+
+#
+# One feed per namespace, shared by all storage objects for that namespace.
+#
+_feeds      = dict()
+_feeds_lock = threading.Lock()
+
+
+class ChangeFeedStorage(BaseStorage):
+    """
+    Records the changes made through it to another storage object.
+
+    """
+    def __init__(self, storage, feed_name):
+        """
+        Initialize the change feed storage.
+
+        @param storage:      Storage to which the changes are passed on.
+        @type storage:       BaseStorage
+
+        @param feed_name:    Unique name of the namespace. All storage objects
+                             for the same namespace need to use the same name,
+                             so that they share the feed.
+        @type feed_name:     string
+
+        """
+        self.storage = storage
+        _feeds_lock.acquire()
+        try:
+            feed = _feeds.get(feed_name)
+            if feed is None:
+                feed = _feeds[feed_name] = _ChangeFeed()
+        finally:
+            _feeds_lock.release()
+        self.feed = feed
+
+    def __record(self, change, file_name):
+        if not file_name.startswith("."):
+            self.feed.add(change, file_name)
+
+    def getChanges(self, cursor, limit=None, wait=0):
+        """
+        Return the changes after a cursor.
+
+        @param cursor:       Cursor returned with the changes seen last, or None
+                             to get just the cursor of the latest change.
+        @type cursor:        string
+
+        @param limit:        Maximum number of changes to return.
+        @type limit:         int
+
+        @param wait:         Number of seconds to wait for a change, if there
+                             are no changes after the cursor yet.
+        @type wait:          number
+
+        @return:             Tuple of the changes, as a list of (sequence number,
+                             change, file name) tuples, the cursor to continue with
+                             and a flag, which is set if the changes after the given
+                             cursor are not known. In that case, the list is empty.
+        @rtype:              tuple
+
+        """
+        since = None
+        if cursor is not None:
+            epoch, _, seq = cursor.partition(":")
+            if not seq.isdigit():
+                raise GluBadRequest("Malformed change cursor '%s'" % cursor)
+            if epoch == self.feed.epoch:
+                since = int(seq)
+        changes, since = self.feed.get(since, limit, wait)
+        reset          = changes is None  and  cursor is not None
+        return changes or [], "%s:%d" % (self.feed.epoch, since), reset
+
+    def loadFile(self, file_name):
+        """
+        Load the specified file from storage.
+
+        @param file_name:    Name of the selected file.
+        @type file_name:     string
+
+        @return              Buffer containing the file contents.
+        @rtype               string
+
+        """
+        return self.storage.loadFile(file_name)
+
+    def openFile(self, file_name):
+        """
+        Open the specified file for streaming its contents.
+
+        @param file_name:    Name of the selected file.
+        @type file_name:     string
+
+        @return              Body from which the file contents can be read.
+        @rtype               StreamedBody
+
+        """
+        return self.storage.openFile(file_name)
+
+    def storeFile(self, file_name, data):
+        """
+        Store the specified file in storage.
+
+        @param file_name:    Name of the file.
+        @type file_name:     string
+
+        @param data:         Buffer containing the file contents.
+        @type data:          string
+
+        """
+        self.storage.storeFile(file_name, data)
+        self.__record(CHANGE_STORE, file_name)
+
+    def storeStream(self, file_name, stream):
+        """
+        Store the contents of a file-like object in storage.
+
+        @param file_name:    Name of the file.
+        @type file_name:     string
+
+        @param stream:       Object from which the file contents are read.
+        @type stream:        file-like object
+
+        """
+        self.storage.storeStream(file_name, stream)
+        self.__record(CHANGE_STORE, file_name)
+
+    def appendFile(self, file_name, data):
+        """
+        Append data to the specified file.
+
+        @param file_name:    Name of the file.
+        @type file_name:     string
+
+        @param data:         Buffer containing the data to append.
+        @type data:          string
+
+        """
+        self.storage.appendFile(file_name, data)
+        self.__record(CHANGE_APPEND, file_name)
+
+    def deleteFile(self, file_name):
+        """
+        Delete the specified file from storage.
+
+        @param file_name:    Name of the selected file.
+        @type file_name:     string
+
+        """
+        self.storage.deleteFile(file_name)
+        self.__record(CHANGE_DELETE, file_name)
+
+    def renameFile(self, old_name, new_name):
+        """
+        Give a stored file a new name.
+
+        Recorded as the deletion of the old and the storing of the new name.
+
+        @param old_name:     Current name of the file.
+        @type old_name:      string
+
+        @param new_name:     New name of the file.
+        @type new_name:      string
+
+        """
+        self.storage.renameFile(old_name, new_name)
+        self.__record(CHANGE_DELETE, old_name)
+        self.__record(CHANGE_STORE, new_name)
+
+    def _getLock(self, lock_name):
+        """
+        Return the lock of the underlying storage for the given name.
+
+        @param lock_name:    Name of the lock.
+        @type lock_name:     string
+
+        @return:             The lock.
+        @rtype:              object with acquire() and release()
+
+        """
+        return self.storage._getLock(lock_name)
+
+    def getFileVersion(self, file_name):
+        """
+        Return a cheap validator for the current version of a file.
+
+        @param file_name:    Name of the selected file.
+        @type file_name:     string
+
+        @return              Validator or None if the file does not exist.
+        @rtype               object
+
+        """
+        return self.storage.getFileVersion(file_name)
+
+    def getFileModificationTime(self, file_name):
+        """
+        Return the time at which a file was last written.
+
+        @param file_name:    Name of the selected file.
+        @type file_name:     string
+
+        @return              Seconds since the epoch or None if not known.
+        @rtype               float
+
+        """
+        return self.storage.getFileModificationTime(file_name)
+
+    def listFiles(self, prefix=None, limit=None, cursor=None):
+        """
+        Return list of files in the storage.
+
+        @param prefix:           Only names starting with this prefix are returned.
+        @type prefix:            string
+
+        @param limit:            Maximum number of names to return.
+        @type limit:             int
+
+        @param cursor:           Continuation cursor returned with the previous page.
+        @type cursor:            string
+
+        @return:                 List of file names.
+        @rtype:                  FileList
+
+        """
+        return self.storage.listFiles(prefix=prefix, limit=limit, cursor=cursor)
+
+    def syncFiles(self, file_names):
+        """
+        Make sure that the specified files have been written to disk.
+
+        @param file_names:       Names of the files.
+        @type file_names:        list
+
+        """
+        self.storage.syncFiles(file_names)
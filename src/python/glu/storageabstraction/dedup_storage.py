@@ -0,0 +1,422 @@
+"""
+Storage abstraction that keeps identical contents only once.
+
+The contents of files (blobs) are stored once, under the hash of their
+data, in a blob storage that is shared by all namespaces. In its own
+namespace, a file is just a small pointer to the blob. Each blob has a
+reference count, and the blob is deleted once the last file pointing
+to it is deleted or overwritten.
+
+Files that were stored before this mode was enabled are not pointers.
+They can still be read and deleted as usual.
+
+Reference counts are changed under a lock of the blob storage, which for
+FileStorage also works between processes (where fcntl is available). The
+lock is only held while reference counts and pointers change: The data of
+new blobs is written before, under a temporary name. Readers take no lock.
+When the blob of a file disappears while it is read (because the file was
+overwritten or deleted in the meantime), the pointer is read again.
+
+"""
+# Python imports
+import uuid
+import hashlib
+import StringIO
+
+# Glu imports
+from glu.exceptions                      import *
+from glu.storageabstraction.base_storage import BaseStorage
+
+# Namespace of the blobs, which is shared by all namespaces of a storage location
+BLOB_NAMESPACE = ".blobs"
+
+# Pointer files start with this magic string, followed by the hash of the blob
+_POINTER_MAGIC = "\x89GLB\r\n\x1a\n"
+
+#
+# Name of the lock in the blob storage, under which reference counts are
+# updated. For FileStorage, this is a lock file, so that several processes
+# can share the blob storage.
+#
+_REFCOUNT_LOCK_NAME = "refcounts"
+
+
+class _HashingReader(object):
+    """
+    File-like object, which computes the hash of everything read through it.
+
+    """
+    def __init__(self, stream):
+        self.stream = stream
+        self.hash   = hashlib.sha1()
+
+    def read(self, size=-1):
+        data = self.stream.read(size)
+        self.hash.update(data)
+        return data
+
+
+class DedupStorage(BaseStorage):
+    """
+    Content-addressed storage on top of two other storage objects.
+
+    """
+    def __init__(self, pointer_storage, blob_storage):
+        """
+        Initialize the content-addressed storage.
+
+        @param pointer_storage:  Storage for the names of this namespace.
+        @type pointer_storage:   BaseStorage
+
+        @param blob_storage:     Storage for the blobs, shared by all namespaces.
+        @type blob_storage:      BaseStorage
+
+        """
+        self.pointer_storage = pointer_storage
+        self.blob_storage    = blob_storage
+        self.refcount_lock   = blob_storage._getLock(_REFCOUNT_LOCK_NAME)
+
+    def __get_pointer(self, file_name):
+        """
+        Return the hash of the blob a file points to.
+
+        @return:    Tuple of hash and data. Hash is None (and data is
+                    the content) if the file is not a pointer.
+        @rtype:     tuple
+
+        """
+        buf = self.pointer_storage.loadFile(file_name)
+        if buf.startswith(_POINTER_MAGIC):
+            return buf[len(_POINTER_MAGIC):], None
+        return None, buf
+
+    def __add_reference(self, blob_hash):
+        refs_name = blob_hash + ".refs"
+        try:
+            count = int(self.blob_storage.loadFile(refs_name))
+        except GluFileNotFound:
+            count = 0
+        self.blob_storage.storeFile(refs_name, str(count + 1))
+
+    def __remove_reference(self, blob_hash):
+        refs_name = blob_hash + ".refs"
+        try:
+            count = int(self.blob_storage.loadFile(refs_name)) - 1
+        except GluFileNotFound:
+            count = 0
+        if count > 0:
+            self.blob_storage.storeFile(refs_name, str(count))
+        else:
+            # Nobody points to this blob anymore
+            for name in [ blob_hash, refs_name ]:
+                try:
+                    self.blob_storage.deleteFile(name)
+                except GluFileNotFound:
+                    pass
+
+    def __point_to(self, file_name, blob_hash):
+        """
+        Make a file point to a stored blob, releasing any blob it pointed to before.
+
+        Needs to be called with the reference count lock held.
+
+        """
+        try:
+            old_hash, dummy = self.__get_pointer(file_name)
+        except GluFileNotFound:
+            old_hash = None
+        self.__add_reference(blob_hash)
+        self.pointer_storage.storeFile(file_name, _POINTER_MAGIC + blob_hash)
+        if old_hash:
+            self.__remove_reference(old_hash)
+
+    def __read(self, file_name, read_blob):
+        """
+        Read a file through its pointer.
+
+        The blob is released by whoever overwrites or deletes the file, which
+        may happen after we read the pointer. If the blob is gone, the pointer
+        is therefore read again and followed to the new blob.
+
+        @param file_name:    Name of the selected file.
+        @type file_name:     string
+
+        @param read_blob:    Function that reads a blob, given its hash.
+        @type read_blob:     callable
+
+        @return:             Tuple of the result of read_blob() and the contents
+                             of the file, only one of which is not None.
+        @rtype:              tuple
+
+        """
+        blob_hash, buf = self.__get_pointer(file_name)
+        while blob_hash:
+            try:
+                return read_blob(blob_hash), None
+            except GluFileNotFound:
+                new_hash, buf = self.__get_pointer(file_name)
+                if new_hash == blob_hash:
+                    raise
+                blob_hash = new_hash
+        return None, buf
+
+    def __store_blob(self, file_name, blob_hash, tmp_name):
+        """
+        Make a file point to a blob, whose data was written under a temporary name.
+
+        The temporary file becomes the blob, unless the blob is stored already.
+        Only this is done while holding the reference count lock.
+
+        @param tmp_name:     Temporary name of the data or None, if the blob
+                             existed when the caller checked.
+        @type tmp_name:      string
+
+        @return:             False if there is no temporary file, and the blob
+                             was released in the meantime. The caller needs to
+                             store the data after all.
+        @rtype:              boolean
+
+        """
+        self.refcount_lock.acquire()
+        try:
+            exists = self.blob_storage.getFileVersion(blob_hash) is not None
+            if tmp_name:
+                if exists:
+                    self.blob_storage.deleteFile(tmp_name)
+                else:
+                    self.blob_storage.renameFile(tmp_name, blob_hash)
+            elif not exists:
+                return False
+            self.__point_to(file_name, blob_hash)
+            return True
+        finally:
+            self.refcount_lock.release()
+
+    def loadFile(self, file_name):
+        """
+        Load the specified file from storage.
+
+        @param file_name:    Name of the selected file.
+        @type file_name:     string
+
+        @return              Buffer containing the file contents.
+        @rtype               string
+
+        """
+        blob, buf = self.__read(file_name, self.blob_storage.loadFile)
+        if blob is not None:
+            return blob
+        return buf
+
+    def openFile(self, file_name):
+        """
+        Open the specified file for streaming its contents.
+
+        @param file_name:    Name of the selected file.
+        @type file_name:     string
+
+        @return              Body from which the file contents can be read.
+        @rtype               StreamedBody
+
+        """
+        # Imported here, since glu.core depends on the storage classes
+        from glu.core.util import StreamedBody
+        body, buf = self.__read(file_name, self.blob_storage.openFile)
+        if body is not None:
+            return body
+        return StreamedBody(StringIO.StringIO(buf), len(buf))
+
+    def storeFile(self, file_name, data):
+        """
+        Store the specified file in storage.
+
+        The data is only written if no file with the same contents
+        is stored yet.
+
+        @param file_name:    Name of the file.
+        @type file_name:     string
+
+        @param data:         Buffer containing the file contents.
+        @type data:          string
+
+        """
+        blob_hash = hashlib.sha1(data).hexdigest()
+        if self.blob_storage.getFileVersion(blob_hash) is not None:
+            if self.__store_blob(file_name, blob_hash, None):
+                return
+            # The blob was released in the meantime: Store the data after all
+        tmp_name = ".tmp-%s" % uuid.uuid4().hex
+        self.blob_storage.storeFile(tmp_name, data)
+        self.__store_blob(file_name, blob_hash, tmp_name)
+
+    def storeStream(self, file_name, stream):
+        """
+        Store the contents of a file-like object in storage.
+
+        The hash is only known once the stream has been read. So, the data
+        is first stored under a temporary name in the blob storage, which
+        is then either renamed or - if the contents are stored already -
+        deleted.
+
+        @param file_name:    Name of the file.
+        @type file_name:     string
+
+        @param stream:       Object from which the file contents are read.
+        @type stream:        file-like object
+
+        """
+        reader   = _HashingReader(stream)
+        tmp_name = ".tmp-%s" % uuid.uuid4().hex
+        self.blob_storage.storeStream(tmp_name, reader)
+        self.__store_blob(file_name, reader.hash.hexdigest(), tmp_name)
+
+    def appendFile(self, file_name, data):
+        """
+        Append data to the specified file.
+
+        Blobs are shared, so they cannot be changed: The appended
+        contents are stored as a new blob. Appends are serialized
+        by a lock of this namespace.
+
+        @param file_name:    Name of the file.
+        @type file_name:     string
+
+        @param data:         Buffer containing the data to append.
+        @type data:          string
+
+        """
+        lock = self._getLock("append")
+        lock.acquire()
+        try:
+            try:
+                buf = self.loadFile(file_name)
+            except GluFileNotFound:
+                buf = ""
+            self.storeFile(file_name, buf + data)
+        finally:
+            lock.release()
+
+    def deleteFile(self, file_name):
+        """
+        Delete the specified file from storage.
+
+        The blob of the file is deleted as well, if no other file points to it.
+
+        @param file_name:    Name of the selected file.
+        @type file_name:     string
+
+        """
+        self.refcount_lock.acquire()
+        try:
+            blob_hash, dummy = self.__get_pointer(file_name)
+            self.pointer_storage.deleteFile(file_name)
+            if blob_hash:
+                self.__remove_reference(blob_hash)
+        finally:
+            self.refcount_lock.release()
+
+    def renameFile(self, old_name, new_name):
+        """
+        Give a stored file a new name.
+
+        Only the pointer is moved, the blob stays where it is.
+
+        @param old_name:     Current name of the file.
+        @type old_name:      string
+
+        @param new_name:     New name of the file.
+        @type new_name:      string
+
+        """
+        self.refcount_lock.acquire()
+        try:
+            try:
+                old_hash, dummy = self.__get_pointer(new_name)
+            except GluFileNotFound:
+                old_hash = None
+            self.pointer_storage.renameFile(old_name, new_name)
+            if old_hash:
+                self.__remove_reference(old_hash)
+        finally:
+            self.refcount_lock.release()
+
+    def _getLock(self, lock_name):
+        """
+        Return the lock of the storage for the names of this namespace.
+
+        @param lock_name:    Name of the lock.
+        @type lock_name:     string
+
+        @return:             The lock.
+        @rtype:              object with acquire() and release()
+
+        """
+        return self.pointer_storage._getLock(lock_name)
+
+    def getFileVersion(self, file_name):
+        """
+        Return a cheap validator for the current version of a file.
+
+        Every store rewrites the pointer, so its version will do.
+
+        @param file_name:    Name of the selected file.
+        @type file_name:     string
+
+        @return              Version of the file or None if the file does not exist.
+
+        """
+        return self.pointer_storage.getFileVersion(file_name)
+
+    def getFileModificationTime(self, file_name):
+        """
+        Return the time at which a file was last written.
+
+        @param file_name:    Name of the selected file.
+        @type file_name:     string
+
+        @return              Seconds since the epoch or None if not known.
+        @rtype               float
+
+        """
+        return self.pointer_storage.getFileModificationTime(file_name)
+
+    def syncFiles(self, file_names):
+        """
+        Make sure that the specified files have been written to disk.
+
+        The pointers, as well as the blobs and reference counts they
+        refer to, are synced.
+
+        @param file_names:       Names of the files.
+        @type file_names:        list
+
+        """
+        blob_names = []
+        for file_name in file_names:
+            try:
+                blob_hash, dummy = self.__get_pointer(file_name)
+            except GluFileNotFound:
+                continue
+            if blob_hash:
+                blob_names += [ blob_hash, blob_hash + ".refs" ]
+        self.blob_storage.syncFiles(blob_names)
+        self.pointer_storage.syncFiles(file_names)
+
+    def listFiles(self, prefix=None, limit=None, cursor=None):
+        """
+        Return list of files in the storage.
+
+        @param prefix:           Only names starting with this prefix are returned.
+        @type prefix:            string
+
+        @param limit:            Maximum number of names to return.
+        @type limit:             int
+
+        @param cursor:           Continuation cursor returned with the previous page.
+        @type cursor:            string
+
+        @return:                 List of file names.
+        @rtype:                  FileList
+
+        """
+        return self.pointer_storage.listFiles(prefix=prefix, limit=limit, cursor=cursor)
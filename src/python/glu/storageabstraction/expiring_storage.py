@@ -0,0 +1,608 @@
+"""
+Storage abstraction that lets stored files expire.
+
+A file can be given a time to live when it is written. Once that has
+passed, the file is hidden from reads and listings right away, and it
+is deleted by a background thread soon after. Google App Engine does not
+allow background threads. There, expired files are deleted by the next
+write to or listing of the storage instead.
+
+The expiry times of each namespace are kept in a dictionary. In addition,
+all expiry times of the process are kept in a heap, ordered by time. The
+background thread sleeps until the earliest expiry time, so it never needs
+to scan the stored files. Heap entries are not removed when a file gets a
+new expiry time (or none). Outdated entries are recognized and dropped when
+they reach the top of the heap.
+
+To survive restarts, changes of the expiry times are appended to a journal,
+which is kept in the namespace itself, under the reserved name '.expiry'.
+The journal is read when a namespace is first used by the process, so
+expired files of a namespace are only deleted after that. Expiry times set
+by another process are not noticed until the journal is read again, which
+also happens when it is compacted.
+
+Several processes append to the same journal. Appending and compacting
+are therefore done while holding the storage's lock for the journal
+(see BaseStorage._getLock()), and compacting merges the records that
+other processes wrote into the new journal.
+
+"""
+# Python imports
+import time
+import heapq
+import atexit
+import urllib
+import threading
+
+# Glu imports
+import glu.settings as settings
+
+from glu.exceptions                      import *
+from glu.logger                          import *
+from glu.platform_specifics              import PLATFORM, PLATFORM_GAE
+from glu.storageabstraction.base_storage import BaseStorage, FileList
+
+_JOURNAL_NAME      = ".expiry"
+_JOURNAL_LOCK_NAME = "expiry"
+
+
+class _Sweeper(object):
+    """
+    Deletes expired files, in the order in which they expire.
+
+    The thread is only started once the first expiry time is scheduled.
+    Without a thread, sweepDue() needs to be called from time to time.
+
+    """
+    def __init__(self, threaded=True):
+        self.cond     = threading.Condition(threading.Lock())
+        self.heap     = list()      # (expiry time, file name, index)
+        self.threaded = threaded
+        self.thread   = None
+        self.closed   = False
+
+    def schedule(self, index, file_name, when):
+        """
+        Delete a file of a namespace at the given time, if it has not got a later expiry time by then.
+
+        """
+        self.cond.acquire()
+        try:
+            heapq.heappush(self.heap, (when, file_name, index))
+            if self.thread is None  and  self.threaded:
+                self.thread = threading.Thread(target=self.__run)
+                self.thread.setDaemon(True)
+                self.thread.start()
+            elif self.heap[0][0] == when:
+                # Earlier than what the thread is waiting for
+                self.cond.notifyAll()
+        finally:
+            self.cond.release()
+
+    def sweepDue(self, limit):
+        """
+        Delete files that have expired by now, in the calling thread.
+
+        Must not be called while the lock of an expiry index is held.
+
+        @param limit:   Maximum number of files to look at.
+        @type limit:    int
+
+        """
+        due = list()
+        self.cond.acquire()
+        try:
+            now = time.time()
+            while self.heap  and  self.heap[0][0] <= now  and  len(due) < limit:
+                due.append(heapq.heappop(self.heap))
+        finally:
+            self.cond.release()
+        for when, file_name, index in due:
+            index.sweep(file_name)
+
+    def close(self):
+        """
+        Stop the background thread.
+
+        """
+        self.cond.acquire()
+        try:
+            self.closed = True
+            self.cond.notifyAll()
+            thread = self.thread
+        finally:
+            self.cond.release()
+        if thread:
+            thread.join()
+
+    def __run(self):
+        while True:
+            self.cond.acquire()
+            try:
+                while not self.closed:
+                    now = time.time()
+                    if not self.heap:
+                        self.cond.wait()
+                    elif self.heap[0][0] > now:
+                        self.cond.wait(self.heap[0][0] - now)
+                    else:
+                        break
+                if self.closed:
+                    return
+                due = list()
+                while self.heap  and  self.heap[0][0] <= now:
+                    due.append(heapq.heappop(self.heap))
+            finally:
+                self.cond.release()
+
+            for when, file_name, index in due:
+                index.sweep(file_name)
+            # Files that expire in the meantime are handled together in the next pass
+            time.sleep(settings.STORAGE_EXPIRY_SWEEP_INTERVAL)
+
+
+_sweeper = _Sweeper(threaded = PLATFORM != PLATFORM_GAE)
+
+atexit.register(_sweeper.close)
+
+
+class _ExpiryIndex(object):
+    """
+    The expiry times of the files of one namespace.
+
+    While a file is written, the sweeper leaves it alone, so that it
+    cannot delete the new contents.
+
+    """
+    def __init__(self, storage):
+        self.storage      = storage
+        self.lock         = threading.Lock()
+        self.journal_lock = storage._getLock(_JOURNAL_LOCK_NAME)
+        self.deadlines = dict()   # file name -> expiry time
+        self.writing   = dict()   # file name -> number of writes in progress
+        self.records   = 0        # Number of records in the journal
+        self.expired   = 0        # Number of files deleted by the sweeper
+        self.__load()
+
+    def __read(self):
+        """
+        Read the journal.
+
+        @return:    Tuple of the expiry times, the number of records and a flag,
+                    which is set if the last record was not written completely.
+        @rtype:     tuple
+
+        """
+        deadlines = dict()
+        records   = 0
+        try:
+            journal = self.storage.loadFile(_JOURNAL_NAME)
+        except GluFileNotFound:
+            return deadlines, records, False
+        lines = journal.split("\n")
+        for line in lines[:-1]:
+            try:
+                when, name = line.split(" ", 1)
+                when       = float(when)
+            except ValueError:
+                log("Skipping damaged record in expiry journal: %s" % line)
+                continue
+            name = urllib.unquote(name)
+            if when:
+                deadlines[name] = when
+            else:
+                deadlines.pop(name, None)
+            records += 1
+        return deadlines, records, bool(lines[-1])
+
+    def __load(self):
+        self.deadlines, self.records, incomplete = self.__read()
+        for name, when in self.deadlines.items():
+            _sweeper.schedule(self, name, when)
+        if incomplete:
+            # The last record was not written completely
+            self.__compact()
+
+    def __record(self, name, when):
+        return "%.3f %s\n" % (when, urllib.quote(name))
+
+    def __compact(self):
+        """
+        Replace the journal by one record for each file with an expiry time.
+
+        The journal is read again under the lock, so that the records of
+        other processes are kept. Their expiry times are taken over. The
+        new journal is written before the lock is released, so that their
+        later records are appended to it, rather than being overwritten.
+
+        """
+        self.journal_lock.acquire()
+        try:
+            deadlines, records, incomplete = self.__read()
+            self.storage.storeFile(_JOURNAL_NAME, "".join([ self.__record(name, when)
+                                                            for name, when in deadlines.items() ]))
+            self.storage.syncFiles([ _JOURNAL_NAME ])
+        finally:
+            self.journal_lock.release()
+        for name, when in deadlines.items():
+            if self.deadlines.get(name) != when:
+                _sweeper.schedule(self, name, when)
+        self.deadlines = deadlines
+        self.records   = len(deadlines)
+
+    def __set(self, name, when):
+        """
+        Record a new expiry time (None to remove it). Called with the lock held.
+
+        """
+        if self.deadlines.get(name) == when:
+            return
+        self.journal_lock.acquire()
+        try:
+            self.storage.appendFile(_JOURNAL_NAME, self.__record(name, when or 0))
+        finally:
+            self.journal_lock.release()
+        self.records += 1
+        if when is None:
+            del self.deadlines[name]
+        else:
+            self.deadlines[name] = when
+            _sweeper.schedule(self, name, when)
+        if self.records > len(self.deadlines) + settings.STORAGE_EXPIRY_JOURNAL_SLACK:
+            self.__compact()
+
+    def isExpired(self, name):
+        self.lock.acquire()
+        try:
+            when = self.deadlines.get(name)
+            return when is not None  and  when <= time.time()
+        finally:
+            self.lock.release()
+
+    def beginWrite(self, name):
+        self.lock.acquire()
+        try:
+            self.writing[name] = self.writing.get(name, 0) + 1
+        finally:
+            self.lock.release()
+
+    def endWrite(self, name):
+        self.lock.acquire()
+        try:
+            self.writing[name] -= 1
+            if not self.writing[name]:
+                del self.writing[name]
+        finally:
+            self.lock.release()
+
+    def setExpiry(self, name, when):
+        self.lock.acquire()
+        try:
+            self.__set(name, when)
+        finally:
+            self.lock.release()
+
+    def rename(self, old_name, new_name):
+        self.lock.acquire()
+        try:
+            when = self.deadlines.get(old_name)
+            self.__set(new_name, when)
+            self.__set(old_name, None)
+        finally:
+            self.lock.release()
+
+    def sweep(self, name):
+        """
+        Delete a file, if it has expired.
+
+        The file is deleted with the lock held, so that a write to the
+        file cannot start in the meantime.
+
+        """
+        self.lock.acquire()
+        try:
+            when = self.deadlines.get(name)
+            if when is None  or  when > time.time():
+                # Outdated heap entry
+                return
+            if name in self.writing:
+                # Look again once the write is done
+                _sweeper.schedule(self, name, time.time() + settings.STORAGE_EXPIRY_SWEEP_INTERVAL)
+                return
+            try:
+                try:
+                    self.storage.deleteFile(name)
+                except GluFileNotFound:
+                    pass
+                self.__set(name, None)
+                self.expired += 1
+            except Exception, e:
+                # Stays hidden. The journal still has it, so it is tried again after a restart.
+                log("Deleting expired file '%s' failed: %s" % (name, str(e)))
+        finally:
+            self.lock.release()
+
+    def getStats(self):
+        self.lock.acquire()
+        try:
+            return dict(expiring        = len(self.deadlines),
+                        expired         = self.expired,
+                        journal_records = self.records)
+        finally:
+            self.lock.release()
+
+
+#
+# One index per namespace, shared by all storage objects for that namespace.
+#
+_indexes      = dict()
+_indexes_lock = threading.Lock()
+
+
+class ExpiringStorage(BaseStorage):
+    """
+    Hides and deletes the files of another storage object once they have expired.
+
+    """
+    def __init__(self, storage, index_name, ttl=None):
+        """
+        Initialize the expiring storage.
+
+        @param storage:      Storage in which the files and the journal are kept.
+        @type storage:       BaseStorage
+
+        @param index_name:   Unique name of the namespace. All storage objects
+                             for the same namespace need to use the same name,
+                             so that they share the expiry times.
+        @type index_name:    string
+
+        @param ttl:          Number of seconds after which files stored through
+                             this object expire. If None, those files do
+                             not expire. Appending does not change the expiry time
+                             of a file, unless a ttl is given.
+        @type ttl:           number
+
+        """
+        self.storage = storage
+        self.ttl     = ttl
+        _indexes_lock.acquire()
+        try:
+            index = _indexes.get(index_name)
+            if index is None:
+                index = _indexes[index_name] = _ExpiryIndex(storage)
+        finally:
+            _indexes_lock.release()
+        self.index = index
+
+    def __expiry(self):
+        if self.ttl is None:
+            return None
+        return time.time() + self.ttl
+
+    def __check(self, file_name):
+        if self.index.isExpired(file_name):
+            raise GluFileNotFound("File '%s' could not be found'" % file_name)
+
+    def __sweep(self):
+        """
+        Delete expired files, if there is no background thread to do that.
+
+        """
+        if not _sweeper.threaded:
+            _sweeper.sweepDue(settings.STORAGE_EXPIRY_SWEEP_LIMIT)
+
+    def __write(self, file_name, write, data, keep_expiry=False):
+        """
+        Write a file and set its expiry time.
+
+        With keep_expiry, the expiry time is only changed if a ttl was given.
+
+        """
+        self.__sweep()
+        self.index.beginWrite(file_name)
+        try:
+            write(file_name, data)
+            if self.ttl is not None  or  not keep_expiry:
+                self.index.setExpiry(file_name, self.__expiry())
+        finally:
+            self.index.endWrite(file_name)
+
+    def loadFile(self, file_name):
+        """
+        Load the specified file from storage.
+
+        @param file_name:    Name of the selected file.
+        @type file_name:     string
+
+        @return              Buffer containing the file contents.
+        @rtype               string
+
+        """
+        self.__check(file_name)
+        return self.storage.loadFile(file_name)
+
+    def openFile(self, file_name):
+        """
+        Open the specified file for streaming its contents.
+
+        @param file_name:    Name of the selected file.
+        @type file_name:     string
+
+        @return              Body from which the file contents can be read.
+        @rtype               StreamedBody
+
+        """
+        self.__check(file_name)
+        return self.storage.openFile(file_name)
+
+    def storeFile(self, file_name, data):
+        """
+        Store the specified file in storage.
+
+        @param file_name:    Name of the file.
+        @type file_name:     string
+
+        @param data:         Buffer containing the file contents.
+        @type data:          string
+
+        """
+        self.__write(file_name, self.storage.storeFile, data)
+
+    def storeStream(self, file_name, stream):
+        """
+        Store the contents of a file-like object in storage.
+
+        @param file_name:    Name of the file.
+        @type file_name:     string
+
+        @param stream:       Object from which the file contents are read.
+        @type stream:        file-like object
+
+        """
+        self.__write(file_name, self.storage.storeStream, stream)
+
+    def appendFile(self, file_name, data):
+        """
+        Append data to the specified file.
+
+        An expired file is replaced by the data.
+
+        @param file_name:    Name of the file.
+        @type file_name:     string
+
+        @param data:         Buffer containing the data to append.
+        @type data:          string
+
+        """
+        if self.index.isExpired(file_name):
+            self.__write(file_name, self.storage.storeFile, data)
+        else:
+            self.__write(file_name, self.storage.appendFile, data, keep_expiry=True)
+
+    def deleteFile(self, file_name):
+        """
+        Delete the specified file from storage.
+
+        @param file_name:    Name of the selected file.
+        @type file_name:     string
+
+        """
+        self.__check(file_name)
+        self.__sweep()
+        self.index.beginWrite(file_name)
+        try:
+            self.storage.deleteFile(file_name)
+            self.index.setExpiry(file_name, None)
+        finally:
+            self.index.endWrite(file_name)
+
+    def renameFile(self, old_name, new_name):
+        """
+        Give a stored file a new name.
+
+        The file keeps its expiry time.
+
+        @param old_name:     Current name of the file.
+        @type old_name:      string
+
+        @param new_name:     New name of the file.
+        @type new_name:      string
+
+        """
+        self.__check(old_name)
+        self.index.beginWrite(old_name)
+        self.index.beginWrite(new_name)
+        try:
+            self.storage.renameFile(old_name, new_name)
+            self.index.rename(old_name, new_name)
+        finally:
+            self.index.endWrite(new_name)
+            self.index.endWrite(old_name)
+
+    def _getLock(self, lock_name):
+        """
+        Return the lock of the underlying storage for the given name.
+
+        @param lock_name:    Name of the lock.
+        @type lock_name:     string
+
+        @return:             The lock.
+        @rtype:              object with acquire() and release()
+
+        """
+        return self.storage._getLock(lock_name)
+
+    def getFileVersion(self, file_name):
+        """
+        Return a cheap validator for the current version of a file.
+
+        @param file_name:    Name of the selected file.
+        @type file_name:     string
+
+        @return              Validator or None if the file does not exist or has expired.
+        @rtype               object
+
+        """
+        if self.index.isExpired(file_name):
+            return None
+        return self.storage.getFileVersion(file_name)
+
+    def getFileModificationTime(self, file_name):
+        """
+        Return the time at which a file was last written.
+
+        @param file_name:    Name of the selected file.
+        @type file_name:     string
+
+        @return              Seconds since the epoch or None if not known.
+        @rtype               float
+
+        """
+        if self.index.isExpired(file_name):
+            return None
+        return self.storage.getFileModificationTime(file_name)
+
+    def listFiles(self, prefix=None, limit=None, cursor=None):
+        """
+        Return list of files in the storage, without the expired files.
+
+        A page may therefore hold fewer names than the limit.
+
+        @param prefix:           Only names starting with this prefix are returned.
+        @type prefix:            string
+
+        @param limit:            Maximum number of names to return.
+        @type limit:             int
+
+        @param cursor:           Continuation cursor returned with the previous page.
+        @type cursor:            string
+
+        @return:                 List of file names.
+        @rtype:                  FileList
+
+        """
+        self.__sweep()
+        page = self.storage.listFiles(prefix=prefix, limit=limit, cursor=cursor)
+        return FileList([ name for name in page if not self.index.isExpired(name) ], page.next_cursor)
+
+    def syncFiles(self, file_names):
+        """
+        Make sure that the specified files and the expiry times have been written to disk.
+
+        @param file_names:       Names of the files.
+        @type file_names:        list
+
+        """
+        if self.index.records:
+            file_names = list(file_names) + [ _JOURNAL_NAME ]
+        self.storage.syncFiles(file_names)
+
+    def getStats(self):
+        """
+        Return the number of files with an expiry time and of expired files.
+
+        @return:    Dictionary with the counters of the namespace.
+        @rtype:     dict
+
+        """
+        return self.index.getStats()
@@ -5,37 +5,460 @@ Base class from which all storage abstractions derive.
 
 # Python imports
 import os
-import glujson as json
+import zlib
+import errno
+import uuid
+import struct
+import urllib
+import hashlib
+import threading
+
+try:
+    # Not available under Jython
+    import mmap
+except ImportError:
+    mmap = None
+
+try:
+    # Not available under Jython or on Windows
+    import fcntl
+except ImportError:
+    fcntl = None
 
 # Glu imports
-from glu.exceptions import *
+import glu.settings as settings
+
+from glu.exceptions                      import *
+from glu.logger                          import *
+from glu.storageabstraction.base_storage import BaseStorage, FileList, _makeFileList
+
+#
+# The layouts of the storage directory.
+#
+# LAYOUT_FLAT:    All files are kept in the storage directory itself, the
+#                 file names of a namespace start with '<unique_prefix>__'.
+#
+# LAYOUT_SHARDED: Each namespace has its own sub-directory. Within that,
+#                 files are spread over sub-directories, which are named
+#                 after the first hex digits of the hash of the file name.
+#                 File names are quoted, so that they are safe to use on
+#                 the file system. Reserved names (starting with '.') are
+#                 kept directly in the namespace directory.
+#
+LAYOUT_FLAT    = "flat"
+LAYOUT_SHARDED = "sharded"
+
+# Size of the pieces in which streams are copied into files
+_STREAM_CHUNK_SIZE = 64 * 1024
+
+#
+# Compressed files start with this magic string, followed by the size of
+# the uncompressed data (8 bytes, big-endian) and the zlib stream. Files
+# without the magic string are stored as they are.
+#
+_COMPRESSED_MAGIC  = "\x89GLZ\r\n\x1a\n"
+_COMPRESSED_HEADER = len(_COMPRESSED_MAGIC) + 8
+
+# Statistics about the compression achieved by all FileStorage objects
+_compression_stats = dict(files_compressed   = 0,
+                          files_uncompressed = 0,
+                          bytes_in           = 0,
+                          bytes_out          = 0)
+_compression_stats_lock = threading.Lock()
+
+
+def _recordCompression(bytes_in, bytes_out, compressed):
+    _compression_stats_lock.acquire()
+    try:
+        if compressed:
+            _compression_stats['files_compressed'] += 1
+        else:
+            _compression_stats['files_uncompressed'] += 1
+        _compression_stats['bytes_in']  += bytes_in
+        _compression_stats['bytes_out'] += bytes_out
+    finally:
+        _compression_stats_lock.release()
+
+
+def getCompressionStats():
+    """
+    Return statistics about the compression of stored files.
+
+    Counted are all files that were written by FileStorage objects
+    in this process, since it was started.
+
+    @return:    Dictionary with the number of compressed and uncompressed files,
+                the bytes that were given to us and the bytes we actually wrote,
+                as well as the resulting compression ratio.
+    @rtype:     dict
+
+    """
+    _compression_stats_lock.acquire()
+    try:
+        stats = dict(_compression_stats)
+    finally:
+        _compression_stats_lock.release()
+    if stats['bytes_in']:
+        stats['ratio'] = round(float(stats['bytes_out']) / stats['bytes_in'], 3)
+    else:
+        stats['ratio'] = None
+    return stats
+
+
+def _decode(buf):
+    """
+    Return the original contents of a file, decompressing it if necessary.
+
+    @param buf:    The contents of the file as stored on disk.
+    @type buf:     string
+
+    @return:       The original data.
+    @rtype:        string
+
+    """
+    if buf.startswith(_COMPRESSED_MAGIC):
+        return zlib.decompress(buf[_COMPRESSED_HEADER:])
+    return buf
+
+
+def _decompressedChunks(f, chunk_size=64 * 1024):
+    """
+    Generator that returns the decompressed contents of a compressed file.
+
+    The file needs to be positioned after the header.
+
+    """
+    decompressor = zlib.decompressobj()
+    while True:
+        chunk = f.read(chunk_size)
+        if not chunk:
+            break
+        data = decompressor.decompress(chunk)
+        if data:
+            yield data
+    data = decompressor.flush()
+    if data:
+        yield data
+
+
+# Marker file, which indicates that a namespace was migrated from the flat layout
+_MIGRATED_MARKER = ".migrated"
+
+#
+# Writers never change a file in place, other than appending to it. A new
+# version is written to a temporary file, which is then renamed over the
+# old one, so readers need no lock: They see either version completely.
+#
+# Read-modify-write operations (appends and updates of the resource index)
+# are serialized with lock files, which also works between processes. The
+# files of a directory are spread over this many lock files.
+#
+_LOCK_STRIPES = 16
+
+# Lock objects, keyed by the name of their lock file
+_file_locks      = dict()
+_file_locks_lock = threading.Lock()
+
+
+class _FileLock(object):
+    """
+    An exclusive lock, which is held by a thread of one process at a time.
+
+    Within the process, threads are serialized with a thread lock. Between
+    processes, flock() on a lock file is used. Where fcntl is not available
+    (Jython, Windows), the lock only works within the process.
 
-class FileStorage(object):
+    The lock is reentrant. Get instances through _getFileLock(), so that
+    all threads use the same object for a lock file.
+
+    """
+    def __init__(self, lock_name):
+        self.lock_name  = lock_name
+        self.local_lock = threading.RLock()
+        self.depth      = 0
+        self.f          = None
+
+    def acquire(self):
+        self.local_lock.acquire()
+        self.depth += 1
+        if self.depth == 1  and  fcntl:
+            try:
+                # Opened for appending, so that it is created, but never truncated
+                f = open(self.lock_name, "ab")
+                try:
+                    fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+                except:
+                    f.close()
+                    raise
+            except:
+                self.depth -= 1
+                self.local_lock.release()
+                raise
+            self.f = f
+
+    def release(self):
+        self.depth -= 1
+        try:
+            if self.depth == 0  and  self.f:
+                f, self.f = self.f, None
+                try:
+                    fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+                finally:
+                    f.close()
+        finally:
+            self.local_lock.release()
+
+
+def _getFileLock(lock_name):
+    """
+    Return the lock object for a lock file.
+
+    @param lock_name:    File name of the lock file.
+    @type lock_name:     string
+
+    @return:             The lock.
+    @rtype:              _FileLock
+
+    """
+    _file_locks_lock.acquire()
+    try:
+        lock = _file_locks.get(lock_name)
+        if lock is None:
+            lock = _file_locks[lock_name] = _FileLock(lock_name)
+        return lock
+    finally:
+        _file_locks_lock.release()
+
+
+def _replaceFile(src, dst):
+    """
+    Rename a file, replacing any existing file of the new name.
+
+    This is atomic, except on Windows, which does not allow us to rename
+    over an existing file. There, the old file is removed first.
+
+    """
+    try:
+        os.rename(src, dst)
+    except OSError, e:
+        if e.errno == errno.ENOENT  or  not os.path.exists(dst):
+            raise
+        os.remove(dst)
+        os.rename(src, dst)
+
+# Namespace directories of which we know that they are migrated already
+_migrated_dirs = set()
+_migration_lock = threading.Lock()
+
+
+class FileStorage(BaseStorage):
     """
     Abstract implementation of the base storage methods.
 
     """
-    def __init__(self, storage_location, unique_prefix=""):
+    def __init__(self, storage_location, unique_prefix="", layout=None, compress_threshold=-1):
         """
-        The unique prefix is used to create a namespace in a flat bucket.
+        The unique prefix is used to create a namespace in the storage location.
+
+        @param storage_location:  Directory in which files are stored.
+        @type storage_location:   string
+
+        @param unique_prefix:     Namespace for the files of this storage object.
+        @type unique_prefix:      string
+
+        @param layout:            LAYOUT_FLAT or LAYOUT_SHARDED. The default
+                                  is taken from settings.FILE_STORAGE_LAYOUT.
+        @type layout:             string
+
+        @param compress_threshold: Files of at least this many bytes are stored
+                                  compressed. None disables compression. The
+                                  default is taken from settings.FILE_STORAGE_COMPRESS_THRESHOLD.
+        @type compress_threshold: int
 
         """
         self.storage_location = storage_location
         self.unique_prefix    = unique_prefix
+        self.layout           = layout or settings.FILE_STORAGE_LAYOUT
+        if compress_threshold == -1:
+            compress_threshold = settings.FILE_STORAGE_COMPRESS_THRESHOLD
+        self.compress_threshold = compress_threshold
+        if self.layout == LAYOUT_SHARDED:
+            if unique_prefix:
+                self.namespace_dir = os.path.join(storage_location, urllib.quote(str(unique_prefix), safe=""))
+            else:
+                self.namespace_dir = storage_location
+            self.__migrate_flat_files()
 
-    def __make_filename(self, file_name):
+    def __base_dir(self):
+        if self.layout == LAYOUT_SHARDED:
+            return self.namespace_dir
+        return self.storage_location
+
+    def _getLock(self, lock_name):
+        """
+        Return a lock for read-modify-write operations that span several files.
+
+        The lock is a lock file in the directory of the namespace (or, in the
+        flat layout, of the storage location), so it also works between processes.
+
+        @param lock_name:    Name of the lock.
+        @type lock_name:     string
+
+        @return:             The lock.
+        @rtype:              _FileLock
+
+        """
+        return _getFileLock(os.path.join(self.__base_dir(), ".lock-%s" % lock_name))
+
+    def __lock_for(self, full_name):
+        """
+        Return the lock for read-modify-write operations on a file.
+
+        """
+        stripe = zlib.crc32(os.path.basename(full_name)) % _LOCK_STRIPES
+        return _getFileLock(os.path.join(os.path.dirname(full_name), ".lock-%02d" % stripe))
+
+    def __write_temporary(self, full_name, write):
+        """
+        Write a new version of a file under a temporary name next to it.
+
+        @param full_name:    File name of the file.
+        @type full_name:     string
+
+        @param write:        Function, which writes the contents to the open file passed to it.
+        @type write:         callable
+
+        @return:             File name of the temporary file.
+        @rtype:              string
+
+        """
+        # Names starting with '.' are never listed
+        tmp_name = os.path.join(os.path.dirname(full_name), ".tmp-%s" % uuid.uuid4().hex)
+        try:
+            f = open(tmp_name, "wb")
+            try:
+                write(f)
+            finally:
+                f.close()
+        except:
+            if os.path.exists(tmp_name):
+                os.remove(tmp_name)
+            raise
+        return tmp_name
+
+    def __install(self, tmp_name, full_name):
+        """
+        Rename a temporary file into place.
+
+        This holds the lock of the file, so that it does not happen in
+        the middle of a read-modify-write operation.
+
+        """
+        lock = self.__lock_for(full_name)
+        lock.acquire()
+        try:
+            try:
+                _replaceFile(tmp_name, full_name)
+            except:
+                if os.path.exists(tmp_name):
+                    os.remove(tmp_name)
+                raise
+        finally:
+            lock.release()
+
+    def __flat_filename(self, file_name):
         if self.unique_prefix:
             name = "%s/%s__%s" % (self.storage_location, self.unique_prefix, file_name)
         else:
             name = "%s/%s" % (self.storage_location, file_name)
         return name
 
+    def __shard_dir(self, file_name):
+        if file_name.startswith("."):
+            return self.namespace_dir
+        if type(file_name) is unicode:
+            file_name = file_name.encode("utf-8")
+        shard = hashlib.md5(file_name).hexdigest()[:settings.FILE_STORAGE_SHARD_DIGITS]
+        return os.path.join(self.namespace_dir, shard)
+
+    def __make_filename(self, file_name):
+        if self.layout == LAYOUT_SHARDED:
+            if type(file_name) is unicode:
+                file_name = file_name.encode("utf-8")
+            return os.path.join(self.__shard_dir(file_name), urllib.quote(file_name, safe=""))
+        else:
+            return self.__flat_filename(file_name)
+
     def __remove_filename_prefix(self, file_name):
         if self.unique_prefix:
             if file_name.startswith(self.unique_prefix):
                 file_name = file_name[len(self.unique_prefix) + 2:]
         return file_name
 
+    def __list_flat_files(self, reserved=False):
+        """
+        Return the names of the files in our namespace in the flat layout.
+
+        Reserved names (starting with '.') are only included if requested.
+
+        """
+        dir_list = os.listdir(self.storage_location)
+        # Need to filter all those out, which are not part of our storage space
+        if self.unique_prefix:
+            prefix    = self.unique_prefix + "__"
+            our_files = [ self.__remove_filename_prefix(name) for name in dir_list if name.startswith(prefix) ]
+        else:
+            our_files = [ name for name in dir_list if os.path.isfile(os.path.join(self.storage_location, name)) ]
+        if reserved:
+            # Except for the files used to write and lock the others
+            return [ name for name in our_files if not name.startswith(".tmp-")  and  not name.startswith(".lock-") ]
+        # Names starting with '.' are reserved for internal use
+        return [ name for name in our_files if not name.startswith(".") ]
+
+    def __migrate_flat_files(self):
+        """
+        Move any files of our namespace from the flat into the sharded layout.
+
+        This is done the first time a namespace is accessed in the sharded
+        layout. A marker file in the namespace directory records that the
+        migration is complete, so that the (potentially large) flat storage
+        directory doesn't need to be listed again.
+
+        """
+        if self.namespace_dir in _migrated_dirs:
+            return
+        _migration_lock.acquire()
+        try:
+            marker = os.path.join(self.namespace_dir, _MIGRATED_MARKER)
+            if not os.path.exists(marker):
+                if not os.path.isdir(self.namespace_dir):
+                    os.makedirs(self.namespace_dir)
+                count = 0
+                for file_name in self.__list_flat_files(reserved=True):
+                    self.__make_dirs(self.__shard_dir(file_name))
+                    try:
+                        os.rename(self.__flat_filename(file_name), self.__make_filename(file_name))
+                        count += 1
+                    except OSError, e:
+                        # Some other process may have moved it already
+                        if e.errno != errno.ENOENT:
+                            raise
+                if count:
+                    log("Moved %d files of namespace '%s' into sharded layout" % (count, self.unique_prefix))
+                open(marker, "w").close()
+            _migrated_dirs.add(self.namespace_dir)
+        finally:
+            _migration_lock.release()
+
+    def __make_dirs(self, dir_name):
+        if not os.path.isdir(dir_name):
+            try:
+                os.makedirs(dir_name)
+            except OSError, e:
+                # Someone else may have just created it
+                if e.errno != errno.EEXIST:
+                    raise
+
     def loadFile(self, file_name):
         """
         Load the specified file from storage.
@@ -48,12 +471,53 @@ class FileStorage(object):
 
         """
         try:
-            f   = open(self.__make_filename(file_name), "r")
+            f   = open(self.__make_filename(file_name), "rb")
             buf = f.read()
             f.close()
         except Exception, e:
             raise GluFileNotFound("File '%s' could not be found'" % (file_name))
-        return buf
+        return _decode(buf)
+
+    def openFile(self, file_name):
+        """
+        Open the specified file for streaming its contents.
+
+        Where available, the file is memory-mapped, so that its contents
+        are paged in by the operating system as they are sent, rather
+        than being copied into a buffer first. Otherwise, the file is
+        read in chunks.
+
+        @param file_name:    Name of the selected file.
+        @type file_name:     string
+
+        @return              Body from which the file contents can be read.
+        @rtype               StreamedBody
+
+        """
+        # Imported here, since glu.core depends on the storage classes
+        from glu.core.util import StreamedBody
+        name = self.__make_filename(file_name)
+        try:
+            f = open(name, "rb")
+        except Exception, e:
+            raise GluFileNotFound("File '%s' could not be found'" % (file_name))
+        try:
+            # The file may be replaced while we read it, so ask the open file for its size
+            size = os.fstat(f.fileno()).st_size
+            if size >= _COMPRESSED_HEADER:
+                header = f.read(_COMPRESSED_HEADER)
+                if header.startswith(_COMPRESSED_MAGIC):
+                    length = struct.unpack("!Q", header[len(_COMPRESSED_MAGIC):])[0]
+                    return StreamedBody(_decompressedChunks(f), length, on_close=f.close)
+                f.seek(0)
+            # Empty files cannot be mapped
+            if mmap  and  size > 0:
+                m = mmap.mmap(f.fileno(), size, access=mmap.ACCESS_READ)
+                return StreamedBody(m, size, on_close=f.close)
+            return StreamedBody(f, size)
+        except:
+            f.close()
+            raise
 
     def storeFile(self, file_name, data):
         """
@@ -66,9 +530,156 @@ class FileStorage(object):
         @type data:          string
 
         """
-        f = open(self.__make_filename(file_name), "w")
-        f.write(data)
-        f.close()
+        if self.layout == LAYOUT_SHARDED:
+            self.__make_dirs(self.__shard_dir(file_name))
+        full_name = self.__make_filename(file_name)
+        buf       = self.__encode(data)
+        self.__install(self.__write_temporary(full_name, lambda f: f.write(buf)), full_name)
+
+    def __encode(self, data, compress=True):
+        """
+        Return the data as it should be written to disk, compressed if worthwhile.
+
+        Data that happens to start with our magic string is always
+        compressed, so that it is not mistaken for a compressed file.
+        Otherwise, nothing is compressed if 'compress' is not set.
+
+        """
+        must_compress = data.startswith(_COMPRESSED_MAGIC)
+        if must_compress  or  (compress  and  self.compress_threshold is not None  and  len(data) >= self.compress_threshold):
+            packed = zlib.compress(data)
+            if must_compress  or  _COMPRESSED_HEADER + len(packed) < len(data):
+                _recordCompression(len(data), _COMPRESSED_HEADER + len(packed), True)
+                return _COMPRESSED_MAGIC + struct.pack("!Q", len(data)) + packed
+        _recordCompression(len(data), len(data), False)
+        return data
+
+    def storeStream(self, file_name, stream):
+        """
+        Store the contents of a file-like object in storage.
+
+        The data is copied in chunks into a temporary file next to the
+        final one, which is then renamed. Readers therefore never see a
+        partially written file, and memory use does not depend on the
+        size of the data.
+
+        @param file_name:    Name of the file.
+        @type file_name:     string
+
+        @param stream:       Object from which the file contents are read.
+        @type stream:        file-like object
+
+        """
+        if self.layout == LAYOUT_SHARDED:
+            self.__make_dirs(self.__shard_dir(file_name))
+        full_name = self.__make_filename(file_name)
+        self.__install(self.__write_temporary(full_name, lambda f: self.__copy_stream(stream, f)), full_name)
+
+    def __copy_stream(self, stream, f):
+        """
+        Copy a stream into an open file, compressing it if worthwhile.
+
+        Up to compress_threshold bytes are read before we decide: Streams
+        that end before that are written like storeFile() would. Longer
+        streams are compressed on the fly. The size of the data is only
+        known at the end, so it is filled into the header last.
+
+        """
+        want = len(_COMPRESSED_MAGIC)
+        if self.compress_threshold is not None:
+            want = max(want, self.compress_threshold)
+        head = ""
+        while len(head) < want:
+            chunk = stream.read(_STREAM_CHUNK_SIZE)
+            if not chunk:
+                break
+            head += chunk
+        if len(head) < want:
+            # The whole stream has been read already
+            f.write(self.__encode(head))
+            return
+
+        if self.compress_threshold is None  and  not head.startswith(_COMPRESSED_MAGIC):
+            # Not compressing: Just copy
+            size  = 0
+            chunk = head
+            while chunk:
+                f.write(chunk)
+                size += len(chunk)
+                chunk = stream.read(_STREAM_CHUNK_SIZE)
+            _recordCompression(size, size, False)
+            return
+
+        compressor = zlib.compressobj()
+        f.write(_COMPRESSED_MAGIC + struct.pack("!Q", 0))
+        size    = 0
+        written = _COMPRESSED_HEADER
+        chunk   = head
+        while chunk:
+            size    += len(chunk)
+            packed   = compressor.compress(chunk)
+            written += len(packed)
+            f.write(packed)
+            chunk = stream.read(_STREAM_CHUNK_SIZE)
+        packed   = compressor.flush()
+        written += len(packed)
+        f.write(packed)
+        f.seek(len(_COMPRESSED_MAGIC))
+        f.write(struct.pack("!Q", size))
+        _recordCompression(size, written, True)
+
+    def appendFile(self, file_name, data):
+        """
+        Append data to the specified file.
+
+        The file is created if it does not exist yet. Only the new data is
+        written, so many small appends are cheap. The file is locked while
+        we write, so that concurrent appends (also from other processes)
+        are not interleaved. Readers may see a part of an append that is
+        still in progress.
+
+        A compressed file cannot be appended to. It is rewritten as a
+        whole, uncompressed, so that the next append is cheap again.
+
+        @param file_name:    Name of the file.
+        @type file_name:     string
+
+        @param data:         Buffer containing the data to append.
+        @type data:          string
+
+        """
+        if self.layout == LAYOUT_SHARDED:
+            self.__make_dirs(self.__shard_dir(file_name))
+        full_name = self.__make_filename(file_name)
+        lock      = self.__lock_for(full_name)
+        lock.acquire()
+        try:
+            # Only open the file once we hold the lock, so that it cannot be replaced anymore
+            try:
+                f = open(full_name, "rb")
+                try:
+                    head = f.read(len(_COMPRESSED_MAGIC))
+                    if head == _COMPRESSED_MAGIC  or  len(head) < len(_COMPRESSED_MAGIC):
+                        head += f.read()
+                finally:
+                    f.close()
+            except IOError, e:
+                if e.errno != errno.ENOENT:
+                    raise
+                head = ""
+            if head.startswith(_COMPRESSED_MAGIC)  or  len(head) < len(_COMPRESSED_MAGIC):
+                # New, compressed or very short: Write everything. Not compressed,
+                # since files that are appended to tend to be appended to again.
+                buf = self.__encode(_decode(head) + data, compress=False)
+                self.__install(self.__write_temporary(full_name, lambda f: f.write(buf)), full_name)
+            else:
+                f = open(full_name, "ab")
+                try:
+                    f.write(data)
+                finally:
+                    f.close()
+        finally:
+            lock.release()
 
     def deleteFile(self, file_name):
         """
@@ -90,87 +701,172 @@ class FileStorage(object):
         except Exception, e:
             raise GluException("Cannot delete file '%s' (%s)" % (file_name, str(e)))
 
-    def listFiles(self):
+    def renameFile(self, old_name, new_name):
         """
-        Return list of all files in the storage.
+        Give a stored file a new name.
 
-        @return:                 List of file names.
-        @rtype:                  list
+        A file with the new name is replaced.
+
+        @param old_name:     Current name of the file.
+        @type old_name:      string
+
+        @param new_name:     New name of the file.
+        @type new_name:      string
 
         """
+        if self.layout == LAYOUT_SHARDED:
+            self.__make_dirs(self.__shard_dir(new_name))
+        old_filename = self.__make_filename(old_name)
+        new_filename = self.__make_filename(new_name)
         try:
-            dir_list = os.listdir(self.storage_location)
-            # Need to filter all those out, which are not part of our storage space
-            if self.unique_prefix:
-                our_files = [ name for name in dir_list if name.startswith(self.unique_prefix) ]
-            else:
-                our_files = dir_list
-            no_prefix_dir_list = [ self.__remove_filename_prefix(name) for name in our_files ]
-            return no_prefix_dir_list
-        except Exception, e:
-            raise GluException("Problems getting file list from storage: " + str(e))
+            _replaceFile(old_filename, new_filename)
+        except OSError, e:
+            if e.errno == errno.ENOENT:
+                raise GluFileNotFound(old_name)
+            raise GluException("Cannot rename file '%s' (%s)" % (old_name, str(e)))
+
+    def syncFiles(self, file_names):
+        """
+        Make sure that the specified files have been written to disk.
+
+        The directories holding the files are synced as well, so that
+        newly created, renamed or deleted files persist too. Files which
+        don't exist (anymore) are skipped.
+
+        @param file_names:       Names of the files.
+        @type file_names:        list
 
-    def loadResourceFromStorage(self, resource_name):
         """
-        Load the specified resource from storage.
+        dir_names = set()
+        for file_name in file_names:
+            full_name = self.__make_filename(file_name)
+            dir_names.add(os.path.dirname(full_name))
+            try:
+                f = open(full_name, "r+b")
+            except IOError, e:
+                continue
+            try:
+                os.fsync(f.fileno())
+            finally:
+                f.close()
+        for dir_name in dir_names:
+            try:
+                fd = os.open(dir_name, os.O_RDONLY)
+            except (OSError, AttributeError):
+                # Directories cannot be opened on all platforms
+                continue
+            try:
+                try:
+                    os.fsync(fd)
+                except OSError:
+                    pass
+            finally:
+                os.close(fd)
+
+    def getFileVersion(self, file_name):
+        """
+        Return a cheap validator for the current version of a file.
 
-        @param resource_name:    Name of the selected resource.
-        @type resource_name:     string
+        The validator changes whenever the file is rewritten, which allows
+        callers to detect edits without reading the file again. This only
+        costs a stat() call.
 
-        @return                  A Python dictionary representation or None
-                                 if not found.
-        @rtype                   dict
+        @param file_name:    Name of the selected file.
+        @type file_name:     string
+
+        @return              Tuple of modification time, size and inode or
+                             None if the file does not exist.
+        @rtype               tuple
 
         """
         try:
-            buf = self.loadFile(resource_name)
-        except GluFileNotFound, e:
+            st = os.stat(self.__make_filename(file_name))
+        except OSError, e:
             return None
-        obj = json.loads(buf)
-        return obj
+        return (st.st_mtime, st.st_size, st.st_ino)
 
-    def deleteResourceFromStorage(self, resource_name):
+    def getFileModificationTime(self, file_name):
         """
-        Delete the specified resource from storage.
+        Return the time at which a file was last written.
 
-        @param resource_name:    Name of the selected resource.
-        @type resource_name:     string
+        @param file_name:    Name of the selected file.
+        @type file_name:     string
+
+        @return              Seconds since the epoch or None if the
+                             file does not exist.
+        @rtype               float
 
         """
-        self.deleteFile(resource_name)
+        try:
+            return os.path.getmtime(self.__make_filename(file_name))
+        except OSError, e:
+            return None
 
-    def listResourcesInStorage(self):
+    def listFiles(self, prefix=None, limit=None, cursor=None):
         """
-        Return list of resources which we currently have in storage.
+        Return list of files in the storage.
+
+        In the flat layout the entire storage directory needs to be
+        listed and the names are returned in alphabetical order.
+
+        In the sharded layout, names are returned shard by shard and the
+        cursor records the shard in which the previous page ended. A page
+        therefore only requires the listing of as many shard directories
+        as are needed to fill it.
+
+        @param prefix:           Only names starting with this prefix are returned.
+        @type prefix:            string
+
+        @param limit:            Maximum number of names to return. All names
+                                 are returned if not specified.
+        @type limit:             int
 
-        @return:                 List of resource names.
-        @rtype:                  list
+        @param cursor:           Continuation cursor returned with the previous page.
+        @type cursor:            string
+
+        @return:                 List of file names.
+        @rtype:                  FileList
 
         """
         try:
-            dir_list = self.listFiles()
-            return dir_list
+            if self.layout == LAYOUT_SHARDED:
+                return self.__list_sharded_files(prefix, limit, cursor)
+            else:
+                return _makeFileList(self.__list_flat_files(), prefix, limit, cursor)
         except Exception, e:
-            raise GluException("Problems getting resource list from storage: " + str(e))
-
-    def writeResourceToStorage(self, resource_name, resource_def):
-        """
-        Store a resource definition.
-        
-        No return value, but raises GluException if there is an issue.
-        
-        @param resource_name: The storage name for this resource
-        @type  resource_name: string
-        
-        @param resource_def: The dictionary containing the resource definition.
-        @type  resource_def: dict
-        
-        @raise GluException: If the resource cannot be stored.
-            
+            raise GluException("Problems getting file list from storage: " + str(e))
+
+    def __list_sharded_files(self, prefix, limit, cursor):
         """
-        try:
-            buf = json.dumps(resource_def, indent=4)
-            self.storeFile(resource_name, buf)
-        except Exception, e:
-            raise GluException("Problems storing new resource: " + str(e))
+        Return a page of file names in the sharded layout.
+
+        The cursor has the format '<shard>:<name>'.
 
+        """
+        if not os.path.isdir(self.namespace_dir):
+            return FileList([])
+        shards = [ shard for shard in os.listdir(self.namespace_dir) if not shard.startswith(".") ]
+        shards.sort()
+        if cursor:
+            cursor_shard, cursor_name = cursor.split(":", 1)
+        else:
+            cursor_shard, cursor_name = None, None
+        names = []
+        for i, shard in enumerate(shards):
+            if cursor_shard  and  shard < cursor_shard:
+                continue
+            shard_names = [ urllib.unquote(name) for name in os.listdir(os.path.join(self.namespace_dir, shard))
+                                                       if not name.startswith(".") ]
+            if prefix:
+                shard_names = [ name for name in shard_names if name.startswith(prefix) ]
+            if shard == cursor_shard:
+                shard_names = [ name for name in shard_names if name > cursor_name ]
+            shard_names.sort()
+            if limit is not None  and  len(names) + len(shard_names) >= limit:
+                take = limit - len(names)
+                names.extend(shard_names[:take])
+                if take < len(shard_names)  or  i < len(shards) - 1:
+                    return FileList(names, "%s:%s" % (shard, names[-1]))
+                break
+            names.extend(shard_names)
+        return FileList(names)
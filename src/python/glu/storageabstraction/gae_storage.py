@@ -12,8 +12,12 @@ from google.appengine.ext import db
 from glu.exceptions import *
 
 class ResourceStorage(db.Model):
-    name = db.StringProperty(multiline=False)
-    data = db.StringProperty(multiline=True)
+    name         = db.StringProperty(multiline=False)
+    data         = db.StringProperty(multiline=True)
+    updated      = db.DateTimeProperty(auto_now=True)
+    # The public summary, so that listings don't need to parse the definitions
+    summary_uri  = db.StringProperty(multiline=False)
+    summary_desc = db.StringProperty(multiline=True)
 
 class GaeStorage(object):
     """
@@ -39,6 +43,31 @@ class GaeStorage(object):
         resource = resources[0]
         return json.loads(resource.data)
 
+    def getResourceVersion(self, resource_name):
+        """
+        Return a cheap validator for the current version of a resource definition.
+
+        Only the key and the update time are fetched (projection query).
+        Resources that were stored before the update time was recorded
+        don't show up in that query. For those, the data is loaded and
+        hashed, until they are stored again.
+
+        @param resource_name:    Name of the selected resource.
+        @type resource_name:     string
+
+        @return                  Key and time of the last update (or hash of
+                                 the data), or None if the resource does not exist.
+        @rtype                   tuple
+
+        """
+        resource = db.GqlQuery("SELECT updated FROM ResourceStorage WHERE name = :1", resource_name).get()
+        if resource is not None:
+            return (str(resource.key()), resource.updated)
+        key = db.GqlQuery("SELECT __key__ FROM ResourceStorage WHERE name = :1", resource_name).get()
+        if key is None:
+            return None
+        return (str(key), hash(db.get(key).data))
+
     def listResourcesInStorage(self):
         """
         Return list of resources which we currently have in storage.
@@ -54,6 +83,50 @@ class GaeStorage(object):
         except Exception, e:
             raise GluException("Problems getting resource list from storage: " + str(e))
 
+    def listResourceSummaries(self, limit=None, cursor=None):
+        """
+        Return the public summaries of stored resources, ordered by name.
+
+        The summaries are stored with each resource. Only resources that
+        were stored before that need to have their definition parsed, until
+        they are stored again.
+
+        @param limit:            Maximum number of summaries to return.
+        @type limit:             int
+
+        @param cursor:           Continuation cursor returned with the previous page.
+        @type cursor:            string
+
+        @return:                 Tuple of a list of (name, summary) tuples and the
+                                 cursor for the next page (None if this was the last page).
+                                 Each summary is a dictionary with 'uri' and 'desc'.
+        @rtype:                  tuple
+
+        """
+        try:
+            if cursor:
+                resources = ResourceStorage.gql("WHERE name > :1 ORDER BY name", cursor)
+            else:
+                resources = ResourceStorage.gql("ORDER BY name")
+            if limit is None:
+                resources = list(resources)
+            else:
+                resources = resources.fetch(limit + 1)
+            out = []
+            for r in resources[:limit]:
+                if r.summary_uri is None:
+                    public_def = json.loads(r.data)['public']
+                    out.append((r.name, dict(uri=public_def['uri'], desc=public_def['desc'])))
+                else:
+                    out.append((r.name, dict(uri=r.summary_uri, desc=r.summary_desc)))
+            if limit is not None  and  len(resources) > limit:
+                next_cursor = out[-1][0]
+            else:
+                next_cursor = None
+            return out, next_cursor
+        except Exception, e:
+            raise GluException("Problems getting resource list from storage: " + str(e))
+
     def writeResourceToStorage(self, resource_name, resource_def):
         """
         Store a resource definition.
@@ -77,8 +150,11 @@ class GaeStorage(object):
             except Exception, e:
                 # No old ones? Make a new one.
                 resource = ResourceStorage()
-            resource.name = resource_name
-            resource.data = json.dumps(resource_def)
+            public_def            = resource_def['public']
+            resource.name         = resource_name
+            resource.data         = json.dumps(resource_def)
+            resource.summary_uri  = public_def['uri']
+            resource.summary_desc = public_def['desc']
             resource.put()
             return "No error"
         except Exception, e:
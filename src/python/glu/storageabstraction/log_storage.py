@@ -0,0 +1,699 @@
+"""
+Log-structured storage abstraction (in the style of Bitcask).
+
+Each namespace has a directory of numbered segment files. All writes
+are appended to the newest (active) segment, so writing is sequential
+and never rewrites existing data. A delete is recorded as a tombstone.
+
+An in-memory index maps each name to the segment, offset and length of
+its current value, so a read takes a single seek. The index is rebuilt
+by scanning the segments when a namespace is first opened.
+
+Appending to a file writes a record with just the new data, which extends
+the current value. Such a value consists of several extents, which are
+read one after the other, until compaction merges them into one.
+
+Overwritten and deleted values stay in the segments until compaction,
+which runs in a background thread once enough of the stored data is
+dead: All segments except the active one are merged into a single new
+segment, which only contains the live values.
+
+Record format:
+
+    crc32 (4 bytes), value length (4 bytes, -1 for a tombstone),
+    key length (4 bytes, highest bit set for appended data), key, value
+
+The CRC covers everything after it, so that a record which was only
+partially written (for example during a crash) is detected and dropped.
+
+"""
+# Python imports
+import os
+import zlib
+import errno
+import struct
+import urllib
+import threading
+
+# Glu imports
+import glu.settings as settings
+
+from glu.exceptions                      import *
+from glu.logger                          import *
+from glu.storageabstraction.base_storage import BaseStorage, _makeFileList
+
+_HEADER_FORMAT = "!IiI"
+_HEADER_SIZE   = struct.calcsize(_HEADER_FORMAT)
+
+#
+# The first record of a segment that was produced by compaction has this
+# (otherwise impossible) key. Its value lists the segments the merged
+# segment replaces, so that any of those left behind by a crash can be
+# removed when the namespace is opened again.
+#
+_SUPERSEDES_KEY = ""
+
+# Set in the key length of records, which extend the current value of the key
+_EXTEND_FLAG = 0x80000000
+
+
+def _segmentName(directory, segment_id):
+    return os.path.join(directory, "%08d.log" % segment_id)
+
+
+def _packRecord(key, value, extend=False):
+    """
+    Return a complete record for a key and value (None for a tombstone).
+
+    With 'extend', the value is appended to the current value of the key.
+
+    """
+    key_len = len(key)
+    if extend:
+        key_len |= _EXTEND_FLAG
+    if value is None:
+        body = struct.pack("!iI", -1, key_len) + key
+    else:
+        body = struct.pack("!iI", len(value), key_len) + key + value
+    return struct.pack("!I", zlib.crc32(body) & 0xffffffff) + body
+
+
+class _ExtentReader(object):
+    """
+    File-like object, which reads a value from its extents, one after the other.
+
+    """
+    def __init__(self, files, extents):
+        """
+        Initialize the reader.
+
+        @param files:     Open files of the segments that hold the extents,
+                          keyed by segment id.
+        @type files:      dict
+
+        @param extents:   List of (segment id, offset, length) tuples.
+        @type extents:    list
+
+        """
+        self.files   = files
+        self.extents = list(extents)
+
+    def read(self, size=-1):
+        parts = []
+        while self.extents  and  size != 0:
+            segment_id, offset, value_len = self.extents[0]
+            if size < 0  or  size >= value_len:
+                count = value_len
+                self.extents.pop(0)
+            else:
+                count = size
+                self.extents[0] = (segment_id, offset + count, value_len - count)
+            f = self.files[segment_id]
+            f.seek(offset)
+            parts.append(f.read(count))
+            if size > 0:
+                size -= count
+        return "".join(parts)
+
+    def close(self):
+        for f in self.files.values():
+            f.close()
+
+
+class _LogEngine(object):
+    """
+    The segments and index of one namespace.
+
+    All storage objects for the same namespace share one engine.
+
+    """
+    def __init__(self, directory):
+        self.directory  = directory
+        self.lock       = threading.RLock()
+        self.index      = dict()     # key -> tuple of extents: (segment id, value offset, value length)
+        self.sizes      = dict()     # segment id -> bytes written
+        self.dead_bytes = dict()     # segment id -> bytes of overwritten values and tombstones
+        self.readers    = dict()     # segment id -> open file
+        self.compacting = False
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+        self.__recover()
+        if self.sizes:
+            self.active_id = max(self.sizes.keys()) + 1
+        else:
+            self.active_id = 1
+        self.__open_active()
+
+    def __open_active(self):
+        self.writer = open(_segmentName(self.directory, self.active_id), "ab")
+        self.sizes[self.active_id]      = 0
+        self.dead_bytes[self.active_id] = 0
+
+    def __record_size(self, key, value_len):
+        return _HEADER_SIZE + len(key) + max(value_len, 0)
+
+    def __mark_dead(self, key):
+        """
+        Account for the current value of a key, which is about to be replaced.
+
+        """
+        for segment_id, offset, value_len in self.index.get(key, ()):
+            self.dead_bytes[segment_id] = self.dead_bytes.get(segment_id, 0) + self.__record_size(key, value_len)
+
+    def __recover(self):
+        """
+        Rebuild the index from the segment files.
+
+        """
+        segment_ids = []
+        for name in os.listdir(self.directory):
+            if name.endswith(".merged"):
+                # Compaction was interrupted before the merged segment was complete
+                os.remove(os.path.join(self.directory, name))
+            elif name.endswith(".log"):
+                segment_ids.append(int(name[:-4]))
+        segment_ids.sort()
+
+        superseded = set()
+        for segment_id in segment_ids:
+            f = open(_segmentName(self.directory, segment_id), "rb")
+            try:
+                header = f.read(_HEADER_SIZE)
+                if len(header) == _HEADER_SIZE:
+                    crc, value_len, key_len = struct.unpack(_HEADER_FORMAT, header)
+                    if key_len == len(_SUPERSEDES_KEY)  and  value_len > 0:
+                        superseded.update([ int(s) for s in f.read(value_len).split(",") if int(s) != segment_id ])
+            finally:
+                f.close()
+
+        for segment_id in segment_ids:
+            if segment_id in superseded:
+                os.remove(_segmentName(self.directory, segment_id))
+            else:
+                # Only the last segment can end in an incomplete record
+                self.__load_segment(segment_id, segment_id == segment_ids[-1])
+
+    def __load_segment(self, segment_id, verify):
+        """
+        Add the records of a segment to the index.
+
+        @param segment_id:   Number of the segment.
+        @type segment_id:    int
+
+        @param verify:       Check the CRC of each record. A damaged record
+                             and everything after it is cut off.
+        @type verify:        boolean
+
+        """
+        file_name = _segmentName(self.directory, segment_id)
+        f         = open(file_name, "rb")
+        offset    = 0
+        dead      = 0
+        try:
+            while True:
+                header = f.read(_HEADER_SIZE)
+                if not header:
+                    break
+                damaged = len(header) < _HEADER_SIZE
+                if not damaged:
+                    crc, value_len, key_len = struct.unpack(_HEADER_FORMAT, header)
+                    extend  = key_len & _EXTEND_FLAG
+                    key_len = key_len & ~_EXTEND_FLAG
+                    key     = f.read(key_len)
+                    damaged = len(key) < key_len
+                if not damaged:
+                    if verify:
+                        value   = value_len > 0 and f.read(value_len) or ""
+                        damaged = len(value) < max(value_len, 0)  or  \
+                                  (zlib.crc32(header[4:] + key + value) & 0xffffffff) != crc
+                    else:
+                        f.seek(max(value_len, 0), 1)
+                if damaged:
+                    log("Dropping incomplete record at offset %d of '%s'" % (offset, file_name))
+                    f.close()
+                    f = open(file_name, "r+b")
+                    f.truncate(offset)
+                    break
+                record_size = self.__record_size(key, value_len)
+                if key == _SUPERSEDES_KEY:
+                    dead += record_size
+                elif value_len < 0:
+                    self.__mark_dead(key)
+                    self.index.pop(key, None)
+                    dead += record_size
+                elif extend:
+                    self.index[key] = self.index.get(key, ()) + ((segment_id, offset + _HEADER_SIZE + key_len, value_len),)
+                else:
+                    self.__mark_dead(key)
+                    self.index[key] = ((segment_id, offset + _HEADER_SIZE + key_len, value_len),)
+                offset += record_size
+        finally:
+            f.close()
+        if offset == 0:
+            # Nothing was written to the segment before it was closed
+            os.remove(file_name)
+            return
+        self.sizes[segment_id]      = offset
+        self.dead_bytes[segment_id] = self.dead_bytes.get(segment_id, 0) + dead
+
+    def __reader(self, segment_id):
+        f = self.readers.get(segment_id)
+        if f is None:
+            f = self.readers[segment_id] = open(_segmentName(self.directory, segment_id), "rb")
+        return f
+
+    def __close_readers(self, segment_ids):
+        for segment_id in segment_ids:
+            f = self.readers.pop(segment_id, None)
+            if f:
+                f.close()
+
+    def append(self, key, value, extend=False):
+        """
+        Append a record for a key and value (None to delete the key).
+
+        With 'extend', the value is added to the end of the current
+        value of the key, which is created if it does not exist.
+
+        """
+        record = _packRecord(key, value, extend)
+        self.lock.acquire()
+        try:
+            if self.sizes[self.active_id] + len(record) > settings.LOG_STORAGE_SEGMENT_SIZE  and  \
+                                                        self.sizes[self.active_id] > 0:
+                self.__roll()
+            offset = self.sizes[self.active_id]
+            self.writer.write(record)
+            self.writer.flush()
+            if settings.LOG_STORAGE_FSYNC:
+                os.fsync(self.writer.fileno())
+            self.sizes[self.active_id] += len(record)
+            extent = (self.active_id, offset + _HEADER_SIZE + len(key), len(value or ""))
+            if value is None:
+                self.__mark_dead(key)
+                self.index.pop(key, None)
+                self.dead_bytes[self.active_id] += len(record)
+            elif extend:
+                self.index[key] = self.index.get(key, ()) + (extent,)
+            else:
+                self.__mark_dead(key)
+                self.index[key] = (extent,)
+        finally:
+            self.lock.release()
+
+    def sync(self):
+        """
+        Write everything appended so far to disk.
+
+        Closed segments are synced when they are closed, so only the
+        active segment needs to be synced.
+
+        """
+        self.lock.acquire()
+        try:
+            os.fsync(self.writer.fileno())
+        finally:
+            self.lock.release()
+
+    def __roll(self):
+        """
+        Start a new active segment, and compact if enough data is dead.
+
+        """
+        os.fsync(self.writer.fileno())
+        self.writer.close()
+        self.active_id += 1
+        self.__open_active()
+        immutable = [ segment_id for segment_id in self.sizes if segment_id != self.active_id ]
+        total     = sum([ self.sizes[segment_id] for segment_id in immutable ])
+        dead      = sum([ self.dead_bytes[segment_id] for segment_id in immutable ])
+        if len(immutable) > 1  and  dead >= total * settings.LOG_STORAGE_COMPACT_RATIO  and  not self.compacting:
+            t = threading.Thread(target=self.compact)
+            t.setDaemon(True)
+            t.start()
+
+    def get(self, key):
+        """
+        Return the value of a key.
+
+        """
+        self.lock.acquire()
+        try:
+            entry = self.index.get(key)
+            if entry is None:
+                raise GluFileNotFound("File '%s' could not be found'" % key)
+            parts = []
+            for segment_id, offset, value_len in entry:
+                f = self.__reader(segment_id)
+                f.seek(offset)
+                parts.append(f.read(value_len))
+            return "".join(parts)
+        finally:
+            self.lock.release()
+
+    def open(self, key):
+        """
+        Return a file-like object for reading the value of a key, and the length of the value.
+
+        The segments are opened right away, so the object stays valid
+        even if compaction removes them while the value is being read.
+
+        """
+        self.lock.acquire()
+        try:
+            entry = self.index.get(key)
+            if entry is None:
+                raise GluFileNotFound("File '%s' could not be found'" % key)
+            files = dict()
+            try:
+                for segment_id, offset, value_len in entry:
+                    if segment_id not in files:
+                        files[segment_id] = open(_segmentName(self.directory, segment_id), "rb")
+            except:
+                for f in files.values():
+                    f.close()
+                raise
+        finally:
+            self.lock.release()
+        return _ExtentReader(files, entry), sum([ value_len for segment_id, offset, value_len in entry ])
+
+    def version(self, key):
+        self.lock.acquire()
+        try:
+            return self.index.get(key)
+        finally:
+            self.lock.release()
+
+    def keys(self):
+        self.lock.acquire()
+        try:
+            return self.index.keys()
+        finally:
+            self.lock.release()
+
+    def compact(self):
+        """
+        Merge all segments except the active one, keeping only live values.
+
+        The live values are copied without holding the lock, so reads and
+        writes continue meanwhile. Values that are overwritten or deleted
+        while we copy are detected when the index is updated at the end.
+
+        The extents of a value in the merged segments are written as a single
+        record. Extents in the active segment follow it, as they did before.
+
+        """
+        self.lock.acquire()
+        try:
+            if self.compacting:
+                return
+            segment_ids = [ segment_id for segment_id in self.sizes if segment_id != self.active_id ]
+            if not segment_ids:
+                return
+            self.compacting = True
+            segment_ids.sort()
+            merged_id = segment_ids[-1]
+            snapshot  = [ (key, tuple([ extent for extent in entry if extent[0] in segment_ids ]))
+                                            for (key, entry) in self.index.items() if entry[0][0] in segment_ids ]
+        finally:
+            self.lock.release()
+
+        try:
+            tmp_name    = _segmentName(self.directory, merged_id) + ".merged"
+            new_entries = []
+            out         = open(tmp_name, "wb")
+            sources     = dict()
+            try:
+                record = _packRecord(_SUPERSEDES_KEY, ",".join([ str(segment_id) for segment_id in segment_ids ]))
+                out.write(record)
+                offset = len(record)
+                for key, extents in snapshot:
+                    parts = []
+                    for segment_id, value_offset, value_len in extents:
+                        f = sources.get(segment_id)
+                        if f is None:
+                            f = sources[segment_id] = open(_segmentName(self.directory, segment_id), "rb")
+                        f.seek(value_offset)
+                        parts.append(f.read(value_len))
+                    value  = "".join(parts)
+                    record = _packRecord(key, value)
+                    out.write(record)
+                    new_entries.append((key, (merged_id, offset + _HEADER_SIZE + len(key), len(value))))
+                    offset += len(record)
+                out.flush()
+                os.fsync(out.fileno())
+            finally:
+                out.close()
+                for f in sources.values():
+                    f.close()
+
+            self.lock.acquire()
+            try:
+                self.__close_readers(segment_ids)
+                try:
+                    os.rename(tmp_name, _segmentName(self.directory, merged_id))
+                except OSError:
+                    # Windows does not allow us to rename over an existing file
+                    os.remove(_segmentName(self.directory, merged_id))
+                    os.rename(tmp_name, _segmentName(self.directory, merged_id))
+                for segment_id in segment_ids:
+                    if segment_id != merged_id:
+                        os.remove(_segmentName(self.directory, segment_id))
+                    del self.sizes[segment_id]
+                    del self.dead_bytes[segment_id]
+                self.sizes[merged_id]      = offset
+                self.dead_bytes[merged_id] = 0
+                old_extents = dict(snapshot)
+                for key, extent in new_entries:
+                    entry   = self.index.get(key)
+                    extents = old_extents[key]
+                    if entry  and  entry[:len(extents)] == extents:
+                        # Data appended while we were copying stays where it is
+                        self.index[key] = (extent,) + entry[len(extents):]
+                    else:
+                        # Overwritten or deleted while we were copying
+                        self.dead_bytes[merged_id] += self.__record_size(key, extent[2])
+            finally:
+                self.lock.release()
+            log("Compacted %d segments in '%s'" % (len(segment_ids), self.directory))
+        finally:
+            self.compacting = False
+
+    def getStats(self):
+        self.lock.acquire()
+        try:
+            return dict(keys       = len(self.index),
+                        segments   = len(self.sizes),
+                        bytes      = sum(self.sizes.values()),
+                        dead_bytes = sum(self.dead_bytes.values()))
+        finally:
+            self.lock.release()
+
+
+#
+# One engine per namespace directory, shared by all storage objects.
+#
+_engines      = dict()
+_engines_lock = threading.Lock()
+
+
+def _getEngine(directory):
+    _engines_lock.acquire()
+    try:
+        engine = _engines.get(directory)
+        if engine is None:
+            engine = _engines[directory] = _LogEngine(directory)
+        return engine
+    finally:
+        _engines_lock.release()
+
+
+class LogStorage(BaseStorage):
+    """
+    Implementation of the base storage methods on top of append-only segment files.
+
+    """
+    def __init__(self, storage_location, unique_prefix=""):
+        """
+        The unique prefix is used to create a namespace in the storage location.
+
+        @param storage_location:  Directory in which the segments are stored.
+        @type storage_location:   string
+
+        @param unique_prefix:     Namespace for the files of this storage object.
+        @type unique_prefix:      string
+
+        """
+        self.storage_location = storage_location
+        self.unique_prefix    = unique_prefix
+        if unique_prefix:
+            directory = os.path.join(storage_location, urllib.quote(str(unique_prefix), safe=""))
+        else:
+            directory = storage_location
+        self.engine = _getEngine(directory)
+
+    def __key(self, file_name):
+        if type(file_name) is unicode:
+            return file_name.encode("utf-8")
+        return file_name
+
+    def loadFile(self, file_name):
+        """
+        Load the specified file from storage.
+
+        @param file_name:    Name of the selected file.
+        @type file_name:     string
+
+        @return              Buffer containing the file contents.
+        @rtype               string
+
+        """
+        return self.engine.get(self.__key(file_name))
+
+    def openFile(self, file_name):
+        """
+        Open the specified file for streaming its contents.
+
+        @param file_name:    Name of the selected file.
+        @type file_name:     string
+
+        @return              Body from which the file contents can be read.
+        @rtype               StreamedBody
+
+        """
+        # Imported here, since glu.core depends on the storage classes
+        from glu.core.util import StreamedBody
+        f, length = self.engine.open(self.__key(file_name))
+        return StreamedBody(f, length)
+
+    def storeFile(self, file_name, data):
+        """
+        Store the specified file in storage.
+
+        @param file_name:    Name of the file.
+        @type file_name:     string
+
+        @param data:         Buffer containing the file contents.
+        @type data:          string
+
+        """
+        self.engine.append(self.__key(file_name), data)
+
+    def appendFile(self, file_name, data):
+        """
+        Append data to the specified file.
+
+        The file is created if it does not exist yet. Only a record with
+        the new data is written, the current value is not read.
+
+        @param file_name:    Name of the file.
+        @type file_name:     string
+
+        @param data:         Buffer containing the data to append.
+        @type data:          string
+
+        """
+        self.engine.append(self.__key(file_name), data, extend=True)
+
+    def deleteFile(self, file_name):
+        """
+        Delete the specified file from storage.
+
+        @param file_name:    Name of the selected file.
+        @type file_name:     string
+
+        """
+        key = self.__key(file_name)
+        self.engine.lock.acquire()
+        try:
+            if self.engine.version(key) is None:
+                raise GluFileNotFound(file_name)
+            self.engine.append(key, None)
+        finally:
+            self.engine.lock.release()
+
+    def renameFile(self, old_name, new_name):
+        """
+        Give a stored file a new name.
+
+        A file with the new name is replaced.
+
+        @param old_name:     Current name of the file.
+        @type old_name:      string
+
+        @param new_name:     New name of the file.
+        @type new_name:      string
+
+        """
+        old_key = self.__key(old_name)
+        self.engine.lock.acquire()
+        try:
+            self.engine.append(self.__key(new_name), self.engine.get(old_key))
+            self.engine.append(old_key, None)
+        finally:
+            self.engine.lock.release()
+
+    def getFileVersion(self, file_name):
+        """
+        Return a cheap validator for the current version of a file.
+
+        @param file_name:    Name of the selected file.
+        @type file_name:     string
+
+        @return              Locations of the extents of the current value
+                             or None if the file does not exist.
+        @rtype               tuple
+
+        """
+        return self.engine.version(self.__key(file_name))
+
+    def syncFiles(self, file_names):
+        """
+        Make sure that the specified files have been written to disk.
+
+        All files of a namespace share the active segment, so this
+        syncs every write to the namespace.
+
+        @param file_names:       Names of the files.
+        @type file_names:        list
+
+        """
+        self.engine.sync()
+
+    def listFiles(self, prefix=None, limit=None, cursor=None):
+        """
+        Return list of files in the storage.
+
+        @param prefix:           Only names starting with this prefix are returned.
+        @type prefix:            string
+
+        @param limit:            Maximum number of names to return.
+        @type limit:             int
+
+        @param cursor:           Continuation cursor returned with the previous page.
+        @type cursor:            string
+
+        @return:                 List of file names.
+        @rtype:                  FileList
+
+        """
+        # Names starting with '.' are reserved for internal use
+        names = [ name for name in self.engine.keys() if not name.startswith(".") ]
+        return _makeFileList(names, prefix, limit, cursor)
+
+    def compact(self):
+        """
+        Compact the segments of this namespace now.
+
+        """
+        self.engine.compact()
+
+    def getStats(self):
+        """
+        Return the number of keys, segments, and total and dead bytes of this namespace.
+
+        @return:    Dictionary of statistics.
+        @rtype:     dict
+
+        """
+        return self.engine.getStats()
@@ -0,0 +1,404 @@
+"""
+Storage abstraction that keeps all files in a single SQLite database.
+
+All namespaces share one table, keyed by (namespace, name). Lookups
+and listings of a namespace are therefore index lookups and range
+scans, rather than directory operations.
+
+Note that this requires the 'sqlite3' module, which is available
+when running under CPython, but not under Jython.
+
+"""
+# Python imports
+import os
+import urllib
+import sqlite3
+import threading
+
+# Glu imports
+from glu.exceptions                       import *
+from glu.logger                           import *
+from glu.storageabstraction.base_storage  import BaseStorage, FileList
+from glu.storageabstraction.file_storage  import FileStorage, LAYOUT_FLAT, LAYOUT_SHARDED, _MIGRATED_MARKER
+from glu.storageabstraction.dedup_storage import BLOB_NAMESPACE
+
+_SCHEMA = [
+    """CREATE TABLE IF NOT EXISTS files (
+           namespace  TEXT    NOT NULL,
+           name       TEXT    NOT NULL,
+           data       BLOB    NOT NULL,
+           version    INTEGER NOT NULL,
+           PRIMARY KEY (namespace, name)
+       )""",
+    # A single row with a counter, which provides a new version number for
+    # every write. Versions are never reused, even if a file is deleted and
+    # then created again.
+    """CREATE TABLE IF NOT EXISTS generation (
+           counter    INTEGER NOT NULL
+       )""",
+    """INSERT INTO generation (counter)
+           SELECT 0 WHERE NOT EXISTS (SELECT 1 FROM generation)""",
+]
+
+#
+# SQLite connections may not be shared between threads. Each thread
+# therefore gets its own connection per database file.
+#
+_thread_local = threading.local()
+
+
+def _getConnection(db_location):
+    """
+    Return this thread's connection to the specified database.
+
+    A new connection is opened (and the schema created) if necessary.
+
+    @param db_location:   File name of the database.
+    @type db_location:    string
+
+    @return:              The database connection.
+    @rtype:               sqlite3.Connection
+
+    """
+    connections = getattr(_thread_local, "connections", None)
+    if connections is None:
+        connections = _thread_local.connections = dict()
+    conn = connections.get(db_location)
+    if conn is None:
+        conn = sqlite3.connect(db_location, timeout=30)
+        conn.text_factory = str
+        # With a write-ahead log, readers don't block writers and vice versa.
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        for statement in _SCHEMA:
+            conn.execute(statement)
+        conn.commit()
+        connections[db_location] = conn
+    return conn
+
+
+class SqliteStorage(BaseStorage):
+    """
+    Implementation of the base storage methods on top of SQLite.
+
+    """
+    def __init__(self, storage_location, unique_prefix=""):
+        """
+        The unique prefix is used as the namespace within the database.
+
+        @param storage_location:  File name of the database.
+        @type storage_location:   string
+
+        @param unique_prefix:     Namespace for the files of this storage object.
+        @type unique_prefix:      string
+
+        """
+        self.storage_location = storage_location
+        self.unique_prefix    = unique_prefix
+
+    def __connection(self):
+        return _getConnection(self.storage_location)
+
+    def loadFile(self, file_name):
+        """
+        Load the specified file from storage.
+
+        @param file_name:    Name of the selected file.
+        @type file_name:     string
+
+        @return              Buffer containing the file contents.
+        @rtype               string
+
+        """
+        row = self.__connection().execute("SELECT data FROM files WHERE namespace = ? AND name = ?",
+                                          (self.unique_prefix, file_name)).fetchone()
+        if row is None:
+            raise GluFileNotFound("File '%s' could not be found'" % (file_name))
+        return str(row[0])
+
+    def storeFile(self, file_name, data):
+        """
+        Store the specified file in storage.
+
+        @param file_name:    Name of the file.
+        @type file_name:     string
+
+        @param data:         Buffer containing the file contents.
+        @type data:          string
+
+        """
+        conn = self.__connection()
+        try:
+            conn.execute("UPDATE generation SET counter = counter + 1")
+            conn.execute("INSERT OR REPLACE INTO files (namespace, name, data, version) "
+                         "SELECT ?, ?, ?, counter FROM generation",
+                         (self.unique_prefix, file_name, buffer(data)))
+            conn.commit()
+        except Exception, e:
+            conn.rollback()
+            raise GluException("Cannot store file '%s' (%s)" % (file_name, str(e)))
+
+    def appendFile(self, file_name, data):
+        """
+        Append data to the specified file.
+
+        The file is created if it does not exist yet. The data is
+        concatenated within the database, so the existing contents
+        don't need to be loaded.
+
+        @param file_name:    Name of the file.
+        @type file_name:     string
+
+        @param data:         Buffer containing the data to append.
+        @type data:          string
+
+        """
+        conn = self.__connection()
+        try:
+            conn.execute("UPDATE generation SET counter = counter + 1")
+            cursor = conn.execute("UPDATE files SET data = CAST(data || ? AS BLOB), "
+                                  "version = (SELECT counter FROM generation) "
+                                  "WHERE namespace = ? AND name = ?",
+                                  (buffer(data), self.unique_prefix, file_name))
+            if cursor.rowcount == 0:
+                conn.execute("INSERT INTO files (namespace, name, data, version) "
+                             "SELECT ?, ?, ?, counter FROM generation",
+                             (self.unique_prefix, file_name, buffer(data)))
+            conn.commit()
+        except Exception, e:
+            conn.rollback()
+            raise GluException("Cannot append to file '%s' (%s)" % (file_name, str(e)))
+
+    def deleteFile(self, file_name):
+        """
+        Delete the specified file from storage.
+
+        @param file_name:    Name of the selected file.
+        @type file_name:     string
+
+        """
+        conn = self.__connection()
+        try:
+            cursor = conn.execute("DELETE FROM files WHERE namespace = ? AND name = ?",
+                                  (self.unique_prefix, file_name))
+            conn.commit()
+        except Exception, e:
+            conn.rollback()
+            raise GluException("Cannot delete file '%s' (%s)" % (file_name, str(e)))
+        if cursor.rowcount == 0:
+            raise GluFileNotFound(file_name)
+
+    def renameFile(self, old_name, new_name):
+        """
+        Give a stored file a new name.
+
+        A file with the new name is replaced.
+
+        @param old_name:     Current name of the file.
+        @type old_name:      string
+
+        @param new_name:     New name of the file.
+        @type new_name:      string
+
+        """
+        conn = self.__connection()
+        try:
+            conn.execute("UPDATE generation SET counter = counter + 1")
+            conn.execute("DELETE FROM files WHERE namespace = ? AND name = ?",
+                         (self.unique_prefix, new_name))
+            cursor = conn.execute("UPDATE files SET name = ?, version = (SELECT counter FROM generation) "
+                                  "WHERE namespace = ? AND name = ?",
+                                  (new_name, self.unique_prefix, old_name))
+            if cursor.rowcount == 0:
+                conn.rollback()
+                raise GluFileNotFound(old_name)
+            conn.commit()
+        except GluException:
+            raise
+        except Exception, e:
+            conn.rollback()
+            raise GluException("Cannot rename file '%s' (%s)" % (old_name, str(e)))
+
+    def getFileVersion(self, file_name):
+        """
+        Return a cheap validator for the current version of a file.
+
+        @param file_name:    Name of the selected file.
+        @type file_name:     string
+
+        @return              Version number of the file or None if the
+                             file does not exist.
+        @rtype               int
+
+        """
+        row = self.__connection().execute("SELECT version FROM files WHERE namespace = ? AND name = ?",
+                                          (self.unique_prefix, file_name)).fetchone()
+        if row is None:
+            return None
+        return row[0]
+
+    def listFiles(self, prefix=None, limit=None, cursor=None):
+        """
+        Return list of files in the storage, ordered by name.
+
+        Prefix, cursor and limit are all applied as range conditions on the
+        primary key, so a page costs the same no matter how many files the
+        namespace holds.
+
+        @param prefix:           Only names starting with this prefix are returned.
+        @type prefix:            string
+
+        @param limit:            Maximum number of names to return.
+        @type limit:             int
+
+        @param cursor:           Continuation cursor returned with the previous page.
+        @type cursor:            string
+
+        @return:                 List of file names.
+        @rtype:                  FileList
+
+        """
+        # Names starting with '.' are reserved for internal use
+        query = "SELECT name FROM files WHERE namespace = ? AND substr(name, 1, 1) != '.'"
+        args  = [ self.unique_prefix ]
+        if prefix:
+            # Everything that starts with the prefix sorts between the prefix
+            # itself and the prefix with its last character incremented.
+            if type(prefix) is str:
+                prefix = prefix.decode("utf-8")
+            query += " AND name >= ? AND name < ?"
+            args  += [ prefix, prefix[:-1] + unichr(ord(prefix[-1]) + 1) ]
+        if cursor:
+            query += " AND name > ?"
+            args.append(cursor)
+        query += " ORDER BY name"
+        if limit is not None:
+            # Fetching one more than requested tells us whether there is another page
+            query += " LIMIT %d" % (limit + 1)
+        try:
+            names = [ row[0] for row in self.__connection().execute(query, args) ]
+        except Exception, e:
+            raise GluException("Problems getting file list from storage: " + str(e))
+        if limit is not None  and  len(names) > limit:
+            names = names[:limit]
+            return FileList(names, names[-1])
+        return FileList(names)
+
+
+def _fileStorageNamespaces(data_location, namespaces):
+    """
+    Find the files of each namespace in a FileStorage directory.
+
+    The directory may hold files in the flat layout as well as namespace
+    directories of the sharded layout (for example, while it is being
+    migrated). Reserved files (names starting with '.', such as expiry
+    journals) are included, only lock files and temporary files are not.
+
+    @param data_location:      Directory of the stored data.
+    @type data_location:       string
+
+    @param namespaces:         Names of the namespaces, to which the files of the flat
+                               layout can belong.
+    @type namespaces:          list
+
+    @return:                   Tuple of a list of (namespace, FileStorage, file names)
+                               tuples and a list of files that don't belong to any
+                               of the namespaces.
+    @rtype:                    tuple
+
+    """
+    # Longest names first, so that a namespace 'foo__bar' takes precedence over 'foo'
+    prefixes = [ name + "__" for name in namespaces ]
+    prefixes.sort(lambda x, y: cmp(len(y), len(x)))
+
+    flat_files = dict()
+    found      = list()
+    unknown    = list()
+    for file_name in os.listdir(data_location):
+        full_name = os.path.join(data_location, file_name)
+        if file_name.startswith(".lock-")  or  file_name.startswith(".tmp-"):
+            continue
+        if os.path.isdir(full_name):
+            if not os.path.exists(os.path.join(full_name, _MIGRATED_MARKER)):
+                raise GluException("Namespace directory '%s' was not completely moved to the sharded "
+                                   "layout. Access it with the sharded layout before migrating." % full_name)
+            namespace = urllib.unquote(file_name)
+            storage   = FileStorage(data_location, unique_prefix=namespace, layout=LAYOUT_SHARDED)
+            names     = list(storage.listFiles())
+            names    += [ name for name in os.listdir(full_name)
+                                   if name.startswith(".")  and  name != _MIGRATED_MARKER  and
+                                      not name.startswith(".lock-")  and  not name.startswith(".tmp-")  and
+                                      os.path.isfile(os.path.join(full_name, name)) ]
+            found.append((namespace, storage, names))
+            continue
+        for prefix in prefixes:
+            if file_name.startswith(prefix):
+                flat_files.setdefault(prefix[:-2], list()).append(file_name[len(prefix):])
+                break
+        else:
+            unknown.append(full_name)
+    for namespace, names in flat_files.items():
+        found.append((namespace, FileStorage(data_location, unique_prefix=namespace, layout=LAYOUT_FLAT), names))
+    return found, unknown
+
+def migrateFromFileStorage(resource_location, data_location, db_location):
+    """
+    Copy the contents of an existing FileStorage tree into a SQLite database.
+
+    Both layouts of FileStorage are supported. Resource definitions are
+    copied from the resource directory. In the flat layout, files in the
+    data directory are named '<namespace>__<file-name>'. We assign them to
+    the namespace of the longest matching resource name (or to the blobs of
+    the deduplicating storage mode, which are copied as well). Files that
+    don't belong to any known namespace are skipped and reported. Reserved
+    files, such as expiry journals, are copied along with the other files.
+
+    Everything is copied in a single transaction. The files are left in
+    place.
+
+    @param resource_location:  Directory of the resource definitions (usually 'resourceDB').
+    @type resource_location:   string
+
+    @param data_location:      Directory of the stored data (usually 'storageDB').
+    @type data_location:       string
+
+    @param db_location:        File name of the database.
+    @type db_location:         string
+
+    @return:                   Tuple with the number of copied resources,
+                               copied data files and skipped data files.
+    @rtype:                    tuple
+
+    @raise GluException:       If the migration fails. Nothing is copied then.
+
+    """
+    if os.path.exists(os.path.join(resource_location, _MIGRATED_MARKER)):
+        resource_storage = FileStorage(resource_location, layout=LAYOUT_SHARDED)
+    else:
+        resource_storage = FileStorage(resource_location, layout=LAYOUT_FLAT)
+    resource_names = list(resource_storage.listFiles())
+
+    conn = _getConnection(db_location)
+    try:
+        namespaces, unknown = _fileStorageNamespaces(data_location, resource_names + [ BLOB_NAMESPACE ])
+        conn.execute("UPDATE generation SET counter = counter + 1")
+        version = conn.execute("SELECT counter FROM generation").fetchone()[0]
+        for name in resource_names:
+            conn.execute("INSERT OR REPLACE INTO files (namespace, name, data, version) VALUES (?, ?, ?, ?)",
+                         ("", name, buffer(resource_storage.loadFile(name)), version))
+        data_count = 0
+        for namespace, storage, names in namespaces:
+            for name in names:
+                conn.execute("INSERT OR REPLACE INTO files (namespace, name, data, version) VALUES (?, ?, ?, ?)",
+                             (namespace, name, buffer(storage.loadFile(name)), version))
+                data_count += 1
+        for full_name in unknown:
+            log("Skipping file '%s', which does not belong to any resource" % full_name)
+        conn.commit()
+    except Exception, e:
+        conn.rollback()
+        raise GluException("Migration to '%s' failed: %s" % (db_location, str(e)))
+
+    # The resource index is not copied, since it is easily rebuilt.
+    SqliteStorage(db_location).rebuildResourceIndex()
+    return len(resource_names), data_count, len(unknown)
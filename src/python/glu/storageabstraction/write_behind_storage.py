@@ -0,0 +1,610 @@
+"""
+Storage abstraction that acknowledges writes before they reach the storage.
+
+Stores, appends and deletes are put into a bounded in-memory queue and
+return right away. A background thread per namespace writes the queued
+changes to the underlying storage in batches. Writes that arrive while
+a batch is written are collected into the next batch, so that a busy
+namespace needs only one sync per batch, rather than one per write.
+
+Reads see the queued changes. Listings, renames and large stores first
+wait until the queue has been written. Appends to reserved files (names
+starting with '.', such as the expiry journal) are not queued either.
+
+Durability: A write that was acknowledged, but not yet written, is lost
+if the process dies. Call flush() (or use the 'flush' service of the
+StorageComponent) to wait until all writes so far have been written and,
+if syncing is enabled, have reached the disk.
+
+A change that cannot be written is put back into the queue (unless it
+was replaced by a newer change in the meantime), so that reads still see
+it, and is tried again after STORAGE_WRITE_BEHIND_RETRY_DELAY seconds, or
+right away when the queue is flushed. flush() reports the number of
+changes that failed in the last batch.
+
+"""
+# Python imports
+import time
+import atexit
+import threading
+
+# Glu imports
+import glu.settings as settings
+
+from glu.exceptions                      import *
+from glu.logger                          import *
+from glu.storageabstraction.base_storage import BaseStorage
+
+_OP_STORE  = "store"
+_OP_APPEND = "append"
+_OP_DELETE = "delete"
+
+
+def _applyOps(ops, buf):
+    """
+    Return the contents of a file after applying queued changes.
+
+    @param ops:     List of (operation, data) tuples, oldest first.
+    @type ops:      list
+
+    @param buf:     Contents before the changes, None if the file does not exist.
+    @type buf:      string
+
+    @return:        The new contents, None if the file was deleted.
+    @rtype:         string
+
+    """
+    for op, data in ops:
+        if op == _OP_STORE:
+            buf = data
+        elif op == _OP_DELETE:
+            buf = None
+        else:
+            buf = (buf or "") + data
+    return buf
+
+
+def _combine(old, new):
+    """
+    Return the single change that has the effect of two changes to a file.
+
+    @param old:     The older change, (operation, data) tuple or None.
+    @type old:      tuple
+
+    @param new:     The newer change, (operation, data) tuple.
+    @type new:      tuple
+
+    @return:        The combined change.
+    @rtype:         tuple
+
+    """
+    if new[0] != _OP_APPEND  or  not old:
+        return new
+    if old[0] == _OP_DELETE:
+        return (_OP_STORE, new[1])
+    return (old[0], old[1] + new[1])
+
+
+class _WriteQueue(object):
+    """
+    The queued changes of one namespace and the thread that writes them.
+
+    Only the latest change per file is queued: A store or delete replaces
+    whatever was queued for the file before, and appends are combined.
+
+    Changes are moved from 'pending' to 'in_flight' while their batch is
+    written. New changes are never combined with those in flight, since
+    those may already be partially written.
+
+    """
+    def __init__(self, storage, sync):
+        self.storage         = storage
+        self.sync            = sync
+        self.cond            = threading.Condition(threading.Lock())
+        # Held while a batch is written, so that readers can wait for a consistent state
+        self.io_lock         = threading.Lock()
+        self.pending         = dict()     # file name -> (operation, data)
+        self.in_flight       = dict()
+        self.pending_bytes   = 0
+        self.queued          = 0          # Number of changes queued so far
+        self.written         = 0          # Number of changes written so far, without failures
+        self.flush_requested = 0
+        self.started         = 0          # Number of batches started so far
+        self.batches         = 0          # Number of batches written so far
+        self.failed          = 0          # Number of changes that failed in the last batch
+        self.closed          = False
+        self.thread          = threading.Thread(target=self.__run)
+        self.thread.setDaemon(True)
+        self.thread.start()
+
+    def __size(self, entry):
+        if entry and entry[1]:
+            return len(entry[1])
+        return 0
+
+    def put(self, file_name, op, data=None):
+        """
+        Queue a change, waiting for room in the queue if necessary.
+
+        """
+        self.cond.acquire()
+        try:
+            while (self.pending  or  self.in_flight)  and  \
+                  (len(self.pending) + len(self.in_flight) >= settings.STORAGE_WRITE_BEHIND_MAX_PENDING  or
+                   self.pending_bytes + len(data or "") > settings.STORAGE_WRITE_BEHIND_MAX_BYTES):
+                self.cond.wait()
+            old = self.pending.get(file_name)
+            new = _combine(old, (op, data))
+            self.pending[file_name] = new
+            self.pending_bytes     += self.__size(new) - self.__size(old)
+            self.queued            += 1
+            self.cond.notifyAll()
+        finally:
+            self.cond.release()
+
+    def getOps(self, file_name):
+        """
+        Return the queued changes of a file, oldest first.
+
+        @return:    List of (operation, data) tuples.
+        @rtype:     list
+
+        """
+        self.cond.acquire()
+        try:
+            return [ entry for entry in [ self.in_flight.get(file_name), self.pending.get(file_name) ] if entry ]
+        finally:
+            self.cond.release()
+
+    def flush(self):
+        """
+        Wait until all changes queued so far have been written.
+
+        If some of them cannot be written, we only wait until they
+        have been tried once more, in a batch started after this call.
+
+        @return:    Number of changes that could not be written.
+        @rtype:     int
+
+        """
+        self.cond.acquire()
+        try:
+            target  = self.queued
+            started = self.started
+            batches = self.batches
+            self.flush_requested += 1
+            self.cond.notifyAll()
+            try:
+                while self.written < target  and  (self.batches <= started  or  not self.failed):
+                    self.cond.wait()
+            finally:
+                self.flush_requested -= 1
+            if self.batches == batches:
+                # Nothing was left to write
+                return 0
+            return self.failed
+        finally:
+            self.cond.release()
+
+    def close(self):
+        """
+        Write all queued changes and stop the background thread.
+
+        """
+        self.flush()
+        self.cond.acquire()
+        try:
+            self.closed = True
+            self.cond.notifyAll()
+        finally:
+            self.cond.release()
+        self.thread.join()
+
+    def getStats(self):
+        self.cond.acquire()
+        try:
+            return dict(pending       = len(self.pending) + len(self.in_flight),
+                        pending_bytes = self.pending_bytes,
+                        written       = self.written,
+                        batches       = self.batches)
+        finally:
+            self.cond.release()
+
+    def __apply(self, file_name, op, data):
+        if op == _OP_STORE:
+            self.storage.storeFile(file_name, data)
+        elif op == _OP_APPEND:
+            self.storage.appendFile(file_name, data)
+        else:
+            try:
+                self.storage.deleteFile(file_name)
+            except GluFileNotFound:
+                pass
+
+    def __run(self):
+        while True:
+            self.cond.acquire()
+            try:
+                while not self.pending  and  not self.closed:
+                    self.cond.wait()
+                if self.closed:
+                    return
+                flush_requested = self.flush_requested
+            finally:
+                self.cond.release()
+            if not flush_requested:
+                # Give other writers the chance to join this batch
+                time.sleep(settings.STORAGE_WRITE_BEHIND_DELAY)
+
+            self.io_lock.acquire()
+            try:
+                self.cond.acquire()
+                try:
+                    self.in_flight, self.pending = self.pending, dict()
+                    upto          = self.queued
+                    self.started += 1
+                finally:
+                    self.cond.release()
+
+                errors = 0
+                failed = dict()
+                for file_name, (op, data) in self.in_flight.items():
+                    try:
+                        self.__apply(file_name, op, data)
+                    except Exception, e:
+                        log("Write-behind of '%s' failed, will retry: %s" % (file_name, str(e)))
+                        failed[file_name] = (op, data)
+                        errors += 1
+                if self.sync:
+                    try:
+                        self.storage.syncFiles(self.in_flight.keys())
+                    except Exception, e:
+                        # The changes were written, so they are not tried again
+                        log("Sync of write-behind batch failed: %s" % str(e))
+                        errors += len(self.in_flight)
+
+                self.cond.acquire()
+                try:
+                    self.pending_bytes -= sum([ self.__size(entry) for entry in self.in_flight.values() ])
+                    for file_name, entry in failed.items():
+                        # Queue the failed change again, in front of any newer change
+                        newer = self.pending.get(file_name)
+                        if newer:
+                            entry = _combine(entry, newer)
+                        self.pending[file_name] = entry
+                        self.pending_bytes     += self.__size(entry) - self.__size(newer)
+                    self.in_flight      = dict()
+                    if not failed:
+                        self.written    = upto
+                    self.batches       += 1
+                    self.failed         = errors
+                    self.cond.notifyAll()
+                finally:
+                    self.cond.release()
+            finally:
+                self.io_lock.release()
+            if failed:
+                # Wait before trying again, unless the queue is flushed
+                self.cond.acquire()
+                try:
+                    retry_time = time.time() + settings.STORAGE_WRITE_BEHIND_RETRY_DELAY
+                    while not self.flush_requested  and  not self.closed  and  time.time() < retry_time:
+                        self.cond.wait(retry_time - time.time())
+                finally:
+                    self.cond.release()
+
+
+#
+# One queue per namespace, shared by all storage objects for that namespace.
+#
+_queues      = dict()
+_queues_lock = threading.Lock()
+
+
+def _closeAll():
+    """
+    Write all queued changes. Called when the process exits.
+
+    """
+    for queue in _queues.values():
+        queue.close()
+
+atexit.register(_closeAll)
+
+
+class WriteBehindStorage(BaseStorage):
+    """
+    Queues the writes to another storage object.
+
+    """
+    def __init__(self, storage, queue_name, sync=False):
+        """
+        Initialize the write-behind storage.
+
+        @param storage:      Storage to which the changes are written.
+        @type storage:       BaseStorage
+
+        @param queue_name:   Unique name of the namespace. All storage objects
+                             for the same namespace need to use the same name,
+                             so that they share the queue.
+        @type queue_name:    string
+
+        @param sync:         Sync each batch to disk after writing it.
+        @type sync:          boolean
+
+        """
+        self.storage = storage
+        _queues_lock.acquire()
+        try:
+            queue = _queues.get(queue_name)
+            if queue is None:
+                queue = _queues[queue_name] = _WriteQueue(storage, sync)
+            queue.sync = sync
+        finally:
+            _queues_lock.release()
+        self.queue = queue
+
+    def __current(self, file_name):
+        """
+        Return the contents of a file with its queued changes applied.
+
+        @return:    Tuple of a flag, which indicates whether there are queued
+                    changes, and the contents (None if the file was deleted).
+        @rtype:     tuple
+
+        """
+        ops = self.queue.getOps(file_name)
+        if not ops:
+            return False, None
+        if [ op for op, data in ops if op != _OP_APPEND ]:
+            return True, _applyOps(ops, None)
+        # Only appends are queued, so we need the stored contents. They must
+        # not change between reading them and looking at the queue again.
+        self.queue.io_lock.acquire()
+        try:
+            ops = self.queue.getOps(file_name)
+            try:
+                buf = self.storage.loadFile(file_name)
+            except GluFileNotFound:
+                buf = None
+            return True, _applyOps(ops, buf)
+        finally:
+            self.queue.io_lock.release()
+
+    def loadFile(self, file_name):
+        """
+        Load the specified file from storage.
+
+        @param file_name:    Name of the selected file.
+        @type file_name:     string
+
+        @return              Buffer containing the file contents.
+        @rtype               string
+
+        """
+        queued, buf = self.__current(file_name)
+        if not queued:
+            return self.storage.loadFile(file_name)
+        if buf is None:
+            raise GluFileNotFound("File '%s' could not be found'" % file_name)
+        return buf
+
+    def openFile(self, file_name):
+        """
+        Open the specified file for streaming its contents.
+
+        @param file_name:    Name of the selected file.
+        @type file_name:     string
+
+        @return              Body from which the file contents can be read.
+        @rtype               StreamedBody
+
+        """
+        if self.queue.getOps(file_name):
+            # Queued contents are in memory anyway
+            return BaseStorage.openFile(self, file_name)
+        return self.storage.openFile(file_name)
+
+    def storeFile(self, file_name, data):
+        """
+        Queue the specified file for storing.
+
+        @param file_name:    Name of the file.
+        @type file_name:     string
+
+        @param data:         Buffer containing the file contents.
+        @type data:          string
+
+        """
+        self.queue.put(file_name, _OP_STORE, data)
+
+    def storeStream(self, file_name, stream):
+        """
+        Store the contents of a file-like object in storage.
+
+        Small items are queued. Larger items (more than
+        settings.STORAGE_WRITE_BEHIND_MAX_ITEM bytes) are written
+        directly, after the queue has been written.
+
+        @param file_name:    Name of the file.
+        @type file_name:     string
+
+        @param stream:       Object from which the file contents are read.
+        @type stream:        file-like object
+
+        """
+        head = stream.read(settings.STORAGE_WRITE_BEHIND_MAX_ITEM + 1)
+        if len(head) <= settings.STORAGE_WRITE_BEHIND_MAX_ITEM:
+            self.storeFile(file_name, head)
+        else:
+            self.queue.flush()
+            self.storage.storeStream(file_name, _PrefixedStream(head, stream))
+
+    def appendFile(self, file_name, data):
+        """
+        Queue data to be appended to the specified file.
+
+        Reserved files are appended to while holding a lock that other
+        processes use as well (see BaseStorage._getLock()). Their data is
+        written right away, so that it is written while the lock is held.
+
+        @param file_name:    Name of the file.
+        @type file_name:     string
+
+        @param data:         Buffer containing the data to append.
+        @type data:          string
+
+        """
+        if file_name.startswith("."):
+            if self.queue.getOps(file_name):
+                # Keep the order of the changes to the file
+                self.queue.flush()
+            self.storage.appendFile(file_name, data)
+        else:
+            self.queue.put(file_name, _OP_APPEND, data)
+
+    def deleteFile(self, file_name):
+        """
+        Queue the specified file for deletion.
+
+        @param file_name:    Name of the selected file.
+        @type file_name:     string
+
+        """
+        if self.getFileVersion(file_name) is None:
+            raise GluFileNotFound(file_name)
+        self.queue.put(file_name, _OP_DELETE)
+
+    def renameFile(self, old_name, new_name):
+        """
+        Give a stored file a new name, after the queue has been written.
+
+        @param old_name:     Current name of the file.
+        @type old_name:      string
+
+        @param new_name:     New name of the file.
+        @type new_name:      string
+
+        """
+        self.queue.flush()
+        self.storage.renameFile(old_name, new_name)
+
+    def _getLock(self, lock_name):
+        """
+        Return the lock of the underlying storage for the given name.
+
+        @param lock_name:    Name of the lock.
+        @type lock_name:     string
+
+        @return:             The lock.
+        @rtype:              object with acquire() and release()
+
+        """
+        return self.storage._getLock(lock_name)
+
+    def getFileVersion(self, file_name):
+        """
+        Return a cheap validator for the current version of a file.
+
+        @param file_name:    Name of the selected file.
+        @type file_name:     string
+
+        @return              Validator or None if the file does not exist.
+        @rtype               object
+
+        """
+        ops = self.queue.getOps(file_name)
+        if not ops:
+            return self.storage.getFileVersion(file_name)
+        if ops[-1][0] == _OP_DELETE:
+            return None
+        # Any queued change is newer than what is stored
+        return ("queued", self.queue.queued)
+
+    def getFileModificationTime(self, file_name):
+        """
+        Return the time at which a file was last written.
+
+        @param file_name:    Name of the selected file.
+        @type file_name:     string
+
+        @return              Seconds since the epoch or None if not known
+                             (also while changes to the file are queued).
+        @rtype               float
+
+        """
+        if self.queue.getOps(file_name):
+            return None
+        return self.storage.getFileModificationTime(file_name)
+
+    def listFiles(self, prefix=None, limit=None, cursor=None):
+        """
+        Return list of files in the storage, after the queue has been written.
+
+        @param prefix:           Only names starting with this prefix are returned.
+        @type prefix:            string
+
+        @param limit:            Maximum number of names to return.
+        @type limit:             int
+
+        @param cursor:           Continuation cursor returned with the previous page.
+        @type cursor:            string
+
+        @return:                 List of file names.
+        @rtype:                  FileList
+
+        """
+        self.queue.flush()
+        return self.storage.listFiles(prefix=prefix, limit=limit, cursor=cursor)
+
+    def syncFiles(self, file_names):
+        """
+        Write the queue and make sure the specified files have reached the disk.
+
+        @param file_names:       Names of the files.
+        @type file_names:        list
+
+        """
+        self.queue.flush()
+        self.storage.syncFiles(file_names)
+
+    def flush(self):
+        """
+        Wait until all changes queued so far have been written.
+
+        @return:    Number of changes that could not be written. They
+                    stay queued. Details are in the log.
+        @rtype:     int
+
+        """
+        return self.queue.flush()
+
+    def getStats(self):
+        """
+        Return the state of the queue.
+
+        @return:    Dictionary with the number of pending changes and bytes,
+                    the number of changes written and batches.
+        @rtype:     dict
+
+        """
+        return self.queue.getStats()
+
+
+class _PrefixedStream(object):
+    """
+    File-like object, which returns a buffer and then the rest of a stream.
+
+    """
+    def __init__(self, head, stream):
+        self.head   = head
+        self.stream = stream
+
+    def read(self, size=-1):
+        if not self.head:
+            return self.stream.read(size)
+        if size < 0:
+            data, self.head = self.head + self.stream.read(), ""
+        else:
+            data, self.head = self.head[:size], self.head[size:]
+        return data
@@ -0,0 +1,32 @@
+"""
+Copy an existing file based Glu storage into a SQLite database.
+
+Usage:
+
+    % python src/python/glu_migrate_to_sqlite.py [<resource-dir> <data-dir> <database>]
+
+The defaults are 'resourceDB', 'storageDB' and 'gluDB.sqlite', which
+match the locations in glu/platform_specifics.py. SQLite requires
+CPython, so PLATFORM has to be PLATFORM_PYTHON. After the migration,
+set STORAGE = STORAGE_SQLITE in glu/platform_specifics.py.
+
+"""
+import sys
+
+# Glu imports
+import glu.platform_specifics   # Needs to be imported before the storage modules
+from glu.storageabstraction.sqlite_storage import migrateFromFileStorage
+
+
+if __name__ == '__main__':
+    if len(sys.argv) == 4:
+        resource_location, data_location, db_location = sys.argv[1:]
+    elif len(sys.argv) == 1:
+        resource_location, data_location, db_location = "resourceDB", "storageDB", "gluDB.sqlite"
+    else:
+        print __doc__
+        sys.exit(1)
+    resource_count, data_count, skipped = migrateFromFileStorage(resource_location, data_location, db_location)
+    print "Migrated %d resources and %d data files into '%s' (%d files skipped)." % \
+                                        (resource_count, data_count, db_location, skipped)
+
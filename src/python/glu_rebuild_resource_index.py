@@ -0,0 +1,18 @@
+"""
+Rebuild the index of public resource summaries.
+
+The index is normally kept up to date by the server whenever a resource
+is created or deleted. Run this if the index was lost or corrupted, or
+after resource definitions were copied into the resource storage by hand:
+
+    % jython src/python/glu_rebuild_resource_index.py
+
+"""
+# Glu imports
+from glu.platform_specifics import STORAGE_OBJECT
+
+
+if __name__ == '__main__':
+    summaries, names = STORAGE_OBJECT.rebuildResourceIndex()
+    print "Resource index rebuilt with %d resources." % len(names)
+
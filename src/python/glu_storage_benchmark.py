@@ -0,0 +1,73 @@
+"""
+Compare the storage classes on a mixed read/write workload.
+
+Usage:
+
+    % python src/python/glu_storage_benchmark.py [<operations> [<keys> [<value-size> [<write-percent>]]]]
+
+The defaults are 20000 operations on 1000 keys, with values of 512 bytes
+and 50% writes. Each storage class works in its own temporary directory,
+which is removed afterwards. The keys are first stored once, then the
+operations are run on randomly selected keys.
+
+"""
+import sys
+import time
+import random
+import shutil
+import tempfile
+
+# Glu imports
+import glu.platform_specifics   # Needs to be imported before the storage modules
+from glu.storageabstraction.file_storage import FileStorage
+from glu.storageabstraction.log_storage  import LogStorage
+
+
+def run(storage, operations, keys, value_size, write_percent):
+    """
+    Run the workload against a storage object.
+
+    @return:    Tuple with the seconds taken for the initial load and for the mixed operations.
+    @rtype:     tuple
+
+    """
+    names  = [ "key-%06d" % i for i in xrange(keys) ]
+    value  = "x" * value_size
+    # Same sequence of operations for every storage class
+    rand   = random.Random(42)
+
+    start = time.time()
+    for name in names:
+        storage.storeFile(name, value)
+    load_time = time.time() - start
+
+    start = time.time()
+    for i in xrange(operations):
+        name = rand.choice(names)
+        if rand.randint(1, 100) <= write_percent:
+            storage.storeFile(name, value)
+        else:
+            storage.loadFile(name)
+    return load_time, time.time() - start
+
+
+if __name__ == '__main__':
+    try:
+        args = [ int(arg) for arg in sys.argv[1:] ]
+    except ValueError:
+        args = None
+    if args is None  or  len(args) > 4:
+        print __doc__
+        sys.exit(1)
+    operations, keys, value_size, write_percent = args + [ 20000, 1000, 512, 50 ][len(args):]
+
+    print "%d operations on %d keys, %d byte values, %d%% writes" % (operations, keys, value_size, write_percent)
+    for name, storage_class in [ ("FileStorage", FileStorage), ("LogStorage", LogStorage) ]:
+        location = tempfile.mkdtemp(prefix="glu-benchmark-")
+        try:
+            load_time, mixed_time = run(storage_class(location, unique_prefix="benchmark"),
+                                        operations, keys, value_size, write_percent)
+        finally:
+            shutil.rmtree(location)
+        print "%-12s  load: %7.3fs  mixed: %7.3fs  (%8.0f ops/s)" % \
+                        (name, load_time, mixed_time, operations / max(mixed_time, 0.000001))
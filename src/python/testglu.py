@@ -6,6 +6,7 @@ import types
 import string
 import urllib
 import datetime
+import threading
 
 from glu.core.parameter import *
 
@@ -379,10 +380,315 @@ def test_70_positional_params():
     assert(cdef == '"This is a buffer"')
     assert(resp.getStatus() == 200)
 
+    # Retrieve the raw content of the file: The stored bytes (the JSON string we sent)
+    resp = http.urlopen("GET", SERVER_URL + "/resource/_test_foobarstorage/files/foo", headers={"Accept" : "application/octet-stream"})
+    assert(resp.read() == '"This is a buffer"')
+    assert(resp.getStatus() == 200)
+
     # Delete the file again
     buf, resp = _delete("/resource/_test_foobarstorage/files/foo")
     assert(resp.getStatus() == 200)
 
+def test_71_storage_append():
+    """
+    Test that data can be appended to a stored item.
+
+    """
+    d = {
+            "resource_creation_params" : { "suggested_name" : "_test_appendstorage" }
+        }
+    data, resp = _send_data("/code/StorageComponent", d)
+    assert(resp.getStatus() == 201)
+
+    # Store an item and append to it, with PUT and with POST
+    resp = http.urlopen("PUT", SERVER_URL + "/resource/_test_appendstorage/files/log", data="Line 1\n")
+    resp.read()
+    assert(resp.getStatus() == 200)
+    for method in [ "PUT", "POST" ]:
+        resp = http.urlopen(method, SERVER_URL + "/resource/_test_appendstorage/files/log?append=true",
+                            headers={"Accept" : "application/json"}, data="%s line\n" % method)
+        assert(json.loads(resp.read()) == "Successfully appended")
+        assert(resp.getStatus() == 200)
+    resp = http.urlopen("GET", SERVER_URL + "/resource/_test_appendstorage/files/log", headers={"Accept" : "application/octet-stream"})
+    assert(resp.read() == "Line 1\nPUT line\nPOST line\n")
+
+    # Appending to an item that does not exist yet creates it
+    resp = http.urlopen("POST", SERVER_URL + "/resource/_test_appendstorage/files/new?append=true", data="First")
+    resp.read()
+    assert(resp.getStatus() == 200)
+    resp = http.urlopen("GET", SERVER_URL + "/resource/_test_appendstorage/files/new", headers={"Accept" : "application/octet-stream"})
+    assert(resp.read() == "First")
+
+def test_72_storage_names():
+    """
+    Test that items have the same name in the files and uploads services.
+
+    """
+    d = {
+            "resource_creation_params" : { "suggested_name" : "_test_namestorage" }
+        }
+    data, resp = _send_data("/code/StorageComponent", d)
+    assert(resp.getStatus() == 201)
+
+    # Upload an item with a space in its name, in a single part
+    data, resp = _send_data("/resource/_test_namestorage/uploads?name=my%20item", "")
+    assert(resp.getStatus() == 201)
+    upload_uri = data['upload']
+    data, resp = _send_data(upload_uri + "/1", "Uploaded")
+    assert(resp.getStatus() == 200)
+    data, resp = _send_data(upload_uri + "?commit=true", "")
+    assert(resp.getStatus() == 200)
+
+    # It is found under the same name in the files service, by path or by query
+    data, resp = _get_data("/resource/_test_namestorage/files/my%20item")
+    assert(resp.getStatus() == 200)
+    assert(data == '"Uploaded"')
+    data, resp = _get_data("/resource/_test_namestorage/files?name=my%20item")
+    assert(resp.getStatus() == 200)
+    assert(data == '"Uploaded"')
+
+    # The listing contains a URI that leads back to it
+    data, resp = _get_data("/resource/_test_namestorage/files")
+    assert(data == [ "/resource/_test_namestorage/files/my%20item" ])
+
+    # Reserved names can't be accessed
+    data, resp = _send_data("/resource/_test_namestorage/files/.upload.foo", "x")
+    assert(resp.getStatus() == 400)
+    data, resp = _get_data("/resource/_test_namestorage/files?name=.expiry")
+    assert(resp.getStatus() == 400)
+
+def test_73_storage_ttl():
+    """
+    Test that items that have expired are no longer listed or read.
+
+    """
+    d = {
+            "resource_creation_params" : { "suggested_name" : "_test_ttlstorage" }
+        }
+    data, resp = _send_data("/code/StorageComponent", d)
+    assert(resp.getStatus() == 201)
+
+    data, resp = _send_data("/resource/_test_ttlstorage/files/short?ttl=1", "Short")
+    assert(resp.getStatus() == 200)
+    data, resp = _send_data("/resource/_test_ttlstorage/files/long", "Long")
+    assert(resp.getStatus() == 200)
+    data, resp = _get_data("/resource/_test_ttlstorage/files/short")
+    assert(resp.getStatus() == 200)
+    assert(data == '"Short"')
+
+    time.sleep(1.5)
+    data, resp = _get_data("/resource/_test_ttlstorage/files/short")
+    assert(resp.getStatus() == 404)
+    data, resp = _get_data("/resource/_test_ttlstorage/files")
+    assert(data == [ "/resource/_test_ttlstorage/files/long" ])
+
+def test_75_resource_paging():
+    """
+    Test that the list of resources can be retrieved page by page.
+
+    """
+    all_resources, resp = _get_data("/resource")
+    assert(resp.getStatus() == 200)
+
+    # Walk through the list one resource at a time
+    seen = dict()
+    url  = "/resource?limit=1"
+    while url:
+        page, resp = _get_data(url)
+        assert(resp.getStatus() == 200)
+        assert(len(page['resources']) <= 1)
+        seen.update(page['resources'])
+        url = page.get('next')
+    assert(len(seen) == len(all_resources))
+    for name in all_resources:
+        assert(name in seen)
+
+    data, resp = _get_data("/resource?limit=0")
+    assert(resp.getStatus() == 400)
+
+def test_76_storage_changes_wait():
+    """
+    Test that a write wakes up a request that waits for changes.
+
+    """
+    d = {
+            "resource_creation_params" : { "suggested_name" : "_test_waitstorage" }
+        }
+    data, resp = _send_data("/code/StorageComponent", d)
+    assert(resp.getStatus() == 201)
+    data, resp = _get_data("/resource/_test_waitstorage/changes")
+    assert(resp.getStatus() == 200)
+    cursor = data['cursor']
+
+    # The server has to answer the write while the other request waits
+    result = dict()
+    def wait_for_change():
+        result['data'], resp = _get_data("/resource/_test_waitstorage/changes?since=%s&wait=10" % \
+                                         urllib.quote(cursor, safe=""))
+        result['time'] = time.time()
+    waiter = threading.Thread(target=wait_for_change)
+    waiter.start()
+    time.sleep(0.5)
+    start = time.time()
+    data, resp = _send_data("/resource/_test_waitstorage/files/foo", "Changed")
+    assert(resp.getStatus() == 200)
+    waiter.join(10)
+    assert(not waiter.isAlive())
+    assert(result['time'] - start < 5)
+    assert([ change['uri'] for change in result['data']['changes'] ] == [ "/resource/_test_waitstorage/files/foo" ])
+
+def test_77_storage_conditional_get():
+    """
+    Test that an item which was not changed is not sent again.
+
+    """
+    d = {
+            "resource_creation_params" : { "suggested_name" : "_test_etagstorage" }
+        }
+    data, resp = _send_data("/code/StorageComponent", d)
+    assert(resp.getStatus() == 201)
+    resp = http.urlopen("PUT", SERVER_URL + "/resource/_test_etagstorage/files/foo", data="Version 1")
+    resp.read()
+    assert(resp.getStatus() == 200)
+
+    # The item is returned with its entity tag
+    url  = SERVER_URL + "/resource/_test_etagstorage/files/foo"
+    resp = http.urlopen("GET", url, headers={"Accept" : "application/octet-stream"})
+    assert(resp.read() == "Version 1")
+    assert(resp.getStatus() == 200)
+    etag = resp.getHeaders()['etag']
+    assert(etag)
+
+    # Sending it back gets a 304 without content, for either representation
+    for accept in [ "application/octet-stream", "application/json" ]:
+        resp = http.urlopen("GET", url, headers={"Accept" : accept, "If-None-Match" : etag})
+        assert(resp.read() == "")
+        assert(resp.getStatus() == 304)
+
+    # After a change the item is sent again, with a new entity tag
+    resp = http.urlopen("PUT", url, data="Version 2")
+    resp.read()
+    resp = http.urlopen("GET", url, headers={"Accept" : "application/octet-stream", "If-None-Match" : etag})
+    assert(resp.read() == "Version 2")
+    assert(resp.getStatus() == 200)
+    assert(resp.getHeaders()['etag'] != etag)
+
+def test_78_service_cache():
+    """
+    Test that results of services with a 'cache' are reused.
+
+    The 'count' service returns the number of calls, and its results are cached for a second.
+
+    """
+    d = {
+            "resource_creation_params" : { "suggested_name" : "_test_counter" }
+        }
+    data, resp = _send_data("/code/CounterComponent", d)
+    assert(resp.getStatus() == 201)
+
+    # Hit
+    url = "/resource/_test_counter/count?name=cache"
+    first, resp = _get_data(url)
+    assert(resp.getStatus() == 200)
+    assert(first == { "name" : "cache", "count" : 1 })
+    data, resp = _get_data(url)
+    assert(data == first)
+    data, resp = _get_data("/resource/_test_counter/count?name=other")
+    assert(data == { "name" : "other", "count" : 1 })
+
+    # Any other method than GET removes the cached results
+    data, resp = _send_data(url, {})
+    assert(resp.getStatus() == 200)
+    second, resp = _get_data(url)
+    assert(second != first)
+
+    # Stale hit: The outdated result is returned, while it is refreshed
+    time.sleep(1.2)
+    data, resp = _get_data(url)
+    assert(data == second)
+    time.sleep(0.5)
+    third, resp = _get_data(url)
+    assert(third != second)
+    data, resp = _get_data(url)
+    assert(data == third)
+
+def test_79_coalesced_calls():
+    """
+    Test that only services which opt in have their identical calls coalesced.
+
+    """
+    # The files and archive services of the storage component are not coalesced
+    d = {
+            "resource_creation_params" : { "suggested_name" : "_test_flightstorage" }
+        }
+    data, resp = _send_data("/code/StorageComponent", d)
+    assert(resp.getStatus() == 201)
+    data, resp = _send_data("/resource/_test_flightstorage/files/foo", "Foo")
+    assert(resp.getStatus() == 200)
+    before, resp = _get_data("/meta/stats")
+    data, resp = _get_data("/resource/_test_flightstorage/files/foo")
+    assert(resp.getStatus() == 200)
+    resp = http.urlopen("GET", SERVER_URL + "/resource/_test_flightstorage/archive")
+    resp.read()
+    assert(resp.getStatus() == 200)
+    after, resp = _get_data("/meta/stats")
+    assert(after['service_calls']['executions'] == before['service_calls']['executions'])
+
+    # Neither are services that don't declare it
+    data, resp = _send_data("/code/GpsWalkerComponent", { "resource_creation_params" : { "suggested_name" : "_test_flightwalker" } })
+    assert(resp.getStatus() == 201)
+    data, resp = _get_data("/resource/_test_flightwalker/city?name=London")
+    assert(resp.getStatus() == 200)
+    after, resp = _get_data("/meta/stats")
+    assert(after['service_calls']['executions'] == before['service_calls']['executions'])
+
+    # The counter component declares it
+    data, resp = _send_data("/code/CounterComponent", { "resource_creation_params" : { "suggested_name" : "_test_flightcounter" } })
+    assert(resp.getStatus() == 201)
+    data, resp = _get_data("/resource/_test_flightcounter/count?name=flight")
+    assert(resp.getStatus() == 200)
+    after, resp = _get_data("/meta/stats")
+    assert(after['service_calls']['executions'] == before['service_calls']['executions'] + 1)
+
+def test_80_storage_range():
+    """
+    Test that a part of the raw content of an item can be requested.
+
+    """
+    d = {
+            "resource_creation_params" : { "suggested_name" : "_test_rangestorage" }
+        }
+    data, resp = _send_data("/code/StorageComponent", d)
+    assert(resp.getStatus() == 201)
+    url  = SERVER_URL + "/resource/_test_rangestorage/files/foo"
+    resp = http.urlopen("PUT", url, data="0123456789")
+    resp.read()
+    assert(resp.getStatus() == 200)
+
+    # Explicit, open and suffix ranges
+    for spec, part in [ ("2-5", "2345"), ("7-", "789"), ("-3", "789"), ("8-20", "89") ]:
+        resp = http.urlopen("GET", url, headers={"Accept" : "application/octet-stream", "Range" : "bytes=" + spec})
+        assert(resp.read() == part)
+        assert(resp.getStatus() == 206)
+    assert(resp.getHeaders()['content-range'] == "bytes 8-9/10")
+
+    # A range beyond the end of the item can't be satisfied
+    resp = http.urlopen("GET", url, headers={"Accept" : "application/octet-stream", "Range" : "bytes=10-"})
+    resp.read()
+    assert(resp.getStatus() == 416)
+    assert(resp.getHeaders()['content-range'] == "bytes */10")
+
+    # With If-Range, only a part of the same version is sent, otherwise all of it
+    resp = http.urlopen("GET", url, headers={"Accept" : "application/octet-stream"})
+    resp.read()
+    etag = resp.getHeaders()['etag']
+    resp = http.urlopen("GET", url, headers={"Accept" : "application/octet-stream", "Range" : "bytes=0-1", "If-Range" : etag})
+    assert(resp.read() == "01")
+    assert(resp.getStatus() == 206)
+    resp = http.urlopen("GET", url, headers={"Accept" : "application/octet-stream", "Range" : "bytes=0-1", "If-Range" : '"other"'})
+    assert(resp.read() == "0123456789")
+    assert(resp.getStatus() == 200)
+
 def test_999_cleanup():
     """
     Find all resources starting with "_test_" and delete them.
@@ -0,0 +1,611 @@
+"""
+Tests of the storage abstraction, which don't need a running server.
+
+The storage classes are used directly, on temporary directories.
+
+"""
+import os
+import sys
+import time
+import string
+import shutil
+import hashlib
+import StringIO
+import datetime
+import tempfile
+import threading
+
+import glu.platform_specifics   # Needs to be imported before the storage modules
+import glu.settings as settings
+
+from glu.exceptions import *
+
+from glu.storageabstraction.file_storage         import FileStorage, LAYOUT_FLAT, LAYOUT_SHARDED
+from glu.storageabstraction.file_storage         import _COMPRESSED_MAGIC
+from glu.storageabstraction.dedup_storage        import DedupStorage, BLOB_NAMESPACE
+from glu.storageabstraction.sqlite_storage       import SqliteStorage, migrateFromFileStorage
+from glu.storageabstraction.log_storage          import LogStorage
+from glu.storageabstraction.write_behind_storage import WriteBehindStorage
+from glu.storageabstraction.caching_storage      import CachingStorage
+from glu.storageabstraction.expiring_storage     import ExpiringStorage
+from glu.resources.single_flight                 import coalesced, getSingleFlightStats
+
+import glu.storageabstraction.log_storage          as log_storage
+import glu.storageabstraction.expiring_storage     as expiring_storage
+import glu.storageabstraction.write_behind_storage as write_behind_storage
+
+
+def _resource_def(name):
+    """
+    Return a minimal resource definition, as it is kept in storage.
+
+    """
+    return {
+                "public"  : { "uri" : "/resource/%s" % name, "desc" : "A resource", "services" : {} },
+                "private" : { "code_uri" : "/code/StorageComponent", "params" : {} }
+           }
+
+
+def test_10_sqlite_storage():
+    """
+    Test the file operations of the SQLite storage.
+
+    """
+    tmp_dir = tempfile.mkdtemp()
+    try:
+        storage = SqliteStorage(os.path.join(tmp_dir, "test.sqlite"), unique_prefix="foo")
+        other   = SqliteStorage(os.path.join(tmp_dir, "test.sqlite"), unique_prefix="bar")
+
+        storage.storeFile("a", "Data")
+        version = storage.getFileVersion("a")
+        assert(storage.loadFile("a") == "Data")
+        storage.appendFile("a", " more")
+        assert(storage.loadFile("a") == "Data more")
+        assert(storage.getFileVersion("a") != version)
+
+        # Namespaces are separate
+        assert(other.getFileVersion("a") is None)
+        try:
+            other.loadFile("a")
+            assert(False)
+        except GluFileNotFound:
+            pass
+
+        storage.renameFile("a", "b")
+        assert(storage.getFileVersion("a") is None)
+        assert(storage.loadFile("b") == "Data more")
+
+        # Listing page by page, reserved names are not listed
+        for name in [ "c", "d", "e", ".reserved" ]:
+            storage.storeFile(name, name)
+        page = storage.listFiles(limit=2)
+        assert(list(page) == [ "b", "c" ])
+        page = storage.listFiles(limit=2, cursor=page.next_cursor)
+        assert(list(page) == [ "d", "e" ])
+        assert(list(storage.listFiles(prefix="d")) == [ "d" ])
+
+        storage.deleteFile("b")
+        try:
+            storage.deleteFile("b")
+            assert(False)
+        except GluFileNotFound:
+            pass
+    finally:
+        shutil.rmtree(tmp_dir, True)
+
+def test_12_sqlite_migration():
+    """
+    Test that everything in a file storage tree is copied into the database.
+
+    The data directory holds a namespace in the flat layout, with its reserved
+    files and items stored in the deduplicating mode, and one in the sharded layout.
+
+    """
+    tmp_dir = tempfile.mkdtemp()
+    try:
+        resource_dir = os.path.join(tmp_dir, "resourceDB")
+        data_dir     = os.path.join(tmp_dir, "storageDB")
+        db_location  = os.path.join(tmp_dir, "gluDB.sqlite")
+        os.makedirs(resource_dir)
+        os.makedirs(data_dir)
+
+        resources = FileStorage(resource_dir, layout=LAYOUT_FLAT)
+        for name in [ "flat", "sharded" ]:
+            resources.writeResourceToStorage(name, _resource_def(name))
+
+        flat = FileStorage(data_dir, unique_prefix="flat", layout=LAYOUT_FLAT)
+        flat.storeFile("item", "Flat item")
+        flat.storeFile(".expiry", "0.000 item\n")
+        dedup = DedupStorage(flat, FileStorage(data_dir, unique_prefix=BLOB_NAMESPACE, layout=LAYOUT_FLAT))
+        dedup.storeFile("shared1", "Same contents")
+        dedup.storeFile("shared2", "Same contents")
+        sharded = FileStorage(data_dir, unique_prefix="sharded", layout=LAYOUT_SHARDED)
+        sharded.storeFile("item", "Sharded item")
+        sharded.storeFile(".expiry", "")
+        open(os.path.join(data_dir, "stray"), "w").close()
+
+        resource_count, data_count, skipped = migrateFromFileStorage(resource_dir, data_dir, db_location)
+        assert(resource_count == 2)
+        assert(skipped == 1)
+
+        db_resources = SqliteStorage(db_location)
+        assert(db_resources.loadResourceFromStorage("sharded") == _resource_def("sharded"))
+        summaries, next_cursor = db_resources.listResourceSummaries()
+        assert([ name for name, summary in summaries ] == [ "flat", "sharded" ])
+
+        db_flat = SqliteStorage(db_location, unique_prefix="flat")
+        assert(db_flat.loadFile("item") == "Flat item")
+        assert(db_flat.loadFile(".expiry") == "0.000 item\n")
+        db_dedup = DedupStorage(db_flat, SqliteStorage(db_location, unique_prefix=BLOB_NAMESPACE))
+        assert(db_dedup.loadFile("shared1") == "Same contents")
+        assert(db_dedup.loadFile("shared2") == "Same contents")
+
+        db_sharded = SqliteStorage(db_location, unique_prefix="sharded")
+        assert(db_sharded.loadFile("item") == "Sharded item")
+        assert(db_sharded.getFileVersion(".expiry") is not None)
+
+        # The files are left in place
+        assert(flat.loadFile("item") == "Flat item")
+    finally:
+        shutil.rmtree(tmp_dir, True)
+
+def test_20_sharded_layout():
+    """
+    Test the sharded layout of FileStorage and the move of flat files into it.
+
+    """
+    tmp_dir = tempfile.mkdtemp()
+    try:
+        flat  = FileStorage(tmp_dir, unique_prefix="ns", layout=LAYOUT_FLAT)
+        other = FileStorage(tmp_dir, unique_prefix="other", layout=LAYOUT_FLAT)
+        names = [ "item %d" % i for i in range(20) ]
+        for name in names:
+            flat.storeFile(name, name)
+        flat.storeFile(".expiry", "0.000 item\n")
+        other.storeFile("item", "Other")
+
+        # The files of the namespace are moved when it is first used with the sharded layout
+        sharded = FileStorage(tmp_dir, unique_prefix="ns", layout=LAYOUT_SHARDED)
+        namespace_dir = os.path.join(tmp_dir, "ns")
+        for name in names:
+            assert(sharded.loadFile(name) == name)
+            assert(not os.path.exists(os.path.join(tmp_dir, "ns__" + name)))
+        assert(sharded.loadFile(".expiry") == "0.000 item\n")
+        assert(os.path.exists(os.path.join(namespace_dir, ".expiry")))
+        shards = [ name for name in os.listdir(namespace_dir) if not name.startswith(".") ]
+        assert(len(shards) > 1)
+        for shard in shards:
+            assert(len(shard) == settings.FILE_STORAGE_SHARD_DIGITS)
+        assert(os.path.exists(os.path.join(namespace_dir, shards[0], os.listdir(os.path.join(namespace_dir, shards[0]))[0])))
+
+        # Other namespaces stay where they are
+        assert(other.loadFile("item") == "Other")
+
+        # Names are listed shard by shard, page by page, each of them exactly once
+        names.sort()
+        listed = list()
+        cursor = None
+        while True:
+            page = sharded.listFiles(limit=7, cursor=cursor)
+            assert(len(page) <= 7)
+            listed.extend(page)
+            cursor = page.next_cursor
+            if cursor is None:
+                break
+        listed.sort()
+        assert(listed == names)
+        prefixed = list(sharded.listFiles(prefix="item 1"))
+        prefixed.sort()
+        assert(prefixed == [ name for name in names if name.startswith("item 1") ])
+
+        # New and renamed files end up in their shard directories
+        sharded.storeFile("new/item", "New")
+        sharded.renameFile("new/item", "renamed")
+        assert(sharded.loadFile("renamed") == "New")
+        try:
+            sharded.loadFile("new/item")
+            assert(False)
+        except GluFileNotFound:
+            pass
+    finally:
+        shutil.rmtree(tmp_dir, True)
+
+def test_30_compression():
+    """
+    Test that FileStorage compresses large files transparently.
+
+    """
+    tmp_dir = tempfile.mkdtemp()
+    try:
+        storage = FileStorage(tmp_dir, unique_prefix="ns", layout=LAYOUT_FLAT, compress_threshold=100)
+        big     = "All work and no play makes Jack a dull boy. " * 1000
+
+        # Small files are stored as they are, large ones compressed
+        storage.storeFile("small", "Small")
+        assert(open(os.path.join(tmp_dir, "ns__small"), "rb").read() == "Small")
+        storage.storeFile("big", big)
+        on_disk = open(os.path.join(tmp_dir, "ns__big"), "rb").read()
+        assert(on_disk.startswith(_COMPRESSED_MAGIC))
+        assert(len(on_disk) < len(big) / 10)
+        assert(storage.loadFile("big") == big)
+        body = storage.openFile("big")
+        assert(len(body) == len(big))
+        assert(body.read() == big)
+
+        # Streams are compressed on the fly
+        storage.storeStream("streamed", StringIO.StringIO(big))
+        assert(open(os.path.join(tmp_dir, "ns__streamed"), "rb").read().startswith(_COMPRESSED_MAGIC))
+        assert(storage.loadFile("streamed") == big)
+
+        # Data that looks like a compressed file is not mistaken for one
+        fake = _COMPRESSED_MAGIC + "Not compressed"
+        storage.storeFile("fake", fake)
+        assert(storage.loadFile("fake") == fake)
+        assert(storage.openFile("fake").read() == fake)
+
+        # Appending to a compressed file
+        storage.appendFile("big", "The end.")
+        assert(storage.loadFile("big") == big + "The end.")
+        storage.appendFile("big", " Really.")
+        assert(storage.loadFile("big") == big + "The end. Really.")
+        assert(storage.openFile("big").read() == big + "The end. Really.")
+    finally:
+        shutil.rmtree(tmp_dir, True)
+
+def test_40_dedup_refcounts():
+    """
+    Test that DedupStorage keeps each blob once and releases it when it is not used anymore.
+
+    """
+    tmp_dir = tempfile.mkdtemp()
+    try:
+        blobs = FileStorage(tmp_dir, unique_prefix=BLOB_NAMESPACE, layout=LAYOUT_FLAT)
+        one   = DedupStorage(FileStorage(tmp_dir, unique_prefix="one", layout=LAYOUT_FLAT), blobs)
+        two   = DedupStorage(FileStorage(tmp_dir, unique_prefix="two", layout=LAYOUT_FLAT), blobs)
+        same  = hashlib.sha1("Same").hexdigest()
+        other = hashlib.sha1("Other").hexdigest()
+
+        def refs(blob_hash):
+            if blobs.getFileVersion(blob_hash) is None:
+                assert(blobs.getFileVersion(blob_hash + ".refs") is None)
+                return 0
+            return int(blobs.loadFile(blob_hash + ".refs"))
+
+        # Identical contents, also from other namespaces and streams, share their blob
+        one.storeFile("a", "Same")
+        one.storeFile("b", "Same")
+        two.storeStream("c", StringIO.StringIO("Same"))
+        assert(refs(same) == 3)
+        assert(two.loadFile("c") == "Same")
+        assert(two.openFile("c").read() == "Same")
+        assert([ name for name in os.listdir(tmp_dir) if name.startswith(BLOB_NAMESPACE) and not name.endswith(".refs") ] ==
+               [ "%s__%s" % (BLOB_NAMESPACE, same) ])
+
+        # Storing the same contents under the same name again changes nothing
+        one.storeFile("a", "Same")
+        assert(refs(same) == 3)
+
+        # Overwriting, deleting and renaming over a file release its blob
+        one.storeFile("a", "Other")
+        assert(refs(same) == 2)
+        assert(refs(other) == 1)
+        one.deleteFile("b")
+        assert(refs(same) == 1)
+        two.renameFile("c", "d")
+        assert(refs(same) == 1)
+        two.storeFile("e", "Other")
+        assert(refs(other) == 2)
+        two.renameFile("d", "e")
+        assert(refs(same) == 1)
+        assert(refs(other) == 1)
+        assert(two.loadFile("e") == "Same")
+
+        # Appending stores the new contents as a new blob
+        two.appendFile("e", " and more")
+        assert(refs(same) == 0)
+        assert(two.loadFile("e") == "Same and more")
+
+        # A reader follows the pointer again, if the file is overwritten after
+        # the pointer was read and its blob is gone
+        load_blob = blobs.loadFile
+        def overwriting_load(name):
+            blobs.loadFile = load_blob
+            one.storeFile("a", "New")
+            return load_blob(name)
+        blobs.loadFile = overwriting_load
+        try:
+            assert(one.loadFile("a") == "New")
+        finally:
+            blobs.loadFile = load_blob
+        assert(refs(other) == 0)
+
+        one.deleteFile("a")
+        two.deleteFile("e")
+        assert([ name for name in os.listdir(tmp_dir) if name.startswith(BLOB_NAMESPACE) ] == [])
+    finally:
+        shutil.rmtree(tmp_dir, True)
+
+def test_50_log_storage():
+    """
+    Test appending, compaction and recovery of LogStorage.
+
+    """
+    tmp_dir       = tempfile.mkdtemp()
+    segment_size  = settings.LOG_STORAGE_SEGMENT_SIZE
+    compact_ratio = settings.LOG_STORAGE_COMPACT_RATIO
+    try:
+        # Small segments, and no compaction in the background
+        settings.LOG_STORAGE_SEGMENT_SIZE  = 200
+        settings.LOG_STORAGE_COMPACT_RATIO = 2
+        storage   = LogStorage(tmp_dir, unique_prefix="ns")
+        directory = os.path.join(tmp_dir, "ns")
+
+        def reopen():
+            # Forget the namespace, so that it is recovered from the segments
+            log_storage._engines.clear()
+            return LogStorage(tmp_dir, unique_prefix="ns")
+
+        # Appending only writes the new data
+        storage.storeFile("log", "Line 1\n")
+        version = storage.getFileVersion("log")
+        size    = storage.getStats()['bytes']
+        storage.appendFile("log", "Line 2\n")
+        assert(storage.getStats()['bytes'] - size < 50)
+        assert(storage.getFileVersion("log") != version)
+        assert(storage.loadFile("log") == "Line 1\nLine 2\n")
+        storage.appendFile("new", "First")
+        assert(storage.loadFile("new") == "First")
+
+        # Overwrite and append to spread the data over several segments
+        for i in range(20):
+            storage.storeFile("item", "Value %d" % i)
+            storage.appendFile("log", "Line %d\n" % (i + 3))
+        storage.storeFile("gone", "Gone")
+        storage.deleteFile("gone")
+        expected = "".join([ "Line %d\n" % i for i in range(1, 23) ])
+        assert(storage.loadFile("log") == expected)
+        body = storage.openFile("log")
+        assert(len(body) == len(expected))
+        assert(body.read() == expected)
+        stats = storage.getStats()
+        assert(stats['segments'] > 2)
+        assert(stats['dead_bytes'] > 0)
+
+        # Compaction keeps the live values, appended ones in a single extent
+        body = storage.openFile("log")
+        storage.compact()
+        assert(body.read() == expected)
+        stats = storage.getStats()
+        assert(stats['segments'] == 2)
+        assert(storage.loadFile("log") == expected)
+        assert(len(storage.getFileVersion("log")) <= 2)
+        assert(storage.loadFile("item") == "Value 19")
+        storage.appendFile("log", "More\n")
+        expected += "More\n"
+
+        # Recovery, also of a record that was only partially written
+        storage = reopen()
+        assert(storage.loadFile("log") == expected)
+        assert(storage.loadFile("item") == "Value 19")
+        assert(storage.loadFile("new") == "First")
+        assert(storage.getFileVersion("gone") is None)
+        assert(storage.getStats()['keys'] == 3)
+        storage.appendFile("log", "Last\n")
+        segments = [ name for name in os.listdir(directory) if name.endswith(".log") ]
+        segments.sort()
+        f = open(os.path.join(directory, segments[-1]), "r+b")
+        f.seek(-3, 2)
+        f.truncate()
+        f.close()
+        storage = reopen()
+        assert(storage.loadFile("log") == expected)
+        storage.appendFile("log", "Last\n")
+        assert(reopen().loadFile("log") == expected + "Last\n")
+    finally:
+        settings.LOG_STORAGE_SEGMENT_SIZE  = segment_size
+        settings.LOG_STORAGE_COMPACT_RATIO = compact_ratio
+        log_storage._engines.clear()
+        shutil.rmtree(tmp_dir, True)
+
+def test_55_write_behind_retry():
+    """
+    Test that writes which fail in the background stay queued and are tried again.
+
+    """
+    tmp_dir     = tempfile.mkdtemp()
+    retry_delay = settings.STORAGE_WRITE_BEHIND_RETRY_DELAY
+    try:
+        settings.STORAGE_WRITE_BEHIND_RETRY_DELAY = 60
+        storage = FileStorage(tmp_dir, unique_prefix="ns", layout=LAYOUT_FLAT)
+        queued  = WriteBehindStorage(storage, tmp_dir + "/ns")
+
+        failing    = [ True ]
+        store_file = storage.storeFile
+        def failing_store(name, data):
+            if failing[0]:
+                raise IOError("Disk full")
+            store_file(name, data)
+        storage.storeFile = failing_store
+
+        # The failed write is reported and can still be read
+        queued.storeFile("a", "One")
+        assert(queued.flush() == 1)
+        assert(storage.getFileVersion("a") is None)
+        assert(queued.loadFile("a") == "One")
+
+        # Newer appends are added to it, and flushing tries again right away
+        queued.appendFile("a", " two")
+        assert(queued.loadFile("a") == "One two")
+        assert(queued.flush() == 1)
+        failing[0] = False
+        assert(queued.flush() == 0)
+        assert(storage.loadFile("a") == "One two")
+        assert(queued.getStats()['pending'] == 0)
+
+        # A failed write, which is replaced by a newer one, is not tried again
+        failing[0] = True
+        queued.storeFile("b", "Old")
+        assert(queued.flush() == 1)
+        queued.deleteFile("b")
+        failing[0] = False
+        assert(queued.flush() == 0)
+        assert(storage.getFileVersion("b") is None)
+        assert(queued.getFileVersion("b") is None)
+    finally:
+        settings.STORAGE_WRITE_BEHIND_RETRY_DELAY = retry_delay
+        write_behind_storage._queues.pop(tmp_dir + "/ns").close()
+        shutil.rmtree(tmp_dir, True)
+
+def test_60_cache_deleted_file():
+    """
+    Test that the storage cache does not serve files deleted by another process.
+
+    """
+    tmp_dir = tempfile.mkdtemp()
+    try:
+        storage = CachingStorage(FileStorage(tmp_dir, unique_prefix="ns"), "_test_cache")
+        storage.storeFile("foo", "Cached")
+        assert(storage.loadFile("foo") == "Cached")
+
+        # Another process (with its own storage object) deletes the file
+        FileStorage(tmp_dir, unique_prefix="ns").deleteFile("foo")
+        for method in [ storage.loadFile, storage.openFile ]:
+            try:
+                method("foo")
+                assert(False)
+            except GluFileNotFound:
+                pass
+    finally:
+        shutil.rmtree(tmp_dir, True)
+
+def test_65_expiry_without_thread():
+    """
+    Test that expired files are deleted by later requests, if there is no sweeper thread.
+
+    """
+    tmp_dir = tempfile.mkdtemp()
+    sweeper = expiring_storage._sweeper
+    try:
+        expiring_storage._sweeper = expiring_storage._Sweeper(threaded=False)
+        storage  = FileStorage(tmp_dir, unique_prefix="ns")
+        expiring = ExpiringStorage(storage, tmp_dir + "/ns", ttl=0.1)
+        expiring.storeFile("short", "Gone soon")
+        time.sleep(0.2)
+        assert(expiring_storage._sweeper.thread is None)
+
+        # Expired, but not deleted yet
+        assert(expiring.getFileVersion("short") is None)
+        assert(storage.loadFile("short") == "Gone soon")
+
+        # The next write deletes it
+        ExpiringStorage(storage, tmp_dir + "/ns").storeFile("long", "Stays")
+        assert(storage.getFileVersion("short") is None)
+        assert(storage.loadFile("long") == "Stays")
+    finally:
+        expiring_storage._sweeper = sweeper
+        expiring_storage._indexes.pop(tmp_dir + "/ns", None)
+        shutil.rmtree(tmp_dir, True)
+
+def test_70_coalesced_calls():
+    """
+    Test that identical service calls running at the same time share one result.
+
+    """
+    calls   = list()
+    release = threading.Event()
+    def slow_call():
+        calls.append(1)
+        count = len(calls)
+        if count == 1:
+            release.wait(10)
+        return 200, count
+
+    results    = list()
+    definition = dict()
+    def request():
+        results.append(coalesced(slow_call, "_test_flight", "count", definition, { "name" : "a" })())
+    before  = getSingleFlightStats()
+    threads = [ threading.Thread(target=request) for i in range(5) ]
+    for thread in threads:
+        thread.start()
+        time.sleep(0.05)
+    release.set()
+    for thread in threads:
+        thread.join(10)
+    assert(len(calls) == 1)
+    assert(results == [ (200, 1) ] * 5)
+    stats = getSingleFlightStats()
+    assert(stats['executions'] == before['executions'] + 1)
+    assert(stats['coalesced']  == before['coalesced'] + 4)
+
+    # Requests stop waiting for a call that takes too long
+    max_wait = settings.SERVICE_COALESCE_MAX_WAIT
+    settings.SERVICE_COALESCE_MAX_WAIT = 0.2
+    try:
+        calls   = list()
+        results = list()
+        release = threading.Event()
+        leader  = threading.Thread(target=request)
+        leader.start()
+        time.sleep(0.05)
+        request()
+        assert(results == [ (200, 2) ])
+        release.set()
+        leader.join(10)
+    finally:
+        settings.SERVICE_COALESCE_MAX_WAIT = max_wait
+
+
+#
+# Some utility methods
+#
+def _log(msg, eol=True, cur_time=None, continuation=False):
+    """
+    Log a message.
+
+    @param msg:          The message to be logged.
+    @type  msg:          string
+
+    @param eol:          Flag indicating whether we put an '\n' at the end.
+    @type  eol:          boolean
+
+    @param continuation: Flag indicating whether this continues a previous line (don't print time stamp).
+    @type  continuation: boolean
+
+    """
+    buf = ""
+    if not continuation:
+        if not cur_time:
+            start_time = datetime.datetime.now()
+        else:
+            start_time = cur_time
+        buf = "### %s - " % start_time.isoformat()
+    buf += msg
+    if eol:
+        buf += "\n"
+    print buf,
+
+
+def _make_timediff_str(start_time, end_time):
+    """
+    Return properly formatted string with difference in start and end time (datetime.datetime object).
+
+    """
+    td = end_time - start_time
+    return "%d.%06d" % (td.seconds, (td.microseconds * 1000000) / 1000000)
+
+
+if __name__ == '__main__':
+    #
+    # Collect the names of all test methods
+    #
+    test_methods = [ name for name in dir() if name.startswith("test_") ]
+    test_methods.sort()
+    for method_name in test_methods:
+        start_time = datetime.datetime.now()
+        _log("Executing: %s" % string.ljust(method_name, 30), cur_time=start_time, eol=False)
+        method = globals()[method_name]
+        method()
+        msg = "Ok"
+        end_time = datetime.datetime.now()
+        _log(" - Duration: %ss - %s" % (_make_timediff_str(start_time, end_time), msg), continuation=True)